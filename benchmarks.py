@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import argparse
+import atexit
+import copy
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import sushichef
+from page_archive import PageArchive
+from utils import link_to_text, remove_links
+from zip_writer import ReproducibleZipWriter, CompressionStats
+
+
+BASELINE_PATH = os.path.join(sushichef.DATA_DIR, "benchmarks", "baseline.json")
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "pages")
+TOPIC_CLASSES = [sushichef.LessonTopic, sushichef.BookTopic, sushichef.QuestionTopic]
+# the markup of the listing pages of each topic class, questions first as
+# their rows are ipsDataItem too
+LISTING_MARKUP = [
+    (sushichef.QuestionTopic, "li.cForumQuestion"),
+    (sushichef.BookTopic, "ol.ipsDataList li.ipsDataItem"),
+    (sushichef.LessonTopic, "#elCmsPageWrap article"),
+]
+
+
+def listing_class(soup):
+    """
+    The topic class of a listing page, None for the other pages.
+    """
+    for cls, selector in LISTING_MARKUP:
+        if soup.select_one(selector) is not None:
+            return cls
+    return None
+
+
+def load_pages(archive, limit):
+    """
+    Parses the archived pages and sorts them into listing pages, by topic
+    class, and article pages.
+    """
+    listings = dict((cls.__name__, []) for cls in TOPIC_CLASSES)
+    articles = []
+    for url in sorted(archive.index):
+        soup = sushichef.download(url)
+        if not soup:
+            continue
+        cls = listing_class(soup)
+        if cls is not None:
+            if len(listings[cls.__name__]) < limit:
+                listings[cls.__name__].append((url, soup))
+            continue
+        article = soup.find("article")
+        if article is not None and len(articles) < limit:
+            articles.append((url, article))
+    return listings, articles
+
+
+def fixture_archive(path, fixture_dir=FIXTURE_DIR):
+    """
+    Archives the checked-in pages of fixture_dir, listed by url in its
+    urls.json, in a page archive at path.
+    """
+    archive = PageArchive(path)
+    with open(os.path.join(fixture_dir, "urls.json")) as f:
+        urls = json.load(f)
+    for url, name in sorted(urls.items()):
+        with open(os.path.join(fixture_dir, name), "rb") as f:
+            archive.put(url, f.read())
+    return archive
+
+
+def measure(fn, inputs, repeat, prepare=None):
+    """
+    Calls fn on every input repeat times and returns the seconds per call
+    of each round. prepare builds fresh arguments outside of the timed loop
+    for functions that modify their input.
+    """
+    rounds = []
+    for _ in range(repeat):
+        args = [prepare(value) if prepare else value for value in inputs]
+        start = time.perf_counter()
+        for value in args:
+            fn(value)
+        rounds.append((time.perf_counter() - start) / len(args))
+    return rounds
+
+
+def zip_bytes(content):
+    zipper = ReproducibleZipWriter(None, policy=sushichef.ZIP_POLICY, stats=CompressionStats())
+    zipper.write_index_contents(sushichef.INDEX_TEMPLATE.format(content))
+    for name in ("styles.css", "scripts.js"):
+        path = os.path.join(sushichef.DATA_DIR, name)
+        if os.path.isfile(path):
+            with open(path) as f:
+                zipper.write_contents(name, f.read())
+    return zipper.to_bytes()
+
+
+def benchmarks(listings, articles):
+    """
+    Returns (name, fn, inputs, prepare) for every benchmark with inputs.
+    """
+    html_app = object.__new__(sushichef.HTMLApp)
+    article = object.__new__(sushichef.Article)
+    article_soups = [soup for _, soup in articles]
+    cleaned = [str(html_app.clean(copy.copy(soup))) for soup in article_soups]
+    cases = [
+        ("download", sushichef.download, [url for url, _ in articles], None),
+    ]
+    for cls in TOPIC_CLASSES:
+        cases.append(("{}.listing".format(cls.__name__), lambda soup, cls=cls: cls.listing(None, soup),
+                      [soup for _, soup in listings[cls.__name__]], None))
+    cases.extend([
+        ("HTMLApp.clean", html_app.clean, article_soups, copy.copy),
+        ("link_to_text", link_to_text, article_soups, copy.copy),
+        ("remove_links", remove_links, article_soups, copy.copy),
+        ("Article.video_urls", article.video_urls, article_soups, None),
+        ("HTMLApp.to_local_images", html_app.to_local_images, article_soups, copy.copy),
+        ("zip", zip_bytes, cleaned, None),
+    ])
+    return [case for case in cases if case[2]]
+
+
+def inputs_key(listings, articles):
+    urls = sorted(url for pages in listings.values() for url, _ in pages)
+    urls += sorted(url for url, _ in articles)
+    return hashlib.sha1("\n".join(urls).encode("utf-8")).hexdigest()
+
+
+def run(listings, articles, repeat, only=None):
+    """
+    Times every benchmark and returns its stats by name.
+    """
+    results = {}
+    for name, fn, inputs, prepare in benchmarks(listings, articles):
+        if only is not None and name not in only:
+            continue
+        rounds = measure(fn, inputs, repeat, prepare=prepare)
+        results[name] = dict(min=min(rounds), median=statistics.median(rounds),
+                             mean=statistics.mean(rounds), pages=len(inputs))
+        print("{:<28} min {:>9.3f}ms  median {:>9.3f}ms  ({} pages)".format(
+            name, results[name]["min"] * 1000, results[name]["median"] * 1000, len(inputs)))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every benchmark against the baseline and returns
+    the names slower than baseline * (1 + threshold), compared on the
+    fastest round which is the least noisy.
+    """
+    regressions = []
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print("{:<28} no baseline".format(name))
+            continue
+        change = stats["min"] / before["min"] - 1
+        slower = change > threshold
+        print("{:<28} {:>+7.1%}{}".format(name, change, "  REGRESSION" if slower else ""))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the parse, clean and package code over archived pages")
+    parser.add_argument("--archive", default=os.path.join(sushichef.DATA_DIR, "archive", "pages"),
+                        help="page archive recorded with --archive=1")
+    parser.add_argument("--fixture", action="store_true",
+                        help="time the checked-in pages of tests/fixtures/pages instead of an archive")
+    parser.add_argument("--pages", type=int, default=20, help="pages per benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None, help="comma separated benchmark names")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fail if a benchmark is this much slower than the baseline")
+    args = parser.parse_args(argv)
+
+    if args.fixture:
+        fixture_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, fixture_dir, True)
+        sushichef.ARCHIVE = fixture_archive(os.path.join(fixture_dir, "pages"))
+    else:
+        sushichef.ARCHIVE = PageArchive(args.archive)
+    sushichef.REPLAY = True
+    if not len(sushichef.ARCHIVE):
+        sys.exit("The archive {} is empty, record one with --archive=1".format(args.archive))
+
+    listings, articles = load_pages(sushichef.ARCHIVE, args.pages)
+    only = set(args.only.split(",")) if args.only else None
+    results = run(listings, articles, args.repeat, only=only)
+
+    key = inputs_key(listings, articles)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(inputs=key, python=platform.python_version(), machine=platform.machine(),
+                           results=results), f, indent=1, sort_keys=True)
+        print("Baseline saved in {}".format(args.baseline))
+        return
+
+    if not os.path.isfile(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["inputs"] != key:
+        print("The archived pages changed since the baseline was saved, comparing anyway")
+    regressions = compare(results, baseline["results"], args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
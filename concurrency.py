@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import random
+import threading
+import time
+
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def is_overload(exc):
+    """
+    Timeouts, dropped connections and 5xx answers mean the server is
+    struggling, a 4xx is the caller's problem and doesn't count.
+    """
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class Slot(object):
+    def __init__(self):
+        self.ok = True
+
+    def check(self, response):
+        if response.status_code >= 500 or response.status_code == 429:
+            self.ok = False
+        return response
+
+
+class AdaptiveLimiter(object):
+    """
+    AIMD concurrency limit for outgoing requests. Every window of limit
+    requests with a p90 latency under target_latency and no errors raises the
+    limit by one, an error, a 5xx or a request slower than twice the target
+    multiplies it by decrease (at most once per window).
+    """
+    def __init__(self, initial=2, minimum=1, maximum=16, target_latency=2.0, decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.cond = threading.Condition()
+        self.active = 0
+        self.window = []
+        self.since_decrease = 0
+        self.latencies = deque(maxlen=2000)
+        self.requests = 0
+        self.errors = 0
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = int(self.limit)
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self.cond:
+            while self.active >= int(self.limit):
+                self.cond.wait()
+            self.active += 1
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception as e:
+            slot.ok = not is_overload(e)
+            raise
+        finally:
+            self.record(time.monotonic() - start, slot.ok)
+
+    def record(self, latency, ok):
+        with self.cond:
+            self.active -= 1
+            self.requests += 1
+            self.latencies.append(latency)
+            self.since_decrease += 1
+            if not ok:
+                self.errors += 1
+            if not ok or latency > 2 * self.target_latency:
+                if self.since_decrease >= int(self.limit):
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.decreases += 1
+                    self.since_decrease = 0
+                self.window = []
+            else:
+                self.window.append(latency)
+                if len(self.window) >= int(self.limit):
+                    if percentile(self.window, 90) <= self.target_latency and self.limit < self.maximum:
+                        self.limit = min(self.maximum, self.limit + 1)
+                        self.increases += 1
+                        self.peak_limit = max(self.peak_limit, int(self.limit))
+                    self.window = []
+            self.cond.notify_all()
+
+    def report(self):
+        with self.cond:
+            latencies = list(self.latencies)
+            return ("Concurrency: limit {} (peak {}), {} requests, {} errors, {} increases, {} decreases, "
+                    "latency p50 {:.2f}s p90 {:.2f}s p99 {:.2f}s").format(
+                int(self.limit), self.peak_limit, self.requests, self.errors, self.increases,
+                self.decreases, percentile(latencies, 50), percentile(latencies, 90),
+                percentile(latencies, 99))
+
+
+def simulate(requests_count, workers, spike_every, spike_latency):
+    """
+    Runs fake requests whose latency grows with concurrency and spikes
+    periodically, printing how the limit follows.
+    """
+    limiter = AdaptiveLimiter(maximum=workers, target_latency=0.03)
+    counter = [0]
+    lock = threading.Lock()
+
+    def fake_request(i):
+        with limiter.slot() as slot:
+            with lock:
+                counter[0] += 1
+                spike = (counter[0] // spike_every) % 2 == 1
+            latency = 0.01 * (1 + limiter.active / 4.0) + random.random() * 0.005
+            if spike:
+                latency += spike_latency
+                slot.ok = random.random() > 0.2
+            time.sleep(latency)
+        if i % 50 == 0:
+            print("{:>5} requests, limit {:>2}, spike {}".format(i, int(limiter.limit), spike))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(fake_request, range(requests_count)))
+    print(limiter.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the adaptive limiter with latency spikes")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--spike-every", type=int, default=300)
+    parser.add_argument("--spike-latency", type=float, default=0.1)
+    args = parser.parse_args()
+    simulate(args.requests, args.workers, args.spike_every, args.spike_latency)
@@ -0,0 +1,77 @@
+import threading
+
+
+def split_option(value):
+    if not value:
+        return None
+    return set(part.strip() for part in value.split(",") if part.strip())
+
+
+class CrawlFilter(object):
+    """
+    Restricts a crawl to some categories (english or arabic name), topic
+    URLs, a range of listing pages and items updated since a date
+    (YYYY-MM-DD), and optionally keeps only the first sample items of each
+    topic. Everything is allowed by default.
+    """
+    def __init__(self, categories=None, topics=None, pages=None, since=None, sample=None):
+        self.categories = categories
+        self.topics = topics
+        self.first_page, self.last_page = pages if pages is not None else (1, None)
+        self.since = since
+        self.sample = sample
+        self.lock = threading.Lock()
+        self.sampled = {}
+
+    @classmethod
+    def from_options(cls, options):
+        pages = options.get('--pages', None)
+        if pages is not None:
+            first, _, last = pages.partition("-")
+            pages = (int(first), int(last) if last else int(first))
+        sample = options.get('--sample', None)
+        return cls(categories=split_option(options.get('--categories', None)),
+                   topics=split_option(options.get('--topics', None)),
+                   pages=pages,
+                   since=options.get('--since', None),
+                   sample=int(sample) if sample is not None else None)
+
+    def complete(self):
+        """
+        Whether the crawl sees every item of the channel.
+        """
+        return (self.categories is None and self.topics is None and self.first_page == 1
+                and self.last_page is None and self.since is None and self.sample is None)
+
+    def category_allowed(self, *names):
+        return self.categories is None or any(name in self.categories for name in names)
+
+    def topic_allowed(self, url):
+        return self.topics is None or url in self.topics or url.rstrip("/") in self.topics
+
+    def page_range(self, last_page):
+        if self.last_page is None:
+            return self.first_page, last_page
+        return self.first_page, min(self.last_page, last_page)
+
+    def entry_allowed(self, entry):
+        # entries without a date are kept, the listing may not show one
+        if self.since is None or not entry.get("updated"):
+            return True
+        return entry["updated"][:10] >= self.since
+
+    def take_sample(self, topic_url, entries):
+        """
+        Returns the entries that still fit in the sample of topic_url.
+        """
+        if self.sample is None:
+            return entries
+        with self.lock:
+            taken = self.sampled.get(topic_url, 0)
+            entries = entries[:max(0, self.sample - taken)]
+            self.sampled[topic_url] = taken + len(entries)
+        return entries
+
+    def sample_full(self, topic_url):
+        with self.lock:
+            return self.sample is not None and self.sampled.get(topic_url, 0) >= self.sample
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+
+import sushichef
+from item_registry import ItemRegistry, canonical_url
+import utils
+
+
+LOGGER = logging.getLogger()
+
+JOB_KINDS = ("channel", "topic", "url")
+# finished jobs kept for GET /jobs
+KEPT_JOBS = 200
+
+
+class Job(object):
+    def __init__(self, job_id, kind, url=None):
+        self.id = job_id
+        self.kind = kind
+        self.url = url
+        self.state = "queued"
+        self.error = None
+        self.items = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        seconds = None
+        if self.started is not None:
+            seconds = round((self.finished or time.time()) - self.started, 3)
+        return dict(id=self.id, kind=self.kind, url=self.url, state=self.state,
+                    error=self.error, items=self.items, seconds=seconds)
+
+
+class CrawlDaemon(object):
+    """
+    Keeps the chef warm between crawls: the requests session and its
+    connection pool, the limiter, the video workers, the file index, the
+    css and js, the navigation and the listing entries seen so far. Jobs
+    crawl the whole channel, one topic or one item URL, they run one at a
+    time in the order they were submitted and update the json tree.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.chef = sushichef.HsoubAcademyChef()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.jobs = OrderedDict()
+        self.queue = queue.Queue()
+        self.categories = None
+        self.channel_tree = None
+        # canonical item URL -> (topic URL, listing entry)
+        self.entries = {}
+        self.started = time.time()
+        self.worker = None
+
+    def start(self):
+        self.manifest, self.storage = self.chef.prepare(self.options)
+        self.chef.download_css_js()
+        self.chef.configure(self.options)
+        if utils.file_exists(self.chef.scrape_stage):
+            with open(self.chef.scrape_stage) as f:
+                self.channel_tree = json.load(f)
+        self.load_entries()
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self.worker.join()
+        if sushichef.TRANSCODER is not None:
+            sushichef.TRANSCODER.shutdown()
+        self.chef.finish(self.manifest)
+
+    def load_entries(self):
+        # the items stream of the last crawl knows where each item was listed
+        items_path = os.path.join(sushichef.HsoubAcademyChef.TREES_DATA_DIR,
+                                  sushichef.HsoubAcademyChef.ITEMS_STREAM_TPL)
+        if not os.path.isfile(items_path):
+            return
+        with open(items_path) as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if "entry" in item:
+                    self.remember(item)
+
+    def remember(self, item, job=None):
+        self.entries[canonical_url(item["entry"]["source_id"])] = (item["topic"], item["entry"])
+        if job is not None:
+            job.items += 1
+
+    def submit(self, kind, url=None):
+        """
+        Queues a job, an identical job still waiting in the queue is
+        returned instead of queueing it twice.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError("kind must be one of {}".format(", ".join(JOB_KINDS)))
+        if kind != "channel" and not url:
+            raise ValueError("{} jobs need a url".format(kind))
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == "queued" and job.kind == kind and job.url == url:
+                    return job
+            job = Job(next(self.ids), kind, url)
+            self.jobs[job.id] = job
+            finished = [job_id for job_id, old in self.jobs.items() if old.done.is_set()]
+            for job_id in finished[:max(0, len(finished) - KEPT_JOBS)]:
+                del self.jobs[job_id]
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            job.state = "running"
+            job.started = time.time()
+            LOGGER.info("Job {}: {} {}".format(job.id, job.kind, job.url or ""))
+            try:
+                getattr(self, "run_{}".format(job.kind))(job)
+                job.state = "done"
+            except Exception as e:
+                job.state = "failed"
+                job.error = "{}: {}".format(type(e).__name__, e)
+                LOGGER.info("Job {} failed: {}".format(job.id, job.error))
+            finally:
+                job.finished = time.time()
+                self.manifest.save()
+                sushichef.RETRY_QUEUE.save()
+                job.done.set()
+            LOGGER.info("Job {} {} in {:.1f}s, {} items".format(
+                job.id, job.state, job.finished - job.started, job.items))
+
+    def run_channel(self, job):
+        sushichef.ITEM_REGISTRY = ItemRegistry()
+        # the navigation is fetched again, topics come and go
+        self.categories = list(sushichef.browser_resources())
+        self.chef.stream_items(self.categories, on_item=lambda item: self.remember(item, job))
+        self.write_tree(self.chef.channel_tree(self.categories), complete=sushichef.CRAWL_FILTER.complete())
+        self.chef.log_reports()
+
+    def run_topic(self, job):
+        category, topic = self.find_topic(job.url)
+        sushichef.ITEM_REGISTRY = ItemRegistry()
+        # a fresh topic and category, the cached ones keep the nodes of the last crawl
+        scope = sushichef.Category(category.title, category.source_id)
+        scope.topics.append(type(topic)(topic.title, topic.source_id))
+        self.chef.stream_items([scope], on_item=lambda item: self.remember(item, job))
+        if not scope.tree_nodes:
+            raise ValueError("no items packaged for {}, the tree is unchanged".format(job.url))
+        scope_node = sushichef.resolve_transcodes(scope.to_node())
+        tree = self.channel_tree or self.chef.channel_tree([])
+        category_node = find_child(tree, category.source_id)
+        if category_node is None:
+            tree["children"].append(scope_node)
+        else:
+            replace_child(category_node, scope_node["children"][0])
+        self.write_tree(tree)
+
+    def run_url(self, job):
+        known = self.entries.get(canonical_url(job.url))
+        if known is None:
+            raise ValueError("{} was not seen in a listing yet, run a topic or channel job first".format(job.url))
+        topic_url, entry = known
+        _, topic = self.find_topic(topic_url)
+        sushichef.REFRESH = True
+        try:
+            item = topic.build_queued(entry)
+        finally:
+            sushichef.REFRESH = False
+        node = sushichef.resolve_transcodes(item.to_node()) if item is not None else None
+        if node is None:
+            raise ValueError("nothing packaged for {}, the tree is unchanged".format(job.url))
+        job.items = 1
+        tree = self.channel_tree
+        if tree is None or not replace_item(tree, canonical_url(job.url), node):
+            raise ValueError("{} is not in the tree, run a topic or channel job to add it".format(job.url))
+        self.write_tree(tree)
+
+    def find_topic(self, url):
+        if self.categories is None:
+            self.categories = list(sushichef.browser_resources())
+        key = canonical_url(url)
+        for category in self.categories:
+            for topic in category.topics:
+                if canonical_url(topic.source_id) == key:
+                    return category, topic
+        raise ValueError("{} is not a topic of the navigation".format(url))
+
+    def write_tree(self, tree, complete=False):
+        # topic and url jobs only refresh part of the tree
+        self.channel_tree = tree
+        self.chef.save_tree(tree, self.storage, complete=complete)
+
+    def status(self):
+        index = utils.FILE_INDEX
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+        return dict(
+            uptime=round(time.time() - self.started),
+            jobs=dict((state, states.count(state)) for state in set(states)),
+            known_items=len(self.entries),
+            indexed_files=len(index.files) if index is not None else None,
+            items=sushichef.ITEM_REGISTRY.report(),
+            limiter=sushichef.LIMITER.report(),
+            videos="{} downloaded, {} reused".format(sushichef.VIDEO_STORE.downloads,
+                                                    sushichef.VIDEO_STORE.reused))
+
+
+def find_child(node, source_id):
+    for child in node.get("children", []):
+        if child["source_id"] == source_id:
+            return child
+
+
+def replace_child(node, new_child):
+    for index, child in enumerate(node["children"]):
+        if child["source_id"] == new_child["source_id"]:
+            node["children"][index] = new_child
+            return
+    node["children"].append(new_child)
+
+
+def replace_item(node, key, new_node):
+    """
+    Replaces every node with the canonical source URL key under node, an
+    item listed in several topics is in the tree more than once.
+    """
+    replaced = False
+    children = node.get("children", [])
+    for index, child in enumerate(children):
+        if canonical_url(child["source_id"]) == key:
+            children[index] = new_node
+            replaced = True
+        elif replace_item(child, key, new_node):
+            replaced = True
+    return replaced
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """
+    GET /status, GET /jobs, GET /jobs/<id> and POST /jobs with a json body
+    {"kind": "channel" | "topic" | "url", "url": ..., "wait": false}.
+    """
+    def do_GET(self):
+        crawl_daemon = self.server.crawl_daemon
+        if self.path == "/status":
+            self.reply(200, crawl_daemon.status())
+        elif self.path == "/jobs":
+            with crawl_daemon.lock:
+                jobs = [job.to_dict() for job in crawl_daemon.jobs.values()]
+            self.reply(200, jobs)
+        elif self.path.startswith("/jobs/"):
+            try:
+                job = crawl_daemon.get(int(self.path[len("/jobs/"):]))
+            except ValueError:
+                job = None
+            if job is None:
+                self.reply(404, dict(error="no such job"))
+            else:
+                self.reply(200, job.to_dict())
+        else:
+            self.reply(404, dict(error="not found"))
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.reply(404, dict(error="not found"))
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or "{}")
+            job = self.server.crawl_daemon.submit(body.get("kind"), body.get("url"))
+        except (ValueError, AttributeError) as e:
+            self.reply(400, dict(error=str(e)))
+            return
+        if body.get("wait"):
+            job.done.wait()
+        self.reply(200 if job.done.is_set() else 202, job.to_dict())
+
+    def reply(self, code, data):
+        content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # unix socket clients have no address, the jobs are logged by the daemon
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def chef_options(values):
+    """
+    The chef options given after the daemon's own, as ricecooker parses
+    them: --name=value pairs.
+    """
+    options = {}
+    for value in values:
+        name, _, option = value.partition("=")
+        options[name] = option or "1"
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the chef warm and run channel, topic and url crawl jobs from a local API",
+        epilog="other --name=value arguments are chef options, e.g. --download-video=0")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="listen on this unix socket instead")
+    args, rest = parser.parse_known_args()
+    options = chef_options(rest)
+    # small refreshes shouldn't wait for backoffs, the next job retries them
+    options.setdefault('--retry-wait', "0")
+
+    crawl_daemon = CrawlDaemon(options)
+    crawl_daemon.start()
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, JobHandler)
+        LOGGER.info("Crawl daemon listening on {}".format(args.socket))
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), JobHandler)
+        LOGGER.info("Crawl daemon listening on http://{}:{}/".format(args.host, args.port))
+    server.crawl_daemon = crawl_daemon
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        crawl_daemon.stop()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+from collections import defaultdict
+import fnmatch
+import os
+import threading
+
+
+class FileIndex(object):
+    """
+    In-memory snapshot of the files and directories under root, taken with
+    one scandir walk at startup. Skip decisions consult it instead of
+    stat-ing every path, and the chef registers the files it writes.
+    """
+    IGNORED_SUFFIXES = (".tmp", ".part", ".corrupt")
+
+    def __init__(self, root, manifest=None):
+        self.root = os.path.normpath(root)
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.files = {}
+        self.dirs = set()
+        self.names = defaultdict(set)
+        self.scan()
+
+    def scan(self):
+        if not os.path.isdir(self.root):
+            return
+        self.dirs.add(self.root)
+        stack = [self.root]
+        while stack:
+            dirpath = stack.pop()
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.dirs.add(entry.path)
+                        stack.append(entry.path)
+                    elif not entry.name.endswith(FileIndex.IGNORED_SUFFIXES):
+                        stat = entry.stat()
+                        self.files[entry.path] = (stat.st_size, stat.st_mtime)
+                        self.names[dirpath].add(entry.name)
+
+    def covers(self, path):
+        path = os.path.normpath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def has_file(self, path):
+        with self.lock:
+            return os.path.normpath(path) in self.files
+
+    def has_dir(self, path):
+        with self.lock:
+            return os.path.normpath(path) in self.dirs
+
+    def add_file(self, path, md5=None):
+        """
+        Registers a file written by the chef, md5 is its checksum when it
+        was computed while writing it.
+        """
+        path = os.path.normpath(path)
+        stat = os.stat(path)
+        dirpath, name = os.path.split(path)
+        with self.lock:
+            self.files[path] = (stat.st_size, stat.st_mtime)
+            self.names[dirpath].add(name)
+            self.dirs.add(dirpath)
+        if md5 is not None and self.manifest is not None:
+            self.manifest.record(path, md5)
+
+    def remove_file(self, path):
+        """
+        Forgets a file removed by the chef, like an evicted one.
+        """
+        path = os.path.normpath(path)
+        dirpath, name = os.path.split(path)
+        with self.lock:
+            self.files.pop(path, None)
+            if dirpath in self.names:
+                self.names[dirpath].discard(name)
+
+    def remove_dir(self, path):
+        with self.lock:
+            self.dirs.discard(os.path.normpath(path))
+
+    def make_dirs(self, path):
+        path = os.path.normpath(path)
+        with self.lock:
+            if path in self.dirs:
+                return
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            while self.covers(path) and path not in self.dirs:
+                self.dirs.add(path)
+                path = os.path.dirname(path)
+
+    def find(self, dirpath, pattern):
+        dirpath = os.path.normpath(dirpath)
+        with self.lock:
+            names = sorted(self.names.get(dirpath, ()))
+        return [os.path.join(dirpath, name) for name in fnmatch.filter(names, pattern)]
+
+    def stat(self, path):
+        with self.lock:
+            return self.files.get(os.path.normpath(path))
+
+    def hash(self, path):
+        """
+        The md5 recorded in the manifest, if the file didn't change since.
+        """
+        if self.manifest is None:
+            return None
+        stat = self.stat(path)
+        entry = self.manifest.entry(os.path.normpath(path))
+        if stat is None or entry is None or (entry["size"], entry["mtime"]) != stat:
+            return None
+        return entry["md5"]
@@ -0,0 +1,272 @@
+import re
+import struct
+import threading
+
+from utils import LazyModule
+
+
+bs4 = LazyModule("bs4")
+
+# Invision Community controls that do nothing in an offline copy
+REMOVED_CLASSES = {"ipsItemControls", "ipsComment_controls", "ipsReact", "ipsReactOverview",
+                   "ipsSharePanel", "ipsShareLinks", "ipsMenu", "ipsPagination", "ipsButton",
+                   "ipsHide"}
+REMOVED_TAGS = ["form", "button", "input", "select", "textarea"]
+REMOVED_ATTRIBUTES = {"style", "srcset", "itemprop", "itemscope", "itemtype", "itemid"}
+PRESERVE_WHITESPACE = {"pre", "code", "textarea", "script", "style"}
+BLOCK_TAGS = {"html", "head", "body", "div", "p", "ul", "ol", "li", "table", "thead", "tbody",
+              "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "section",
+              "article", "header", "footer", "figure", "figcaption", "hr", "br", "img", "meta",
+              "link", "script", "iframe"}
+ALWAYS_PRESENT_TAGS = {"html", "head", "body", "*"}
+
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+CSS_PSEUDO = re.compile(r"::?[a-zA-Z-]+(\([^)]*\))?")
+CSS_ATTRIBUTE = re.compile(r"\[[^\]]*\]")
+CSS_CLASS = re.compile(r"\.([\w-]+)")
+CSS_ID = re.compile(r"#([\w-]+)")
+CSS_COMBINATOR = re.compile(r"[\s>+~]+")
+CSS_TAG = re.compile(r"^([a-zA-Z][\w-]*|\*)")
+WHITESPACE = re.compile(r"\s+")
+
+
+class OptimizerStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.apps = 0
+        self.before = 0
+        self.after = 0
+
+    def add(self, before, after):
+        with self.lock:
+            self.apps += 1
+            self.before += before
+            self.after += after
+
+    def report(self):
+        return "HTML optimizer: {} apps, {} -> {} bytes of html and css ({} saved)".format(
+            self.apps, self.before, self.after, self.before - self.after)
+
+
+OPTIMIZER_STATS = OptimizerStats()
+
+
+def image_size(content):
+    """
+    Returns (width, height) read from the header of a PNG, GIF, JPEG or WEBP
+    image, None for anything else.
+    """
+    try:
+        if content[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", content[16:24])
+        if content[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", content[6:10])
+        if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+            chunk = content[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", content[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b"VP8L":
+                bits = struct.unpack("<I", content[21:25])[0]
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b"VP8X":
+                width = int.from_bytes(content[24:27], "little") + 1
+                height = int.from_bytes(content[27:30], "little") + 1
+                return width, height
+        if content[:2] == b"\xff\xd8":
+            position = 2
+            while position + 9 < len(content):
+                if content[position] != 0xff:
+                    position += 1
+                    continue
+                marker = content[position + 1]
+                if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                    height, width = struct.unpack(">HH", content[position + 5:position + 9])
+                    return width, height
+                if marker == 0xff:
+                    position += 1
+                    continue
+                if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+                    position += 2
+                    continue
+                position += 2 + struct.unpack(">H", content[position + 2:position + 4])[0]
+    except struct.error:
+        return None
+    return None
+
+
+def selector_used(selector, used):
+    selector = CSS_ATTRIBUTE.sub("", CSS_PSEUDO.sub("", selector))
+    if any(name not in used["classes"] for name in CSS_CLASS.findall(selector)):
+        return False
+    if any(name not in used["ids"] for name in CSS_ID.findall(selector)):
+        return False
+    for compound in CSS_COMBINATOR.split(selector.strip()):
+        match = CSS_TAG.match(compound)
+        if match and match.group(1).lower() not in used["tags"] | ALWAYS_PRESENT_TAGS:
+            return False
+    return True
+
+
+def squash(text):
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def squash_declarations(text):
+    text = re.sub(r"\s*([:;,])\s*", r"\1", squash(text))
+    return text.rstrip(";")
+
+
+def matching_brace(css, position):
+    depth = 0
+    for index in range(position, len(css)):
+        if css[index] == "{":
+            depth += 1
+        elif css[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(css) - 1
+
+
+def subset_css_block(css, position, used):
+    out = []
+    while position < len(css):
+        brace = css.find("{", position)
+        close = css.find("}", position)
+        if close != -1 and (brace == -1 or close < brace):
+            return "".join(out), close + 1
+        if brace == -1:
+            break
+        statements = css[position:brace].split(";")
+        for statement in statements[:-1]:
+            if statement.strip():
+                out.append(squash(statement) + ";")
+        prelude = statements[-1].strip()
+        if prelude.startswith(("@media", "@supports")):
+            inner, position = subset_css_block(css, brace + 1, used)
+            if inner:
+                out.append("{}{{{}}}".format(squash(prelude), inner))
+        elif prelude.startswith("@"):
+            # @font-face, @keyframes, @page are kept whole
+            end = matching_brace(css, brace)
+            out.append(squash(prelude) + squash(css[brace:end + 1]))
+            position = end + 1
+        else:
+            end = css.find("}", brace)
+            end = len(css) if end == -1 else end
+            selectors = [squash(selector) for selector in prelude.split(",")
+                         if selector_used(selector, used)]
+            declarations = squash_declarations(css[brace + 1:end])
+            if selectors and declarations:
+                out.append("{}{{{}}}".format(",".join(selectors), declarations))
+            position = end + 1
+    return "".join(out), position
+
+
+def subset_css(css, used, keep_names=()):
+    """
+    Keeps the rules of css with at least one selector whose tags, classes
+    and ids all appear in the document or in keep_names, minified.
+    """
+    used = dict(used, classes=used["classes"] | set(keep_names), ids=used["ids"] | set(keep_names))
+    return subset_css_block(CSS_COMMENT.sub("", css), 0, used)[0]
+
+
+def css_names(css):
+    css = CSS_COMMENT.sub("", css)
+    return set(CSS_CLASS.findall(css)), set(CSS_ID.findall(css))
+
+
+def has_class(tag, names):
+    return any(name in names for name in tag.get("class", []))
+
+
+def strip_markup(soup, css_classes, css_ids, keep_names):
+    for comment in soup.find_all(string=lambda text: isinstance(text, bs4.Comment)):
+        comment.extract()
+    for tag in soup.find_all(REMOVED_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(lambda tag: has_class(tag, REMOVED_CLASSES)):
+        tag.decompose()
+
+    for tag in soup.find_all(True):
+        # the page template aligns the body itself
+        if tag.name in ALWAYS_PRESENT_TAGS:
+            continue
+        for attribute in list(tag.attrs):
+            if attribute in REMOVED_ATTRIBUTES or attribute.startswith("data-"):
+                del tag[attribute]
+        if tag.get("id") and tag["id"] not in css_ids and tag["id"] not in keep_names:
+            del tag["id"]
+        if tag.get("class"):
+            classes = [name for name in tag["class"] if name in css_classes or name in keep_names]
+            if classes:
+                tag["class"] = classes
+            else:
+                del tag["class"]
+
+    for tag in soup.find_all("span"):
+        if not tag.attrs:
+            tag.unwrap()
+    for tag in soup.find_all("div"):
+        children = [child for child in tag.children
+                    if not isinstance(child, bs4.NavigableString) or child.strip()]
+        if not tag.attrs and len(children) == 1 and getattr(children[0], "name", None) == "div":
+            tag.unwrap()
+
+
+def collapse_whitespace(soup):
+    for text in soup.find_all(string=True):
+        if isinstance(text, bs4.Comment) or text.find_parent(PRESERVE_WHITESPACE):
+            continue
+        collapsed = WHITESPACE.sub(" ", text)
+        if not collapsed.strip():
+            previous, following = text.previous_sibling, text.next_sibling
+            if getattr(previous, "name", None) in BLOCK_TAGS | {None} and \
+                    getattr(following, "name", None) in BLOCK_TAGS | {None}:
+                text.extract()
+                continue
+        if collapsed != text:
+            text.replace_with(collapsed)
+
+
+def add_image_hints(soup, files):
+    for img in soup.find_all("img"):
+        img["loading"] = "lazy"
+        img["decoding"] = "async"
+        if img.get("width") or img.get("height"):
+            continue
+        content = files.get(img.get("src", ""))
+        size = image_size(content) if content else None
+        if size is not None:
+            img["width"], img["height"] = str(size[0]), str(size[1])
+
+
+def optimize_html_app(html, css, files, js=""):
+    """
+    Returns html and css for an HTML5 app zip: unused markup and attributes
+    removed, whitespace collapsed, css reduced to the selectors the page uses
+    and images marked lazy with their intrinsic size. files maps the zip
+    entry names to their bytes. Class and id names mentioned in js are kept,
+    in the markup and in the css.
+    """
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    css_classes, css_ids = css_names(css)
+    keep_names = set(re.findall(r"[\w-]+", js))
+    strip_markup(soup, css_classes, css_ids, keep_names)
+    collapse_whitespace(soup)
+    add_image_hints(soup, files)
+
+    used = dict(tags=set(), classes=set(), ids=set())
+    for tag in soup.find_all(True):
+        used["tags"].add(tag.name)
+        used["classes"].update(tag.get("class", []))
+        if tag.get("id"):
+            used["ids"].add(tag["id"])
+    optimized_html = str(soup)
+    # scripts add and look up names the markup doesn't have yet
+    optimized_css = subset_css(css, used, keep_names)
+    OPTIMIZER_STATS.add(len(html.encode("utf-8")) + len(css.encode("utf-8")),
+                        len(optimized_html.encode("utf-8")) + len(optimized_css.encode("utf-8")))
+    return optimized_html, optimized_css
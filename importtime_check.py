@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# imported on first use by the chef, never by `import sushichef`
+LAZY_PACKAGES = ("youtube_dl", "git", "html5lib", "PIL")
+# the chef's modules are imported from here, wherever this runs from
+CHEF_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module):
+    """
+    Runs `python -X importtime -c "import <module>"` and returns a list of
+    (package, self_us, cumulative_us, depth) in import order.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, cwd=CHEF_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def eager_imports(module, packages=LAZY_PACKAGES):
+    """
+    The packages that are in sys.modules after importing module in a fresh
+    interpreter.
+    """
+    code = "import json, sys, {}; print(json.dumps(sorted(sys.modules)))".format(module)
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, cwd=CHEF_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imported = set(name.split(".")[0] for name in json.loads(result.stdout.strip().splitlines()[-1]))
+    return [package for package in packages if package in imported]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the chef against a budget")
+    parser.add_argument("--module", default="sushichef")
+    parser.add_argument("--budget-ms", type=float, default=1500,
+                        help="fail if importing the module takes longer than this")
+    parser.add_argument("--forbid", default=",".join(LAZY_PACKAGES),
+                        help="comma separated packages that must not be imported eagerly")
+    parser.add_argument("--top", type=int, default=15, help="list the slowest top level imports")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total_ms = sum(cumulative for name, _, cumulative, depth in times
+                   if depth == 0 and name == args.module) / 1000.0
+    print("import {}: {:.1f}ms (budget {:.1f}ms)".format(args.module, total_ms, args.budget_ms))
+    # children are reported before their parent
+    children, pending = [], []
+    for entry in times:
+        if entry[3] == 1:
+            pending.append(entry)
+        elif entry[3] == 0:
+            if entry[0] == args.module:
+                children = pending
+            pending = []
+    top_level = sorted(children, key=lambda entry: -entry[2])
+    for name, _, cumulative, _ in top_level[:args.top]:
+        print("    {:>8.1f}ms  {}".format(cumulative / 1000.0, name))
+
+    failed = total_ms > args.budget_ms
+    for package in eager_imports(args.module, list(filter(None, args.forbid.split(",")))):
+        print("{} is imported eagerly".format(package))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
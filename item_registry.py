@@ -0,0 +1,63 @@
+import threading
+import urllib.parse as urlparse
+
+
+def canonical_url(url):
+    parsed = urlparse.urlparse(url.strip())
+    path = parsed.path.rstrip("/") or "/"
+    return urlparse.urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path, "", "", ""))
+
+
+class ItemRegistry(object):
+    """
+    Crawl wide registry of packaged items keyed by canonical source URL, an
+    item listed under several topics is fetched and packaged only once.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.in_flight = {}
+        self.built = 0
+        self.duplicates = 0
+
+    def __contains__(self, url):
+        with self.lock:
+            return canonical_url(url) in self.nodes
+
+    def get_or_build(self, url, build):
+        """
+        Returns the node of url, calling build() only the first time the
+        url is seen. Callers asking while it is being built wait for it.
+        """
+        key = canonical_url(url)
+        with self.lock:
+            if key in self.nodes:
+                self.duplicates += 1
+                return self.nodes[key]
+            event = self.in_flight.get(key)
+            owner = event is None
+            if owner:
+                event = self.in_flight[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self.lock:
+                self.duplicates += 1
+                return self.nodes.get(key)
+
+        node = None
+        built = False
+        try:
+            node = build()
+            built = True
+        finally:
+            with self.lock:
+                if built:
+                    self.nodes[key] = node
+                    self.built += 1
+                del self.in_flight[key]
+            event.set()
+        return node
+
+    def report(self):
+        return "Items: {} packaged, {} duplicate fetches avoided".format(self.built, self.duplicates)
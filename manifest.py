@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def md5_file(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2097152), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class Manifest(object):
+    """
+    Checksums of the files in chefdata, saved as json. An entry is only
+    trusted while the size and mtime of the file still match.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(filepath):
+            try:
+                with open(filepath) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def entry(self, path):
+        with self.lock:
+            return self.entries.get(path)
+
+    def get(self, path):
+        """
+        Returns the entry of path if the file wasn't modified since it was recorded.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return None
+        return entry
+
+    def record(self, path, md5, status="ok", **extra):
+        stat = os.stat(path)
+        entry = dict(size=stat.st_size, mtime=stat.st_mtime, md5=md5, status=status)
+        entry.update(extra)
+        with self.lock:
+            self.entries[path] = entry
+        return entry
+
+    def remove(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True)
+        dirname = os.path.dirname(self.filepath) or "."
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.filepath)
@@ -0,0 +1,107 @@
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+
+class PageArchive(object):
+    """
+    Append-only archive of fetched pages. Every record is its own gzip member
+    in <path>.warc.gz so it can be read with a single seek, the offsets are
+    kept in <path>.idx (one json line per record, the last record of an url wins).
+    compact() drops the records later ones replaced.
+    """
+    def __init__(self, path):
+        self.data_path = path + ".warc.gz"
+        self.index_path = path + ".idx"
+        self.lock = threading.Lock()
+        self.index = {}
+        dirname = os.path.dirname(self.data_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        if not os.path.isfile(self.index_path):
+            return
+        data_size = os.path.getsize(self.data_path) if os.path.isfile(self.data_path) else 0
+        with open(self.index_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a run killed while writing the index
+                    continue
+                if entry["offset"] + entry["length"] <= data_size:
+                    self.index[entry["url"]] = (entry["offset"], entry["length"])
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def compact(self, min_share=0.5):
+        """
+        Rewrites the archive with the last record of every url once replaced
+        records make up more than min_share of it, returns the bytes reclaimed.
+        The data is replaced before the index, get() checks the url of a
+        record so a run killed in between reads no wrong page.
+        """
+        with self.lock:
+            if not os.path.isfile(self.data_path):
+                return 0
+            data_size = os.path.getsize(self.data_path)
+            replaced = data_size - sum(length for _, length in self.index.values())
+            if replaced <= data_size * min_share:
+                return 0
+            index = {}
+            with open(self.data_path, "rb") as src, open(self.data_path + ".tmp", "wb") as dst:
+                for url, (offset, length) in sorted(self.index.items(), key=lambda item: item[1]):
+                    src.seek(offset)
+                    index[url] = (dst.tell(), length)
+                    dst.write(src.read(length))
+            with open(self.index_path + ".tmp", "w") as f:
+                for url, (offset, length) in sorted(index.items(), key=lambda item: item[1]):
+                    f.write(json.dumps(dict(url=url, offset=offset, length=length)) + "\n")
+            os.replace(self.data_path + ".tmp", self.data_path)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            self.index = index
+            return data_size - os.path.getsize(self.data_path)
+
+    def put(self, url, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        header = "URL: {}\nDate: {}\nContent-Length: {}\n\n".format(
+            url, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), len(content))
+        record = gzip.compress(header.encode("utf-8") + content)
+        with self.lock:
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(record)
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(dict(url=url, offset=offset, length=len(record))) + "\n")
+            self.index[url] = (offset, len(record))
+
+    def get(self, url):
+        """
+        Returns the archived bytes of url or None if it was never archived
+        or its record is damaged or of another url.
+        """
+        with self.lock:
+            if url not in self.index:
+                return None
+            offset, length = self.index[url]
+            with open(self.data_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+        try:
+            record = gzip.decompress(data)
+        except (OSError, EOFError, zlib.error):
+            return None
+        header, _, content = record.partition(b"\n\n")
+        if header.split(b"\n", 1)[0] != "URL: {}".format(url).encode("utf-8"):
+            return None
+        return content
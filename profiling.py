@@ -0,0 +1,155 @@
+from collections import Counter, defaultdict
+import contextlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class NullProfiler(object):
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class StageProfiler(object):
+    """
+    Sampling CPU profiler plus tracemalloc snapshots grouped by crawl stage.
+
+    A background thread samples the stacks of every thread that is inside a
+    stage and counts them in collapsed-stack format (the input of
+    flamegraph.pl and speedscope). One in alloc_every entries of a stage is
+    bracketed by tracemalloc snapshots to find the allocation sites it
+    retains and its peak traced memory. tracemalloc is process wide, so a
+    measurement only counts when no other stage ran meanwhile, on any
+    thread. Crawls with several workers get few of them, --workers=1 gives
+    per stage numbers for every sampled entry.
+    """
+    def __init__(self, output_dir, interval=0.005, alloc_every=20, top=20):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.alloc_every = alloc_every
+        self.top = top
+        self.lock = threading.Lock()
+        self.thread_stages = {}
+        self.stacks = defaultdict(Counter)
+        self.allocs = defaultdict(Counter)
+        self.calls = Counter()
+        self.wall_time = Counter()
+        self.peaks = Counter()
+        self.measured = Counter()
+        self.discarded = Counter()
+        # outermost stages open right now and entered so far, on every thread
+        self.open_stages = 0
+        self.entered = 0
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def start(self):
+        tracemalloc.start(10)
+        self.sampler = threading.Thread(target=self.sample_loop, name="profiler", daemon=True)
+        self.sampler.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stages = self.thread_stages.setdefault(threading.get_ident(), [])
+        stages.append(name)
+        # a nested stage is part of the outer one's measurement
+        outermost = len(stages) == 1
+        with self.lock:
+            self.calls[name] += 1
+            if outermost:
+                self.open_stages += 1
+                self.entered += 1
+            entered = self.entered
+            take_snapshot = self.calls[name] % self.alloc_every == 1 or self.alloc_every == 1
+            if take_snapshot and (not outermost or self.open_stages > 1):
+                # another stage would share the traced memory and the peak
+                self.discarded[name] += 1
+                take_snapshot = False
+        snapshot = self.take_snapshot() if take_snapshot else None
+        if snapshot is not None:
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stages.pop()
+            stats = []
+            if snapshot is not None:
+                peak = tracemalloc.get_traced_memory()[1] - traced_start
+                stats = self.take_snapshot().compare_to(snapshot, "lineno")
+            with self.lock:
+                self.wall_time[name] += elapsed
+                if outermost:
+                    self.open_stages -= 1
+                if snapshot is not None and self.entered != entered:
+                    self.discarded[name] += 1
+                    stats = []
+                elif snapshot is not None:
+                    self.measured[name] += 1
+                    self.peaks[name] = max(self.peaks[name], peak)
+                for stat in stats[:self.top]:
+                    if stat.size_diff > 0:
+                        self.allocs[name][str(stat.traceback[0])] += stat.size_diff
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)])
+
+    def sample_loop(self):
+        own_ident = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                try:
+                    # the thread may leave its last stage meanwhile
+                    stage = self.thread_stages[ident][-1]
+                except (KeyError, IndexError):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append("{}:{}".format(os.path.basename(frame.f_code.co_filename),
+                                                frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                with self.lock:
+                    self.stacks[stage][";".join(stack)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        tracemalloc.stop()
+        self.write()
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "all.collapsed"), "w") as all_f:
+            for stage, stacks in self.stacks.items():
+                with open(os.path.join(self.output_dir, "{}.collapsed".format(stage)), "w") as f:
+                    for stack, count in stacks.most_common():
+                        f.write("{} {}\n".format(stack, count))
+                        all_f.write("{};{} {}\n".format(stage, stack, count))
+
+        for stage, sites in self.allocs.items():
+            with open(os.path.join(self.output_dir, "{}.alloc.txt".format(stage)), "w") as f:
+                for site, size in sites.most_common(self.top):
+                    f.write("{:>12} B  {}\n".format(size, site))
+
+        with open(os.path.join(self.output_dir, "summary.txt"), "w") as f:
+            for stage, elapsed in self.wall_time.most_common():
+                f.write("{:<10} {:>6} calls {:>10.2f}s wall {:>8} samples {:>12} B peak"
+                        " ({} measured, {} overlapped)\n".format(
+                    stage, self.calls[stage], elapsed, sum(self.stacks[stage].values()),
+                    self.peaks[stage], self.measured[stage], self.discarded[stage]))
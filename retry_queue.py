@@ -0,0 +1,177 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+
+class RetryQueue(object):
+    """
+    Dead-letter queue of failed fetches, saved as json so what a run could
+    not fetch is retried by the end of run pass or by the next run. Failures
+    happening while an item or a listing page is built are collected and
+    queued once for that item or page, so the retry rebuilds the whole thing.
+    Entries are retried with exponential backoff until max_attempts, then
+    they stay in the file as dead letters.
+    """
+    def __init__(self, filepath, max_attempts=5, delay=30, max_delay=900):
+        self.filepath = filepath
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.entries = {}
+        if os.path.isfile(filepath):
+            try:
+                with open(filepath) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def backoff(self, attempts):
+        return min(self.max_delay, self.delay * 2 ** max(0, attempts - 1))
+
+    @contextmanager
+    def collect(self):
+        """
+        Collects the failures passed to fail() by the current thread as
+        (reason, retry) pairs instead of queueing them.
+        """
+        previous = getattr(self.local, "failures", None)
+        self.local.failures = failures = []
+        try:
+            yield failures
+        finally:
+            self.local.failures = previous
+
+    def fail(self, kind, key, reason, retry=True):
+        reason = "{} {}: {}".format(kind, key, reason)
+        LOGGER.info("Failed {}".format(reason))
+        failures = getattr(self.local, "failures", None)
+        if failures is not None:
+            failures.append((reason, retry))
+        else:
+            self.add(kind, key, reason, retry=retry)
+
+    def queue(self, kind, key, failures, **params):
+        """
+        Queues kind/key for the failures collected while building it, or
+        passes them on to the collect() this runs in.
+        """
+        outer = getattr(self.local, "failures", None)
+        if outer is not None:
+            outer.extend(failures)
+        else:
+            self.add_failures(kind, key, failures, **params)
+
+    def add_failures(self, kind, key, failures, **params):
+        """
+        Adds kind/key for collected failures, it is only retried if one of
+        them is worth retrying.
+        """
+        self.add(kind, key, "; ".join(reason for reason, _ in failures),
+                 retry=any(retry for _, retry in failures), **params)
+
+    def add(self, kind, key, reason, retry=True, **params):
+        entry_key = "{} {}".format(kind, key)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is None:
+                entry = self.entries[entry_key] = dict(kind=kind, key=key, attempts=0, first_failed=now)
+            entry.update(params)
+            entry["reason"] = reason
+            entry["last_failed"] = now
+            entry["attempts"] = entry["attempts"] + 1 if retry else self.max_attempts
+            entry["next_attempt"] = now + self.backoff(entry["attempts"])
+
+    def remove(self, kind, key):
+        with self.lock:
+            return self.entries.pop("{} {}".format(kind, key), None) is not None
+
+    def drop_others(self, kinds):
+        """
+        Removes the entries of other kinds than kinds, nothing retries them
+        (like the videos older runs queued apart from their item). Returns
+        their keys.
+        """
+        with self.lock:
+            dropped = sorted(entry_key for entry_key, entry in self.entries.items()
+                             if entry["kind"] not in kinds)
+            for entry_key in dropped:
+                del self.entries[entry_key]
+        return dropped
+
+    def pending(self, kinds):
+        with self.lock:
+            return [dict(entry) for entry in self.entries.values()
+                    if entry["kind"] in kinds and entry["attempts"] < self.max_attempts]
+
+    def retry(self, handlers, max_wait=0, deadline=None):
+        """
+        Retries the queued entries whose kind has a handler, waiting for
+        their backoff for up to max_wait seconds. handler(entry) returns the
+        collected failures, an empty list on success, or None when it can't
+        retry the entry in this run. No entry is started after deadline (a
+        time.time() value), the ones left stay queued. Returns the number of
+        entries recovered.
+        """
+        wait_until = time.time() + max_wait
+        if deadline is not None:
+            wait_until = min(wait_until, deadline)
+        recovered = 0
+        skipped = set()
+        while True:
+            pending = [entry for entry in self.pending(handlers)
+                       if (entry["kind"], entry["key"]) not in skipped]
+            if not pending:
+                break
+            now = time.time()
+            due = [entry for entry in pending if entry["next_attempt"] <= now]
+            if not due:
+                next_attempt = min(entry["next_attempt"] for entry in pending)
+                if next_attempt > wait_until:
+                    break
+                time.sleep(max(0, next_attempt - now))
+                continue
+            for entry in sorted(due, key=lambda entry: entry["next_attempt"]):
+                if deadline is not None and time.time() >= deadline:
+                    return recovered
+                try:
+                    failures = handlers[entry["kind"]](entry)
+                except Exception as e:
+                    failures = [(str(e), True)]
+                if failures is None:
+                    skipped.add((entry["kind"], entry["key"]))
+                elif failures:
+                    self.add_failures(entry["kind"], entry["key"], failures)
+                else:
+                    self.remove(entry["kind"], entry["key"])
+                    recovered += 1
+        return recovered
+
+    def report(self):
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda entry: (entry["kind"], entry["key"]))
+        lines = ["Retry queue: {} left".format(len(entries))]
+        for entry in entries:
+            lines.append("    {} {} after {} attempts{}: {}".format(
+                entry["kind"], entry["key"], entry["attempts"],
+                " (dead)" if entry["attempts"] >= self.max_attempts else "", entry["reason"]))
+        return lines
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True, ensure_ascii=False)
+        dirname = os.path.dirname(self.filepath) or "."
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.filepath)
@@ -0,0 +1,69 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+
+class CrawlScheduler(object):
+    """
+    Priority queue of crawl jobs run by a pool of worker threads, lower
+    priorities first. Jobs can push more jobs. Once time_budget seconds have
+    passed no new job is started, the running ones finish and the labels of
+    the jobs left behind are available from pending().
+    """
+    def __init__(self, time_budget=None, workers=4):
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+        self.workers = workers
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = 0
+        self.done = 0
+        self.failed = []
+
+    def push(self, priority, label, fn, *args):
+        with self.cond:
+            heapq.heappush(self.heap, (priority, next(self.seq), label, fn, args))
+            self.cond.notify()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.heap and self.running > 0 and not self.expired():
+                    self.cond.wait(1)
+                if not self.heap or self.expired():
+                    self.cond.notify_all()
+                    return
+                _, _, label, fn, args = heapq.heappop(self.heap)
+                self.running += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                LOGGER.info("Job {} failed: {}".format(label, e))
+                with self.cond:
+                    self.failed.append(label)
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.done += 1
+                    self.cond.notify_all()
+
+    def run(self):
+        threads = [threading.Thread(target=self.worker, name="crawl-{}".format(i))
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.done
+
+    def pending(self):
+        with self.cond:
+            return [label for _, _, label, _, _ in sorted(self.heap)]
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import sushichef
+from item_registry import ItemRegistry
+from synthetic_site import serve, site_arguments, site_from_arguments
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # peak instead of current outside of linux, kB on linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def open_files():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class Sampler(object):
+    """
+    Samples RSS, open file descriptors, threads and the items done every
+    interval seconds from a background thread, a stalled crawl still gets
+    its samples.
+    """
+    def __init__(self, interval=5):
+        self.interval = interval
+        self.items = 0
+        self.samples = []
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        sample = dict(seconds=round(time.time() - self.started, 1), items=self.items, rss=rss_bytes(),
+                      fds=open_files(), threads=threading.active_count())
+        self.samples.append(sample)
+        print("{seconds:>8.1f}s {items:>7} items  rss {rss_mb:>8.1f}MB  fds {fds}  threads {threads}".format(
+            rss_mb=sample["rss"] / 1024.0 / 1024, **sample))
+
+
+def slope(points):
+    """
+    Least squares slope of (x, y) points.
+    """
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def throughput(samples):
+    if len(samples) < 2 or samples[-1]["seconds"] == samples[0]["seconds"]:
+        return 0.0
+    return (samples[-1]["items"] - samples[0]["items"]) / (samples[-1]["seconds"] - samples[0]["seconds"])
+
+
+def analyse(samples, warmup):
+    """
+    Leaves out the warmup share of the run, then measures the RSS growth per
+    item, the file descriptors left open and the throughput of the last
+    quarter against the first one.
+    """
+    steady = samples[int(len(samples) * warmup):]
+    quarter = max(2, len(steady) // 4)
+    fds = [sample["fds"] for sample in steady if sample["fds"] is not None]
+    return dict(
+        items=samples[-1]["items"],
+        seconds=samples[-1]["seconds"],
+        rss_per_item=slope([(sample["items"], sample["rss"]) for sample in steady]),
+        rss_growth=steady[-1]["rss"] - steady[0]["rss"],
+        fd_growth=fds[-1] - fds[0] if fds else 0,
+        first_throughput=throughput(steady[:quarter]),
+        last_throughput=throughput(steady[-quarter:]))
+
+
+def crawl(chef, options, passes, sampler):
+    """
+    Crawls the whole site passes times, the later passes find the items
+    packaged and go through the skip paths, like the daemon's jobs.
+    """
+    workers = int(options['--workers'])
+    for crawl_pass in range(passes):
+        sushichef.ITEM_REGISTRY = ItemRegistry()
+        categories = list(sushichef.browser_resources())
+        for _ in sushichef.iter_items(categories, concurrency=workers):
+            sampler.items += 1
+        for category in categories:
+            category.add_scheduled()
+        chef.channel_tree(categories)
+        print("Pass {}: {} items".format(crawl_pass + 1, sampler.items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl a synthetic site while tracking RSS, open files and throughput")
+    site_arguments(parser)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--passes", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=0.2, help="share of the samples left out")
+    parser.add_argument("--workdir", default=None, help="chefdata goes here, a temporary dir by default")
+    parser.add_argument("--report", default=None, help="write the samples and results as json")
+    parser.add_argument("--max-rss-per-item", type=int, default=64 * 1024)
+    parser.add_argument("--max-fd-growth", type=int, default=32)
+    parser.add_argument("--min-throughput-ratio", type=float, default=0.5,
+                        help="the last quarter's items/s against the first quarter's")
+    args = parser.parse_args()
+
+    site = site_from_arguments(args)
+    server = serve(site)
+    sushichef.BASE_URL = site.base_url
+    print("Synthetic site: {} items on {}".format(site.item_count(), site.base_url))
+
+    report_path = os.path.abspath(args.report) if args.report else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hsoub-soak-")
+    os.makedirs(os.path.join(workdir, sushichef.DATA_DIR), exist_ok=True)
+    os.chdir(workdir)
+    # no download of the html-app-starter assets, the soak stays offline
+    for name in ("styles.css", "scripts.js"):
+        with open(os.path.join(sushichef.DATA_DIR, name), "w") as f:
+            f.write("/* soak */\n")
+    options = {'--download-video': "0", '--workers': str(args.workers), '--retry-wait': "0",
+               '--video-workers': "0"}
+    chef = sushichef.HsoubAcademyChef()
+    manifest, _ = chef.prepare(options)
+    chef.configure(options)
+
+    sampler = Sampler(interval=args.interval)
+    sampler.start()
+    try:
+        crawl(chef, options, args.passes, sampler)
+    finally:
+        sampler.stop()
+        chef.finish(manifest)
+        server.shutdown()
+
+    result = analyse(sampler.samples, args.warmup)
+    ratio = result["last_throughput"] / result["first_throughput"] if result["first_throughput"] else 1.0
+    print("{} items in {:.0f}s, {:.1f} items/s".format(
+        result["items"], result["seconds"], result["items"] / max(result["seconds"], 0.001)))
+    print("RSS: {:+.1f}MB after warmup, {:.1f}kB per item".format(
+        result["rss_growth"] / 1024.0 / 1024, result["rss_per_item"] / 1024))
+    print("Open files: {:+d} after warmup".format(result["fd_growth"]))
+    print("Throughput: {:.1f} -> {:.1f} items/s ({:.0%})".format(
+        result["first_throughput"], result["last_throughput"], ratio))
+    failures = []
+    if result["rss_per_item"] > args.max_rss_per_item:
+        failures.append("RSS grows {:.1f}kB per item".format(result["rss_per_item"] / 1024))
+    if result["fd_growth"] > args.max_fd_growth:
+        failures.append("{} file descriptors leaked".format(result["fd_growth"]))
+    if ratio < args.min_throughput_ratio:
+        failures.append("throughput dropped to {:.0%}".format(ratio))
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(dict(samples=sampler.samples, result=result, failures=failures), f, indent=1)
+    for failure in failures:
+        print("FAIL: {}".format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+LOGGER = logging.getLogger()
+
+ACCESS_FILE = "access.json"
+REFERENCED_FILE = "referenced.json"
+# never evicted: the trees, the page archive, benchmark baselines and the
+# files at the top of the data dir (manifest, retry queue, css, js...)
+PROTECTED_DIRS = {"trees", "archive", "benchmarks"}
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value):
+    """
+    "500M", "20G" or a number of bytes.
+    """
+    value = str(value).strip().upper().rstrip("B")
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    for unit in ("T", "G", "M", "K"):
+        if size >= SIZE_UNITS[unit]:
+            return "{:.1f}{}".format(size / SIZE_UNITS[unit], unit)
+    return "{}B".format(size)
+
+
+def tree_paths(node):
+    """
+    The local files of a ricecooker json tree: thumbnails and file paths.
+    """
+    paths = set()
+    if node.get("thumbnail"):
+        paths.add(os.path.abspath(node["thumbnail"]))
+    for file_dict in node.get("files", []):
+        if file_dict.get("path"):
+            paths.add(os.path.abspath(file_dict["path"]))
+    for child in node.get("children", []):
+        paths |= tree_paths(child)
+    return paths
+
+
+def transcode_source(path):
+    """
+    The download transcoded/<profile>/<id>.mp4 (or its .source marker) was
+    made from, videos/<id>.mp4 of the VideoStore, None for other paths.
+    """
+    profile_dir, name = os.path.split(path)
+    transcoded_dir = os.path.dirname(profile_dir)
+    if os.path.basename(transcoded_dir) != "transcoded":
+        return None
+    return os.path.join(os.path.dirname(transcoded_dir), "videos", stem(name) + ".mp4")
+
+
+def transcode_sources(paths):
+    """
+    The downloads the transcoded videos among paths were made from, the
+    next run needs the download to find the video packaged.
+    """
+    sources = set(transcode_source(path) for path in paths)
+    sources.discard(None)
+    return sources
+
+
+def stem(path):
+    return os.path.splitext(path)[0]
+
+
+def kept_source_marker(path, referenced):
+    # the transcode of a referenced download wasn't smaller, don't run it again
+    return path.endswith(".source") and transcode_source(path) in referenced
+
+
+class StorageManager(object):
+    """
+    Keeps chefdata under a quota. The last run that used every artifact is
+    kept in access.json. Files the current tree doesn't reference (nor a
+    sibling with the same name, like the info json of a video) are removed
+    once unused for max_age seconds, and the least recently used of them
+    go first while the data dir is over quota. Referenced files are never
+    removed, nor the downloads of referenced transcodes. A partial tree
+    (a sample, some topics, a time budget...) references the files of the
+    last complete tree too, nothing is removed before there is one.
+    """
+    def __init__(self, data_dir, quota=None, max_age=None, manifest=None, index=None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.quota = quota
+        self.max_age = max_age
+        self.manifest = manifest
+        # the FileIndex of the run, it must not answer for removed files
+        self.index = index
+        self.access_path = os.path.join(self.data_dir, ACCESS_FILE)
+        self.access = {}
+        if os.path.isfile(self.access_path):
+            try:
+                with open(self.access_path) as f:
+                    self.access = json.load(f)
+            except ValueError:
+                self.access = {}
+        # the files of the last complete tree, relative like access.json
+        self.referenced_path = os.path.join(self.data_dir, REFERENCED_FILE)
+        self.complete_tree = None
+        if os.path.isfile(self.referenced_path):
+            try:
+                with open(self.referenced_path) as f:
+                    self.complete_tree = set(json.load(f))
+            except ValueError:
+                self.complete_tree = None
+
+    def key(self, path):
+        # relative, access.json stays valid if the chef directory moves
+        return os.path.relpath(path, self.data_dir)
+
+    def touch(self, paths, now=None):
+        now = time.time() if now is None else now
+        for path in paths:
+            self.access[self.key(os.path.abspath(path))] = now
+
+    def scan(self):
+        """
+        Returns (evictable, protected_size), evictable lists the
+        (path, size, last access) of the files that may be removed.
+        """
+        evictable = []
+        protected_size = 0
+        for dirpath, dirs, files in os.walk(self.data_dir):
+            top_level = dirpath == self.data_dir
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if top_level:
+                    protected_size += stat.st_size
+                else:
+                    evictable.append((path, stat.st_size, self.access.get(self.key(path), stat.st_mtime)))
+            if top_level:
+                for name in dirs:
+                    if name in PROTECTED_DIRS:
+                        protected_size += sum(os.path.getsize(os.path.join(root, filename))
+                                              for root, _, filenames in os.walk(os.path.join(dirpath, name))
+                                              for filename in filenames)
+                dirs[:] = [name for name in dirs if name not in PROTECTED_DIRS]
+        return evictable, protected_size
+
+    def collect(self, referenced, dry_run=False, now=None, complete=True):
+        """
+        Removes old orphans, then the least recently used orphans until the
+        data dir fits in the quota. complete tells whether referenced are
+        the files of a complete tree of the channel. Returns a report dict.
+        """
+        now = time.time() if now is None else now
+        referenced = set(os.path.abspath(path) for path in referenced)
+        referenced |= transcode_sources(referenced)
+        self.touch(referenced, now=now)
+        if complete:
+            self.complete_tree = set(self.key(path) for path in referenced)
+        elif self.complete_tree is not None:
+            referenced |= set(os.path.join(self.data_dir, key) for key in self.complete_tree)
+        referenced_stems = set(stem(path) for path in referenced)
+
+        evictable, protected_size = self.scan()
+        total = protected_size + sum(size for _, size, _ in evictable)
+        if self.complete_tree is None:
+            orphans = []
+        else:
+            orphans = sorted((last_access, path, size) for path, size, last_access in evictable
+                             if path not in referenced and stem(path) not in referenced_stems
+                             and not kept_source_marker(path, referenced))
+
+        removed = dict(orphans=[0, 0], lru=[0, 0])
+        size_left = total
+        for last_access, path, size in orphans:
+            if self.max_age is not None and now - last_access >= self.max_age:
+                reason = "orphans"
+            elif self.quota is not None and size_left > self.quota:
+                reason = "lru"
+            else:
+                continue
+            if not dry_run and not self.remove(path):
+                continue
+            removed[reason][0] += 1
+            removed[reason][1] += size
+            size_left -= size
+        if not dry_run:
+            self.remove_empty_dirs()
+            self.save()
+        return dict(total=total, left=size_left, quota=self.quota, removed=removed,
+                    over_quota=self.quota is not None and size_left > self.quota,
+                    no_complete_tree=self.complete_tree is None)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            LOGGER.info("Could not remove {}: {}".format(path, e))
+            return False
+        self.access.pop(self.key(path), None)
+        if self.manifest is not None:
+            self.manifest.remove(os.path.relpath(path))
+        if self.index is not None:
+            self.index.remove_file(os.path.relpath(path))
+        return True
+
+    def remove_empty_dirs(self):
+        for dirpath, dirs, files in os.walk(self.data_dir, topdown=False):
+            if dirpath != self.data_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+                if self.index is not None:
+                    self.index.remove_dir(os.path.relpath(dirpath))
+
+    def save(self):
+        # forget files removed by hand
+        self.access = dict((key, last_access) for key, last_access in self.access.items()
+                           if os.path.exists(os.path.join(self.data_dir, key)))
+        self.write_json(self.access_path, self.access)
+        if self.complete_tree is not None:
+            self.write_json(self.referenced_path, sorted(self.complete_tree))
+
+    def write_json(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def report_lines(report):
+    lines = ["Storage: {} in use{}".format(
+        format_size(report["left"]),
+        ", quota {}".format(format_size(report["quota"])) if report["quota"] is not None else "")]
+    for reason, label in (("orphans", "old orphans removed"), ("lru", "least recently used removed")):
+        count, size = report["removed"][reason]
+        if count:
+            lines.append("    {} {}, {} reclaimed".format(count, label, format_size(size)))
+    if report.get("no_complete_tree"):
+        lines.append("    nothing removed, no complete tree recorded yet")
+    elif report["over_quota"]:
+        lines.append("    still over quota, the rest is referenced by the tree or protected")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove unreferenced chefdata files to fit a quota")
+    parser.add_argument("--data-dir", default="chefdata")
+    parser.add_argument("--tree", default=os.path.join("chefdata", "trees", "ricecooker_json_tree.json"),
+                        help="the files of this tree are kept")
+    parser.add_argument("--quota", default=None, help="e.g. 20G")
+    parser.add_argument("--max-age-days", type=float, default=None,
+                        help="remove unreferenced files unused for this many days")
+    parser.add_argument("--complete", action="store_true",
+                        help="the tree is a complete crawl, otherwise the files of the last complete one are kept too")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.tree) as f:
+        referenced = tree_paths(json.load(f))
+    manager = StorageManager(args.data_dir,
+                             quota=parse_size(args.quota) if args.quota else None,
+                             max_age=args.max_age_days * 86400 if args.max_age_days is not None else None)
+    report = manager.collect(referenced, dry_run=args.dry_run, complete=args.complete)
+    for line in report_lines(report):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,46 @@
 #!/usr/bin/env python
 
-from bs4 import BeautifulSoup
-import codecs
-from collections import defaultdict, OrderedDict
-import copy
-import glob
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict, deque, OrderedDict
 from le_utils.constants import licenses, content_kinds, file_formats
 import hashlib
 import json
 import logging
-import ntpath
 import os
-from pathlib import Path
 import re
 import requests
 from ricecooker.classes.licenses import get_license
-from ricecooker.chefs import JsonTreeChef
-from ricecooker.utils import downloader, html_writer
-from ricecooker.utils.caching import CacheForeverHeuristic, FileCache, CacheControlAdapter
-from ricecooker.utils.jsontrees import write_tree_to_json_tree, SUBTITLES_FILE
 import time
+from tree_diff import diff_trees, changed_subtree, tree_hashes, write_report
 from urllib.error import URLError
 from urllib.parse import urljoin
-from utils import dir_exists, get_name_from_url, clone_repo, build_path
-from utils import file_exists, get_video_resolution_format, remove_links
-from utils import get_name_from_url_no_ext, get_node_from_channel, get_level_map
-from utils import remove_iframes, get_confirm_token, save_response_content
-from utils import link_to_text, remove_scripts, save_thumbnail
-import youtube_dl
-import uuid
+from utils import get_name_from_url, build_path, file_exists, remove_links
+from utils import remove_iframes, link_to_text, remove_scripts, save_thumbnail
+from utils import LazyModule, find_files, register_file, forget_file, set_file_index, file_md5, use_manifest_hashes
+from file_index import FileIndex
+from manifest import Manifest
+from item_registry import ItemRegistry, canonical_url
+from page_archive import PageArchive
+from profiling import NullProfiler, StageProfiler
+from concurrency import AdaptiveLimiter, is_overload
+from verify import verify as verify_artifacts
+from scheduler import CrawlScheduler
+from crawl_filter import CrawlFilter
+from retry_queue import RetryQueue
+from storage import StorageManager, format_size, parse_size, report_lines, tree_paths
+from video_store import VideoStore, youtube_id
+from video_transcode import TranscodePool
+from video_worker import VideoWorkerPool, VideoJobError, youtube_dl_extract
+from zip_writer import ReproducibleZipWriter, CompressionPolicy, COMPRESSION_STATS
+from html_optimizer import optimize_html_app, OPTIMIZER_STATS
 import urllib.parse as urlparse
 
+# heavy modules are only imported when a run actually needs them
+bs4 = LazyModule("bs4")
+downloader = LazyModule("ricecooker.utils.downloader")
+jsontrees = LazyModule("ricecooker.utils.jsontrees")
+youtube_dl = LazyModule("youtube_dl")
+
 
 BASE_URL = "https://academy.hsoub.com/"
 
@@ -46,6 +56,30 @@ LOGGER.addHandler(__logging_handler)
 LOGGER.setLevel(logging.INFO)
 
 DOWNLOAD_VIDEOS = True
+ZIP_POLICY = CompressionPolicy()
+OPTIMIZE_HTML = True
+INDEX_TEMPLATE = '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body style="text-align:right;"><div class="main-content-with-sidebar">{}</div><script src="js/scripts.js"></script></body></html>'
+TRANSCODER = None
+VIDEO_WORKERS = None
+PLAYLIST_CACHE = {}
+VIDEO_STORE = VideoStore(DATA_DIR)
+ITEM_REGISTRY = ItemRegistry()
+ARCHIVE = None
+REPLAY = False
+# set while the daemon refreshes single items, their zips are packaged again
+REFRESH = False
+ASSETS = {}
+ASSET_URLS = {
+    "styles.css": "https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css",
+    "scripts.js": "https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js",
+}
+PROFILER = NullProfiler()
+LIMITER = AdaptiveLimiter()
+ITEM_WORKERS = 4
+IMAGE_WORKERS = 4
+CRAWL_FILTER = CrawlFilter()
+RETRY_QUEUE = RetryQueue(os.path.join(DATA_DIR, "retry_queue.json"))
+RETRY_WAIT = 300
 
 sess = requests.Session()
 
@@ -69,10 +103,29 @@ data_nav = OrderedDict([
 ])
 
 
+def home_page(attempts=3):
+    """
+    The navigation, every crawl starts from it. The retry queue can't run
+    the crawl again later, so the home page is retried here a few times.
+    """
+    for attempt in range(1, attempts + 1):
+        with RETRY_QUEUE.collect() as failures:
+            page = download(BASE_URL)
+        if page:
+            return page
+        if REPLAY or not any(retry for _, retry in failures) or attempt == attempts:
+            break
+        time.sleep(2 ** attempt)
+    raise IOError("Could not fetch the navigation from {}: {}".format(
+        BASE_URL, "; ".join(reason for reason, _ in failures) or "not archived"))
+
+
 def browser_resources():
-    page = download(BASE_URL)
+    page = home_page()
     ul01 = page.find(lambda tag: tag.name == "ul" and tag.attrs.get("data-role", "") == "primaryNavBar")
     for name, name_ar in data_nav.items():
+        if not CRAWL_FILTER.category_allowed(name, name_ar):
+            continue
         LOGGER.info("- Category: {} {}".format(name, name_ar))
         li = ul01.find(lambda tag: tag.name == "a" and tag.text.strip() == name_ar)
         ul02 = li.findNext()
@@ -84,6 +137,155 @@ def browser_resources():
         yield category
 
 
+def read_asset(name):
+    """
+    The css or js copied in every html app, read from chefdata once.
+    """
+    if name not in ASSETS:
+        with open(os.path.join(DATA_DIR, name)) as f:
+            ASSETS[name] = f.read()
+    return ASSETS[name]
+
+
+def download_assets():
+    for name, url in ASSET_URLS.items():
+        r = requests.get(url)
+        r.raise_for_status()
+        with open(os.path.join(DATA_DIR, name), "wb") as f:
+            f.write(r.content)
+    ASSETS.clear()
+
+
+def load_assets():
+    """
+    Reads the css and js of the html apps, they are downloaded first if
+    chefdata doesn't have them yet.
+    """
+    if not all(os.path.isfile(os.path.join(DATA_DIR, name)) for name in ASSET_URLS):
+        download_assets()
+    for name in ASSET_URLS:
+        read_asset(name)
+
+
+def listing_pages(categories, workers=8):
+    """
+    Walks the listing pages of every topic concurrently and yields
+    (category, topic, page_number, page_url, entries), the pages of each
+    topic in listing order.
+    """
+    topics = [(category, topic) for category in categories for topic in category.topics]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        paginators = list(executor.map(lambda category_topic: category_topic[1].pages(), topics))
+        # the pages left of each topic, by the position of the topic
+        queued = OrderedDict(
+            (position, deque((category, topic, page_number, page_url)
+                             for page_number, page_url in enumerate(pages, 1)))
+            for position, ((category, topic), pages) in enumerate(zip(topics, paginators)))
+        listing = set()
+        pending = deque()
+
+        def submit_next():
+            # with --sample a topic lists one page at a time and stops once
+            # the caller took its sample
+            for position, jobs in list(queued.items()):
+                if not jobs or CRAWL_FILTER.sample_full(jobs[0][1].source_id):
+                    del queued[position]
+                elif CRAWL_FILTER.sample is None or position not in listing:
+                    job = jobs.popleft()
+                    listing.add(position)
+                    pending.append((position, job, executor.submit(job[1].list_page, job[3])))
+                    return True
+            return False
+
+        while len(pending) < workers and submit_next():
+            pass
+        while pending:
+            position, (category, topic, page_number, page_url), future = pending.popleft()
+            yield category, topic, page_number, page_url, future.result()
+            listing.discard(position)
+            while len(pending) < workers and submit_next():
+                pass
+
+
+def catalogue(categories, workers=8):
+    """
+    Yields the entries of every listing page, without fetching the items
+    themselves. A sample stops the pagination like it does for iter_items.
+    """
+    for category, topic, _, page_url, entries in listing_pages(categories, workers=workers):
+        for entry in CRAWL_FILTER.take_sample(topic.source_id, entries):
+            yield dict(entry, category=category.title, topic=topic.source_id, page=page_url)
+
+
+def node_files(node):
+    """
+    The local files of a node and its children: thumbnails and file paths.
+    """
+    files = []
+    if node.get("thumbnail") and os.path.isfile(node["thumbnail"]):
+        files.append(node["thumbnail"])
+    for file_dict in node.get("files", []):
+        if file_dict.get("path"):
+            files.append(file_dict["path"])
+    for child in node.get("children", []):
+        files.extend(node_files(child))
+    return files
+
+
+def iter_items(categories=None, concurrency=4, listing_workers=8):
+    """
+    Yields every item of categories (all of them by default) as soon as it
+    is packaged, as a dict with its category, topic, listing entry, node
+    and local files.
+    Items are built by concurrency workers while the listings are still
+    being walked, so the first item comes out after one listing page and
+    one item instead of after the whole crawl. The items are also kept in
+    their topics, Category.add_scheduled() puts them in the tree in
+    listing order afterwards. The css and js of the html apps are read from
+    chefdata, or downloaded there first.
+    """
+    load_assets()
+    if categories is None:
+        categories = browser_resources()
+
+    def build(topic, position, entry):
+        item = topic.build_entry(entry)
+        if item is None:
+            return None
+        topic.scheduled[position] = item
+        return item.to_node()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+
+        def finished(block):
+            done, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                category, topic, entry = futures.pop(future)
+                try:
+                    node = future.result()
+                except Exception as e:
+                    LOGGER.info("Item {} failed: {}".format(entry["source_id"], e))
+                    continue
+                if node is not None:
+                    yield dict(category=category.title, topic=topic.source_id, entry=entry,
+                               node=node, files=node_files(node))
+
+        for category, topic, page_number, _, entries in listing_pages(categories, workers=listing_workers):
+            for index, entry in enumerate(CRAWL_FILTER.take_sample(topic.source_id, entries)):
+                futures[executor.submit(build, topic, (page_number, index), entry)] = (category, topic, entry)
+                # bounded queue, the listing walk waits for the item builds
+                yield from finished(block=len(futures) >= concurrency * 2)
+        while futures:
+            yield from finished(block=True)
+
+
+def listing_date(soup):
+    time_tag = soup.find("time")
+    if time_tag is not None:
+        return time_tag.get("datetime", None)
+
+
 class Paginator(object):
     def __init__(self, url, initial=1, last=None):
         self.url = url
@@ -96,6 +298,10 @@ class Paginator(object):
     
     def find_max(self):
         page = download(self.url)
+        if not page:
+            # no pages, the topic is in the retry queue
+            self.last_page = 0
+            return
         li_page = page.find("li", class_="ipsPagination_pageJump")
         if li_page is not None:
             value = li_page.find("input")
@@ -129,7 +335,9 @@ class Node(object):
         self.author = None
 
     def add_node(self, obj):
-        node = obj.to_node()
+        self.add_child(obj.to_node())
+
+    def add_child(self, node):
         if node is not None:
             self.tree_nodes[node["source_id"]] = node
 
@@ -140,7 +348,11 @@ class Node(object):
     @thumbnail.setter
     def thumbnail(self, url):
         key = hashlib.sha1(url.encode("utf-8")).hexdigest()
-        self._thumbnail = save_thumbnail(url, key, DATA_DIR)
+        if REPLAY:
+            saved = find_files(os.path.join(DATA_DIR, "thumbnails"), "{}.*".format(key))
+            self._thumbnail = saved[0] if saved else None
+        else:
+            self._thumbnail = save_thumbnail(url, key, DATA_DIR)
 
     def title_hash(self):
         return hashlib.sha1(self.title.encode("utf-8")).hexdigest()
@@ -165,7 +377,7 @@ class Category(Node):
         self.topics = []
 
     def add_topic(self, title, url, name):
-        if url != "#":
+        if url != "#" and CRAWL_FILTER.topic_allowed(url):
             if name == "Lessons and Articles":
                 self.topics.append(LessonTopic(title, url))
             elif name == "Books and Resources":
@@ -173,84 +385,235 @@ class Category(Node):
             else:
                 self.topics.append(QuestionTopic(title, url))
 
-    def download(self):
+    def add_scheduled(self):
+        # topics cut off by the time budget before any item was built are left out
         for topic in self.topics:
-            topic.download()
-            self.add_node(topic)
-
-
-class LessonTopic(Node):
-    def download(self):
-        LOGGER.info("--- Topic: {}".format(self.source_id))
-        pages = Paginator(self.source_id, initial=1)
-        pages.find_max()
-        for page in pages:
-            LOGGER.info("------ Page: {} of {}".format(page, pages.last_page))
-            page = download(page)
-            div = page.find("div", id="elCmsPageWrap")
-            articles = div.find_all("article")
-            for article_soup in articles:
-                img = article_soup.find("img")
-                title_a = article_soup.find(lambda tag: tag.name == "a" and tag.findParent("h2") and tag.get("href", "").find("/tags/") == -1)
-                title = title_a.text.strip()
-                source_id = title_a.get("href", "")
-                article = Article(title, source_id)
-                article.description = article_soup.find("section").text
-                article.thumbnail = img.get("src", None)
-                article.author = title_a.findNext("a").text.strip()
-                base_path = build_path([DATA_DIR, self.title_hash(), article.title_hash()])
-                article.download(base_path=base_path)
-                self.add_node(article)
-
-
-class BookTopic(Node):
-    def download(self):
-        LOGGER.info("--- Book Topic: {}".format(self.source_id))
-        pages = Paginator(self.source_id, initial=1)
-        pages.find_max()
+            topic.add_scheduled()
+            if topic.tree_nodes:
+                self.add_node(topic)
+
+
+class Topic(Node):
+    """
+    A tag or section listing items over several pages, subclasses parse a
+    listing page into entries and build the item of an entry.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Topic, self).__init__(*args, **kwargs)
+        self.scheduled = {}
+        self.retried = []
+
+    def pages(self):
+        pages = Paginator(self.source_id, initial=CRAWL_FILTER.first_page)
+        with RETRY_QUEUE.collect() as failures:
+            pages.find_max()
+        if failures:
+            RETRY_QUEUE.queue("topic", self.source_id, failures, topic=self.source_id)
+        _, pages.last_page = CRAWL_FILTER.page_range(pages.last_page)
+        return pages
+
+    def list_page(self, page_url):
+        with PROFILER.stage("listing"):
+            with RETRY_QUEUE.collect() as failures:
+                page = download(page_url)
+            if not page:
+                if failures:
+                    RETRY_QUEUE.queue("listing", page_url, failures, topic=self.source_id)
+                return []
+            return [entry for entry in self.listing(page) if CRAWL_FILTER.entry_allowed(entry)]
+
+    def listing(self, page):
+        raise NotImplementedError
+
+    def build_item(self, entry, defer=None):
+        raise NotImplementedError
+
+    def item_path(self, item):
+        return build_path([DATA_DIR, self.title_hash(), item.title_hash()])
+
+    def entry_fetched(self, entry):
+        """
+        Whether a previous run packaged the item of entry, its directory is
+        made before the fetch so only the zip or the PDF counts.
+        """
+        title_hash = hashlib.sha1(entry["title"].encode("utf-8")).hexdigest()
+        item_dir = os.path.join(DATA_DIR, self.title_hash(), title_hash)
+        return bool(find_files(item_dir, "*.zip") or find_files(item_dir, "*.pdf"))
+
+    def build_entry(self, entry, defer=None):
+        return ITEM_REGISTRY.get_or_build(entry["source_id"], lambda: self.build_queued(entry, defer=defer))
+
+    def build_queued(self, entry, defer=None):
+        """
+        Builds the item of entry, the item goes in the retry queue if one of
+        its fetches failed.
+        """
+        with RETRY_QUEUE.collect() as failures:
+            item = self.build_item(entry, defer=defer)
+        if failures:
+            RETRY_QUEUE.add_failures("item", entry["source_id"], failures, topic=self.source_id, entry=entry)
+        else:
+            RETRY_QUEUE.remove("item", entry["source_id"])
+        return item
+
+    def retry_item(self, entry):
+        with RETRY_QUEUE.collect() as failures:
+            item = self.build_item(entry)
+        # replaces the node of the first attempt, if it had one
+        self.retried.append(item)
+        return failures
+
+    def lists(self, source_id):
+        key = canonical_url(source_id)
+        return any(item is not None and canonical_url(item.source_id) == key
+                   for item in self.scheduled.values())
+
+    def retry_listing(self, page_url):
+        with RETRY_QUEUE.collect() as failures:
+            entries = self.list_page(page_url)
+        if failures:
+            return failures
+        for entry in entries:
+            self.retried.append(self.build_queued(entry))
+        return []
+
+    def retry_topic(self):
+        with RETRY_QUEUE.collect() as failures:
+            pages = self.pages()
+        if failures:
+            return failures
+        # failed pages and items of the topic get their own entries
+        for page_url in pages:
+            for entry in self.list_page(page_url):
+                self.retried.append(self.build_queued(entry))
+        return []
+
+    def schedule(self, scheduler, starved):
+        """
+        Queues the listing pages of the topic, each listing page then queues
+        its items with a priority ranking never fetched (or starved by the
+        previous run) before stale, HTML before PDFs before videos, and
+        newer listing positions first.
+        """
+        pages = self.pages()
+        for page_number, page_url in enumerate(pages, 1):
+            scheduler.push((-1, 0, page_number, 0), page_url,
+                           self.schedule_page, scheduler, starved, page_number, page_url)
+
+    def schedule_page(self, scheduler, starved, page_number, page_url):
+        LOGGER.info("------ Page: {}".format(page_url))
+        entries = CRAWL_FILTER.take_sample(self.source_id, self.list_page(page_url))
+        for index, entry in enumerate(entries):
+            if entry["source_id"] in starved:
+                freshness = 0
+            else:
+                freshness = 2 if self.entry_fetched(entry) else 1
+            kind_rank = 1 if entry["kind"] == content_kinds.DOCUMENT else 0
+
+            def defer(job, freshness=freshness, page_number=page_number, index=index, entry=entry):
+                scheduler.push((freshness, 2, page_number, index), entry["source_id"],
+                               self.run_deferred, entry, job)
+            scheduler.push((freshness, kind_rank, page_number, index), entry["source_id"],
+                           self.schedule_item, (page_number, index), entry, defer)
+
+    def schedule_item(self, position, entry, defer):
+        self.scheduled[position] = self.build_entry(entry, defer=defer)
+
+    def run_deferred(self, entry, job):
+        """
+        Runs a job an item deferred (its videos) after the item was built,
+        its failures queue the item of entry for a rebuild.
+        """
+        with RETRY_QUEUE.collect() as failures:
+            job()
+        if failures:
+            RETRY_QUEUE.add_failures("item", entry["source_id"], failures, topic=self.source_id, entry=entry)
+
+    def add_scheduled(self):
+        for position in sorted(self.scheduled):
+            self.add_node(self.scheduled[position])
+        for item in self.retried:
+            self.add_node(item)
+
+
+class LessonTopic(Topic):
+    def listing(self, page):
+        entries = []
+        div = page.find("div", id="elCmsPageWrap")
+        for article_soup in div.find_all("article"):
+            img = article_soup.find("img")
+            title_a = article_soup.find(lambda tag: tag.name == "a" and tag.findParent("h2") and tag.get("href", "").find("/tags/") == -1)
+            entries.append(dict(
+                kind=content_kinds.HTML5,
+                title=title_a.text.strip(),
+                source_id=title_a.get("href", ""),
+                author=title_a.findNext("a").text.strip(),
+                description=article_soup.find("section").text,
+                thumbnail=img.get("src", None) if img is not None else None,
+                updated=listing_date(article_soup)))
+        return entries
+
+    def build_item(self, entry, defer=None):
+        article = Article(entry["title"], entry["source_id"])
+        article.description = entry["description"]
+        if entry["thumbnail"]:
+            article.thumbnail = entry["thumbnail"]
+        article.author = entry["author"]
+        article.download(download=DOWNLOAD_VIDEOS, base_path=self.item_path(article), defer=defer)
+        return article
+
+
+class BookTopic(Topic):
+    def listing(self, page):
+        entries = []
         pattern = "(?P<url>https?://[^\s]+)"
         re_pattern = re.compile(pattern)
-        for page in pages:
-            LOGGER.info("------ Page: {} of {}".format(page, pages.last_page))
-            page = download(page)
-            ol = page.find("ol", class_="ipsDataList")
-            books = ol.find_all("li", class_="ipsDataItem")
-            for book_soup in books:
-                div = book_soup.find_all("div")
-                style = div[0].find("a").get("style", "")
-                img_url = re_pattern.search(style).group("url").replace('"', "")
-                title_a = div[1].find(lambda tag: tag.name == "a" and tag.findParent("h4") and tag.get("href", "").find("/tags/") == -1)
-                title = title_a.text.strip()
-                source_id = title_a.get("href", "")
-                book = Book(title, source_id)
-                book.description = title_a.findNext("div").text.strip()
-                book.thumbnail = img_url
-                book.author = title_a.findNext("a").text.strip()
-                base_path = build_path([DATA_DIR, self.title_hash(), book.title_hash()])
-                book.download(base_path=base_path)
-                self.add_node(book)
-    
+        ol = page.find("ol", class_="ipsDataList")
+        for book_soup in ol.find_all("li", class_="ipsDataItem"):
+            div = book_soup.find_all("div")
+            style = div[0].find("a").get("style", "")
+            img_url = re_pattern.search(style).group("url").replace('"', "")
+            title_a = div[1].find(lambda tag: tag.name == "a" and tag.findParent("h4") and tag.get("href", "").find("/tags/") == -1)
+            entries.append(dict(
+                kind=content_kinds.DOCUMENT,
+                title=title_a.text.strip(),
+                source_id=title_a.get("href", ""),
+                author=title_a.findNext("a").text.strip(),
+                description=title_a.findNext("div").text.strip(),
+                thumbnail=img_url,
+                updated=listing_date(book_soup)))
+        return entries
+
+    def build_item(self, entry, defer=None):
+        book = Book(entry["title"], entry["source_id"])
+        book.description = entry["description"]
+        book.thumbnail = entry["thumbnail"]
+        book.author = entry["author"]
+        book.download(base_path=self.item_path(book))
+        return book
+
+
+class QuestionTopic(Topic):
+    def listing(self, page):
+        entries = []
+        for question_soup in page.find_all("li", class_="cForumQuestion"):
+            div = question_soup.find_all("div")
+            title_a = div[1].find(lambda tag: tag.name == "a" and tag.findParent("h4") and tag.get("href", "").find("/tags/") == -1)
+            entries.append(dict(
+                kind=content_kinds.HTML5,
+                title=title_a.text.strip(),
+                source_id=title_a.get("href", ""),
+                author=title_a.findNext("a").text.strip(),
+                description=None,
+                thumbnail=None,
+                updated=listing_date(question_soup)))
+        return entries
 
-class QuestionTopic(Node):
-    def download(self):
-        LOGGER.info("--- Question and Answers: {}".format(self.source_id))
-        pages = Paginator(self.source_id, initial=1)
-        pages.find_max()
-        for page in pages:
-            LOGGER.info("------ Page: {} of {}".format(page, pages.last_page))
-            page = download(page)
-            div = page.find("div", class_="ipsBox")
-            questions = page.find_all("li", class_="cForumQuestion")
-            for question_soup in questions:
-                div = question_soup.find_all("div")
-                title_a = div[1].find(lambda tag: tag.name == "a" and tag.findParent("h4") and tag.get("href", "").find("/tags/") == -1)
-                title = title_a.text.strip()
-                source_id = title_a.get("href", "")
-                question = Question(title, source_id)
-                question.author = title_a.findNext("a").text.strip()
-                base_path = build_path([DATA_DIR, self.title_hash(), question.title_hash()])
-                question.download(base_path=base_path)
-                self.add_node(question)
+    def build_item(self, entry, defer=None):
+        question = Question(entry["title"], entry["source_id"])
+        question.author = entry["author"]
+        question.download(base_path=self.item_path(question))
+        return question
 
 
 class Article(Node):
@@ -258,7 +621,7 @@ class Article(Node):
         super(Article, self).__init__(*args, **kwargs)
         LOGGER.info("--------- Article: {}".format(self.title))
 
-    def download(self, download=True, base_path=None):
+    def download(self, download=True, base_path=None, defer=None):
         html_app = HTMLApp(self.title, self.source_id)
         html_app.author = self.author
         html_app.thumbnail = self.thumbnail
@@ -266,11 +629,26 @@ class Article(Node):
         html_app.to_file(base_path)
         self.add_node(html_app)
         for url in video_urls:
-            youtube = YouTubeResource(url, lang=self.lang)
-            youtube.download(download, base_path)
-            self.add_node(youtube)
+            # the scheduler runs the videos after the HTML of other items
+            if defer is not None:
+                defer(lambda url=url: self.add_video(url, download, base_path))
+            else:
+                self.add_video(url, download, base_path)
+
+    def add_video(self, url, download, base_path):
+        youtube = YouTubeResource(url, lang=self.lang)
+        if youtube.is_playlist():
+            # one flat extraction, then the videos are fetched concurrently
+            for resource in youtube.download_playlist(download, base_path):
+                self.add_node(resource)
+            return
+        youtube.download(download, base_path)
+        self.add_node(youtube)
 
     def search_urls(self, body):
+        if body is None:
+            # the page failed, build_queued puts the article in the retry queue
+            return set()
         video_urls = self.video_urls(body)
         return video_urls
 
@@ -290,6 +668,9 @@ class Article(Node):
 
     def to_node(self):
         children = list(self.tree_nodes.values())
+        if not children:
+            # nothing packaged, the article waits in the retry queue
+            return None
         if len(children) == 1:
             return children[0]
         else:
@@ -316,46 +697,79 @@ class Book(Node):
 
     def soup(self):
         ##the function "download" was not used here because we need the cookies from this source_id
+        if REPLAY:
+            document = ARCHIVE.get(self.source_id)
+            if document is None:
+                LOGGER.info("Not archived: {}".format(self.source_id))
+                return None, None
+            return bs4.BeautifulSoup(document, 'html5lib').find("aside"), None
+
         headers = {'User-Agent': 'Mozilla/5.0'}
         client = requests.Session()
-        r = client.get(self.source_id, timeout=60, headers=headers)
-        soup = BeautifulSoup(r.text, 'html5lib')
+        with LIMITER.slot() as slot:
+            r = slot.check(client.get(self.source_id, timeout=60, headers=headers))
+        if ARCHIVE is not None:
+            ARCHIVE.put(self.source_id, r.content)
+        soup = bs4.BeautifulSoup(r.text, 'html5lib')
         client.headers.update(headers)
         return soup.find("aside"), client
 
     def download(self, download=True, base_path=None):
-        body, client = self.soup()
-        a = body.find("a")
-        url = a.get("href", "")
+        with PROFILER.stage("pdf"):
+            self.fetch(download=download, base_path=base_path)
+
+    def fetch(self, download=True, base_path=None):
+        # base_path is per book, a PDF in it was saved by a previous run,
+        # a refresh downloads it again
+        saved = find_files(base_path, "*.pdf")
+        if saved and not REFRESH:
+            self.use_saved(saved[0])
+            return
         try:
+            body, client = self.soup()
+            if client is None:
+                return
+            url = body.find("a").get("href", "")
             if download is False:
                 return
             #parsed = urlparse.urlparse(url)
             #csrfKey = str(urlparse.parse_qs(parsed.query)['csrfKey'])
-            response = client.get(url, timeout=60, headers=client.headers)
+            with LIMITER.slot() as slot:
+                response = slot.check(client.get(url, timeout=60, headers=client.headers))
             content_type = response.headers.get('content-type')
             if 'application/pdf' in content_type:
-                self.filename = response.headers.get("Content-Disposition", "").split("=")[1]
-                self.filename = self.filename[1:len(self.filename)-1]
-                self.filepath = os.path.join(base_path, self.filename)
-                if not file_exists(self.filepath):
-                    with open(self.filepath, 'wb') as f:
+                filename = response.headers.get("Content-Disposition", "").split("=")[1]
+                filename = filename[1:len(filename)-1]
+                filepath = os.path.join(base_path, filename)
+                if REFRESH or not file_exists(filepath):
+                    # written aside first, a failed refresh keeps the saved PDF
+                    md5 = hashlib.md5()
+                    with open(filepath + ".tmp", 'wb') as f:
                         for chunk in response.iter_content(10000):
                             f.write(chunk)
-                    LOGGER.info("    - Get file: {}".format(self.filename))
+                            md5.update(chunk)
+                    os.replace(filepath + ".tmp", filepath)
+                    register_file(filepath, md5=md5.hexdigest())
+                    LOGGER.info("    - Get file: {}".format(filename))
                 else:
-                    LOGGER.info("    - File: {} already saved".format(self.filename))
-        except requests.exceptions.HTTPError as e:
-            LOGGER.info("Error: {}".format(e))
-        except requests.exceptions.ConnectionError:
-            ### this is a weird error, may be it's raised when the webpage
-            ### is slow to respond requested resources
-            LOGGER.info("Connection error, the resource will be scraped in 5s...")
-            time.sleep(3)
-        except requests.exceptions.ReadTimeout as e:
-            LOGGER.info("Error: {}".format(e))
-        except requests.exceptions.TooManyRedirects as e:
-            LOGGER.info("Error: {}".format(e))
+                    LOGGER.info("    - File: {} already saved".format(filename))
+                self.filename, self.filepath = filename, filepath
+                for path in saved:
+                    if path != filepath:
+                        # renamed on Hsoub, the old name would be found first
+                        os.remove(path)
+                        forget_file(path)
+        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout, requests.exceptions.TooManyRedirects) as e:
+            RETRY_QUEUE.fail("pdf", self.source_id, e, retry=is_overload(e))
+        finally:
+            if self.filepath is None and saved:
+                self.use_saved(saved[0])
+
+    def use_saved(self, filepath):
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+        LOGGER.info("    - File: {} already saved".format(self.filename))
 
     def to_node(self):
         if self.filepath is not None:
@@ -387,7 +801,8 @@ class Question(Node):
         self.add_node(html_app)
 
     def to_node(self):
-        return list(self.tree_nodes.values())[0]
+        # nothing when the question page couldn't be fetched
+        return next(iter(self.tree_nodes.values()), None)
 
 
 class HTMLApp(object):
@@ -402,7 +817,8 @@ class HTMLApp(object):
         self.body = self.soup()
 
     def soup(self):
-        soup = download(self.source_id)
+        with PROFILER.stage("article"):
+            soup = download(self.source_id)
         if soup:
             return soup.find("article")
 
@@ -432,53 +848,90 @@ class HTMLApp(object):
                     images_urls[img_src] = filename
         return images_urls
 
-    def write_images(self, filepath, images):
-        with html_writer.HTMLWriter(filepath, "a") as zipper:
-            for img_src, img_filename in images.items():
-                try:
-                    if img_src.startswith("data:image/"):
-                        pass
-                    else:
-                        requests.get(img_src, timeout=20)
-                        zipper.write_url(img_src, img_filename, directory="")
-                except requests.exceptions.ConnectionError:
-                    pass
-                except requests.exceptions.HTTPError:
-                    pass
-                except requests.exceptions.MissingSchema:
-                    pass
-                except requests.exceptions.InvalidSchema:
-                    pass
-                except requests.exceptions.ReadTimeout:
-                    pass
-                except requests.exceptions.ConnectTimeout as e:
-                    LOGGER.info(str(e))
-
-    def write_index(self, filepath, content):
-        with html_writer.HTMLWriter(filepath, "w") as zipper:
-            zipper.write_index_contents(content)
-
-    def write_css_js(self, filepath):
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/styles.css") as f:
-            content = f.read()
-            zipper.write_contents("styles.css", content, directory="css/")
-
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/scripts.js") as f:
-            content = f.read()
-            zipper.write_contents("scripts.js", content, directory="js/")
+    def write_images(self, zipper, images):
+        with PROFILER.stage("image"):
+            return self.fetch_images(zipper, images)
+
+    def fetch_images(self, zipper, images):
+        written = {}
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+            for img_filename, content in executor.map(self.fetch_image, images.items()):
+                if content is not None:
+                    zipper.write_contents(img_filename, content, directory="")
+                    written[img_filename] = content
+        return written
+
+    def fetch_image(self, image):
+        img_src, img_filename = image
+        try:
+            if img_src.startswith("data:image/"):
+                pass
+            else:
+                content = fetch_resource(img_src, timeout=20)
+                if content is not None:
+                    return img_filename, ZIP_POLICY.optimize_image(content)
+        except requests.exceptions.ConnectionError:
+            pass
+        except requests.exceptions.HTTPError:
+            pass
+        except requests.exceptions.MissingSchema:
+            pass
+        except requests.exceptions.InvalidSchema:
+            pass
+        except requests.exceptions.ReadTimeout:
+            pass
+        except requests.exceptions.ConnectTimeout as e:
+            LOGGER.info(str(e))
+        return img_filename, None
+
+    def write_index(self, zipper, content):
+        zipper.write_index_contents(content)
+
+    def write_css_js(self, zipper, css, js):
+        zipper.write_contents("styles.css", css, directory="css/")
+        zipper.write_contents("scripts.js", js, directory="js/")
+
+    def write_zip(self, filepath, index, images):
+        css = read_asset("styles.css")
+        js = read_asset("scripts.js")
+        with PROFILER.stage("zip"), ReproducibleZipWriter(filepath, policy=ZIP_POLICY) as zipper:
+            # images go first, the optimizer reads their sizes
+            files = self.write_images(zipper, images)
+            if OPTIMIZE_HTML:
+                with PROFILER.stage("optimize"):
+                    size = len(index.encode("utf-8")) + len(css.encode("utf-8"))
+                    index, css = optimize_html_app(index, css, files, js=js)
+                    LOGGER.info("     * HTML and CSS {} -> {} bytes".format(
+                        size, len(index.encode("utf-8")) + len(css.encode("utf-8"))))
+            self.write_index(zipper, index)
+            self.write_css_js(zipper, css, js)
+        register_file(filepath, md5=zipper.md5)
+
+    def render(self):
+        with PROFILER.stage("clean"):
+            body = self.clean(self.body)
+            images = self.to_local_images(body)
+        return INDEX_TEMPLATE.format(body), images
 
     def to_file(self, base_path):
-        self.filepath = "{path}/{name}.zip".format(path=base_path, name=self.title_hash())
-        if file_exists(self.filepath):
-            LOGGER.info("     * File exists {}".format(self.filepath))
-            return True
+        """
+        Packages the zip of the app in base_path, filepath is only set once
+        there is a zip to point at.
+        """
+        filepath = "{path}/{name}.zip".format(path=base_path, name=self.title_hash())
+        # replay runs repackage from the archive to pick up parsing changes
+        if file_exists(filepath) and not (REPLAY or REFRESH):
+            LOGGER.info("     * File exists {}".format(filepath))
+            self.filepath = filepath
+            return
         if self.body is None:
-            return False
-        body = self.clean(self.body)
-        images = self.to_local_images(body)
-        self.write_index(self.filepath, '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body style="text-align:right;"><div class="main-content-with-sidebar">{}</div><script src="js/scripts.js"></script></body></html>'.format(body))
-        self.write_images(self.filepath, images)
-        self.write_css_js(self.filepath)
+            if file_exists(filepath):
+                # the page couldn't be fetched again, the last zip stays
+                self.filepath = filepath
+            return
+        index, images = self.render()
+        self.write_zip(filepath, index, images)
+        self.filepath = filepath
 
     def to_node(self):
         if self.filepath is not None:
@@ -499,7 +952,8 @@ class HTMLApp(object):
 
 class HTMLAppQA(HTMLApp):
     def soup(self):
-        soup = download(self.source_id)
+        with PROFILER.stage("article"):
+            soup = download(self.source_id)
         if soup:
             return soup.find_all("article")
 
@@ -509,21 +963,14 @@ class HTMLAppQA(HTMLApp):
         remove_scripts(content)
         return content
 
-    def to_file(self, base_path):
-        self.filepath = "{path}/{name}.zip".format(path=base_path, name=self.title_hash())
-        if file_exists(self.filepath):
-            LOGGER.info("     * File exists {}".format(self.filepath))
-            return True
-        if self.body is None:
-            return False
+    def render(self):
         articles = ["<h2>{}</h2>".format(self.title)]
         images = {}
-        for article in self.body:
-            images.update(self.to_local_images(article))
-            articles.append(str(self.clean(article)))
-        self.write_index(self.filepath, '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body style="text-align:right;"><div class="main-content-with-sidebar">{}</div><script src="js/scripts.js"></script></body></html>'.format("".join(articles)))
-        self.write_images(self.filepath, images)
-        self.write_css_js(self.filepath)
+        with PROFILER.stage("clean"):
+            for article in self.body:
+                images.update(self.to_local_images(article))
+                articles.append(str(self.clean(article)))
+        return INDEX_TEMPLATE.format("".join(articles)), images
 
 
 
@@ -544,6 +991,9 @@ class YouTubeResource(object):
         self.file_format = file_formats.MP4
         self.lang = lang
         self.is_valid = False
+        self.video_id = None
+        self.subtitles = None
+        self.error = None
 
     def clean_url(self, url):
         if len(url) == 0:
@@ -565,38 +1015,56 @@ class YouTubeResource(object):
         url = "".join(url.split("?")[:1])
         return url.replace("embed/", "watch?v=").strip()
 
-    def playlist_links(self):
+    def is_playlist(self):
+        return "/playlist" in self.source_id and "list=" in self.source_id
+
+    def playlist_id(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.source_id).query)
+        return query.get("list", [self.source_id])[0]
+
+    def playlist_entries(self):
+        # one flat extraction returns the ids and titles of every entry,
+        # instead of an extract_info call per video
+        playlist_id = self.playlist_id()
+        if playlist_id in PLAYLIST_CACHE:
+            return PLAYLIST_CACHE[playlist_id]
+        if REPLAY:
+            return []
+
         ydl_options = {
                 'no_warnings': True,
-                'restrictfilenames':True,
-                'continuedl': True,
-                'quiet': False,
-                'format': "bestvideo[height<={maxheight}][ext=mp4]+bestaudio[ext=m4a]/best[height<={maxheight}][ext=mp4]".format(maxheight='480'),
+                'quiet': True,
+                'extract_flat': 'in_playlist',
                 'noplaylist': False
             }
 
-        playlist_videos_url = []
-        with youtube_dl.YoutubeDL(ydl_options) as ydl:
-            try:
-                ydl.add_default_info_extractors()
-                info = ydl.extract_info(self.source_id, download=False)
-                for entry in info["entries"]:
-                    playlist_videos_url.append(entry["webpage_url"])
-            except(youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
-                    youtube_dl.utils.ExtractorError) as e:
-                LOGGER.info('An error occured ' + str(e))
-                LOGGER.info(self.source_id)
-            except KeyError as e:
-                LOGGER.info(str(e))
-        return playlist_videos_url
-
-    def playlist_name_links(self):
-        name_url = []
-        for url in self.playlist_links():
-            youtube = YouTubeResource(url)
-            info = youtube.get_video_info(None, False)
-            name_url.append((info["title"], url))
-        return name_url
+        entries = []
+        info = self.extract_info(ydl_options)
+        if info is None:
+            return entries
+        for entry in info.get("entries") or []:
+            video_id = entry.get("id")
+            if video_id is None:
+                continue
+            url = "https://www.youtube.com/watch?v={}".format(video_id)
+            entries.append((entry.get("title") or video_id, url))
+        PLAYLIST_CACHE[playlist_id] = entries
+        return entries
+
+    def download_playlist(self, download=True, base_path=None, workers=4):
+        resources = [YouTubeResource(url, name=name, lang=self.lang, section_title=self.section_title)
+                     for name, url in self.playlist_entries()]
+
+        def fetch(resource):
+            with RETRY_QUEUE.collect() as failures:
+                resource.download(download, base_path)
+            return failures
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            failures = [failure for failed in executor.map(fetch, resources) for failure in failed]
+        if failures:
+            # failed on the pool threads, passed on to the collect() of the item
+            RETRY_QUEUE.queue("playlist", self.source_id, failures)
+        return resources
 
     def get_video_info(self, download_to=None, subtitles=True):
         ydl_options = {
@@ -608,66 +1076,94 @@ class YouTubeResource(object):
                 'quiet': False,
                 'format': "bestvideo[height<={maxheight}][ext=mp4]+bestaudio[ext=m4a]/best[height<={maxheight}][ext=mp4]".format(maxheight='480'),
                 'outtmpl': '{}/%(id)s'.format(download_to),
-                'noplaylist': True
+                'noplaylist': True,
+                # the download lists the subtitles too, subtitles_dict needs no extraction of its own
+                'list_subtitles': download_to is not None,
             }
-
-        with youtube_dl.YoutubeDL(ydl_options) as ydl:
+        return self.extract_info(ydl_options, download_to=download_to)
+
+    def extract_info(self, ydl_options, download_to=None):
+        """
+        Runs youtube_dl in a supervised worker process when VIDEO_WORKERS is
+        set, so a hung or crashing extraction can't take the crawl with it.
+        """
+        if VIDEO_WORKERS is not None:
             try:
-                ydl.add_default_info_extractors()
-                info = ydl.extract_info(self.source_id, download=(download_to is not None))
-                return info
-            except(youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
-                    youtube_dl.utils.ExtractorError) as e:
+                return VIDEO_WORKERS.run(self.source_id, download_to=download_to, options=ydl_options)
+            except VideoJobError as e:
+                self.error = str(e)
                 LOGGER.info('An error occured ' + str(e))
                 LOGGER.info(self.source_id)
-            except KeyError as e:
-                LOGGER.info(str(e))
+                return None
+
+        try:
+            return youtube_dl_extract(self.source_id, download_to, ydl_options, lambda done: None)
+        except(youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
+                youtube_dl.utils.ExtractorError) as e:
+            self.error = str(e)
+            LOGGER.info('An error occured ' + str(e))
+            LOGGER.info(self.source_id)
+        except KeyError as e:
+            LOGGER.info(str(e))
 
     def subtitles_dict(self):
-        subs = []
-        video_info = self.get_video_info()
-        if video_info is not None:
-            video_id = video_info["id"]
-            if 'subtitles' in video_info:
-                subtitles_info = video_info["subtitles"]
-                for language in subtitles_info.keys():
-                    subs.append(dict(file_type=SUBTITLES_FILE, youtube_id=video_id, language=language))
-        return subs
+        languages = self.subtitles
+        if languages is None and not REPLAY:
+            # a video downloaded before the store kept its subtitles
+            video_info = self.get_video_info()
+            if video_info is not None:
+                languages = list(video_info.get("subtitles") or {})
+                VIDEO_STORE.set_subtitles(self.video_id, languages)
+        return [dict(file_type=jsontrees.SUBTITLES_FILE, youtube_id=self.video_id, language=language)
+                for language in languages or []]
 
     #youtubedl has some troubles downloading videos in youtube,
     #sometimes raises connection error
     #for that I choose pafy for downloading
     def download(self, download=True, base_path=None):
+        with PROFILER.stage("video"):
+            self.fetch(download=download, base_path=base_path)
+
+    def fetch(self, download=True, base_path=None):
         if not "watch?" in self.source_id or "/user/" in self.source_id or\
             download is False:
             return
 
-        download_to = build_path([base_path, 'videos'])
-        for i in range(4):
-            try:
-                info = self.get_video_info(download_to=download_to, subtitles=False)
-                if info is not None:
-                    LOGGER.info("    + Video resolution: {}x{}".format(info.get("width", ""), info.get("height", "")))
-                    self.filepath = os.path.join(download_to, "{}.mp4".format(info["id"]))
-                    self.filename = info["title"]
-                    if self.filepath is not None and os.stat(self.filepath).st_size == 0:
-                        LOGGER.info("    + Empty file")
-                        self.filepath = None
-            except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
-                LOGGER.info(e)
-                LOGGER.info("Download retry")
-                time.sleep(.8)
-            except (youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
-                    youtube_dl.utils.ExtractorError, OSError) as e:
-                LOGGER.info("     + An error ocurred, may be the video is not available.")
-                return
-            except OSError:
-                return
-            else:
-                return
+        video_id = youtube_id(self.source_id)
+        if video_id is None:
+            return
+
+        # videos are shared by every article that links them
+        if REPLAY:
+            fetch = lambda download_to: None
+        else:
+            fetch = lambda download_to: self.get_video_info(download_to=download_to, subtitles=False)
+        try:
+            info = VIDEO_STORE.get(video_id, fetch)
+        except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
+            RETRY_QUEUE.fail("video", self.source_id, e)
+            return
+        if info is None:
+            # get_video_info logged why
+            if not REPLAY:
+                RETRY_QUEUE.fail("video", self.source_id, self.error or "no video info")
+            return
+        LOGGER.info("    + Video resolution: {}x{}".format(info.get("width", ""), info.get("height", "")))
+        self.video_id = video_id
+        self.subtitles = info.get("subtitles")
+        self.filepath = VIDEO_STORE.video_path(video_id)
+        self.filename = info["title"]
+        if self.filepath is not None and os.stat(self.filepath).st_size == 0:
+            LOGGER.info("    + Empty file")
+            self.filepath = None
+        else:
+            register_file(self.filepath, md5=info.get("md5"))
+            if TRANSCODER is not None:
+                TRANSCODER.submit(self.video_id, self.filepath)
 
     def to_node(self):
         if self.filepath is not None:
+            # points at the download, resolve_transcodes swaps in the transcode
             files = [dict(file_type=content_kinds.VIDEO, path=self.filepath)]
             files += self.subtitles_dict()
             node = dict(
@@ -683,63 +1179,282 @@ class YouTubeResource(object):
             return node
 
 
+def resolve_transcodes(node, deadline=None):
+    """
+    Waits for the transcodes of the videos of node and puts their paths in
+    it. The items only submit them, so ffmpeg runs while the crawl goes on.
+    Videos not transcoded by deadline keep their download.
+    """
+    if TRANSCODER is not None and node is not None:
+        for path in TRANSCODER.resolve_tree(node, deadline=deadline):
+            # ffmpeg wrote it, hashed here once instead of by the upload
+            file_md5(path)
+    return node
+
+
+def fetch_resource(url, timeout=60):
+    """
+    Fetches the raw bytes of a page resource (images), going through the
+    archive like download() does.
+    """
+    if REPLAY:
+        return ARCHIVE.get(url)
+    with LIMITER.slot() as slot:
+        r = slot.check(sess.get(url, timeout=timeout))
+    r.raise_for_status()
+    if ARCHIVE is not None:
+        ARCHIVE.put(url, r.content)
+    return r.content
+
+
 def download(source_id):
-    tries = 0
-    while tries < 4:
-        try:
+    if REPLAY:
+        document = ARCHIVE.get(source_id)
+        if document is None:
+            LOGGER.info("Not archived: {}".format(source_id))
+            return False
+        return bs4.BeautifulSoup(document, 'html5lib')
+
+    # failures are retried by the retry pass at the end of the run
+    try:
+        with LIMITER.slot():
             document = downloader.read(source_id, loadjs=False, session=sess)
-        except requests.exceptions.HTTPError as e:
-            LOGGER.info("Error: {}".format(e))
-        except requests.exceptions.ConnectionError:
-            ### this is a weird error, may be it's raised when the webpage
-            ### is slow to respond requested resources
-            LOGGER.info("Connection error, the resource will be scraped in 5s...")
-            time.sleep(3)
-        except requests.exceptions.TooManyRedirects as e:
-            LOGGER.info("Error: {}".format(e))
-        else:
-            return BeautifulSoup(document, 'html5lib') #html5lib
-        tries += 1
-    return False
+        if ARCHIVE is not None:
+            ARCHIVE.put(source_id, document)
+    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout, requests.exceptions.TooManyRedirects) as e:
+        RETRY_QUEUE.fail("page", source_id, e, retry=is_overload(e))
+        return False
+    return bs4.BeautifulSoup(document, 'html5lib') #html5lib
 
 
 
 # The chef subclass
 ################################################################################
-class HsoubAcademyChef(JsonTreeChef):
+class HsoubAcademyChef(object):
+    """
+    The crawl and tree writing of the chef. make_chef() mixes it with
+    ricecooker's JsonTreeChef to upload, the daemon and the scripts use it
+    on its own.
+    """
     HOSTNAME = BASE_URL
     TREES_DATA_DIR = os.path.join(DATA_DIR, 'trees')
     SCRAPING_STAGE_OUTPUT_TPL = 'ricecooker_json_tree.json'
+    PREVIOUS_STAGE_OUTPUT_TPL = 'ricecooker_json_tree.prev.json'
+    CHANGED_STAGE_OUTPUT_TPL = 'ricecooker_json_tree.changed.json'
+    DIFF_REPORT_TPL = 'tree_diff.json'
+    HASHES_TPL = 'ricecooker_json_tree.hashes.json'
+    PREVIOUS_HASHES_TPL = 'ricecooker_json_tree.prev.hashes.json'
+    ITEMS_STREAM_TPL = 'items.jsonl'
     THUMBNAIL = ""
 
     def __init__(self):
         build_path([HsoubAcademyChef.TREES_DATA_DIR])
         self.scrape_stage = os.path.join(HsoubAcademyChef.TREES_DATA_DIR, 
                                 HsoubAcademyChef.SCRAPING_STAGE_OUTPUT_TPL)
+        # whether the scraped tree holds every item of the channel
+        self.complete = True
         super(HsoubAcademyChef, self).__init__()
 
+    def run(self, args, options):
+        if int(options.get('--catalogue', "0")) == 1:
+            self.write_catalogue(options)
+        else:
+            use_manifest_hashes()
+            super(HsoubAcademyChef, self).run(args, options)
+
+    def write_catalogue(self, options):
+        global CRAWL_FILTER
+        CRAWL_FILTER = CrawlFilter.from_options(options)
+        filepath = os.path.join(DATA_DIR, "catalogue.jsonl")
+        workers = int(options.get('--catalogue-workers', "8"))
+        kinds = defaultdict(int)
+        with open(filepath, "w") as f:
+            for entry in catalogue(browser_resources(), workers=workers):
+                kinds[entry["kind"]] += 1
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        LOGGER.info("Catalogue {}: {}".format(filepath, ", ".join(
+            "{} {}".format(count, kind) for kind, count in kinds.items())))
+
     def pre_run(self, args, options):
-        self.download_css_js()
-        channel_tree = self.scrape(args, options)
+        if int(options.get('--use-tree', "0")) == 1 and file_exists(self.scrape_stage):
+            # uploads the tree written by the daemon or a previous run
+            return
+        manifest, storage = self.prepare(options)
+        try:
+            self.download_css_js()
+            channel_tree = self.scrape(args, options)
+            self.save_tree(channel_tree, storage, complete=self.complete)
+        finally:
+            self.finish(manifest)
+
+    def prepare(self, options):
+        """
+        Sets up the archive, the manifest, the storage manager and the file
+        index of a run, returns (manifest, storage).
+        """
+        global ARCHIVE, REPLAY, PROFILER
+        if int(options.get('--profile', "0")) == 1:
+            PROFILER = StageProfiler(os.path.join(DATA_DIR, "profiles"))
+            PROFILER.start()
+        REPLAY = int(options.get('--replay', "0")) == 1
+        if REPLAY or int(options.get('--archive', "0")) == 1:
+            ARCHIVE = PageArchive(os.path.join(DATA_DIR, "archive", "pages"))
+            reclaimed = ARCHIVE.compact()
+            if reclaimed:
+                LOGGER.info("Page archive compacted, {} of replaced pages removed".format(format_size(reclaimed)))
+            LOGGER.info("Page archive: {} pages{}".format(len(ARCHIVE), ", replay mode" if REPLAY else ""))
+        if int(options.get('--verify', "0")) == 1:
+            verify_artifacts(DATA_DIR, workers=int(options.get('--verify-workers', "8")))
+        # the manifest also keeps the md5 of every file written by this run
+        manifest = Manifest(os.path.join(DATA_DIR, "manifest.json"))
+        quota = options.get('--quota', None)
+        orphan_days = options.get('--orphan-days', None)
+        storage = StorageManager(DATA_DIR, manifest=manifest,
+            quota=parse_size(quota) if quota is not None else None,
+            max_age=float(orphan_days) * 86400 if orphan_days is not None else None)
+        if (quota is not None or orphan_days is not None) and file_exists(self.scrape_stage):
+            # make room before the crawl, keeping what the last tree uses, it
+            # may have been a partial one
+            with open(self.scrape_stage) as f:
+                self.log_storage(storage.collect(tree_paths(json.load(f)), complete=False))
+        # one scan of chefdata answers every file_exists/build_path of the run,
+        # the files evicted after a crawl or daemon job are dropped from it
+        storage.index = FileIndex(DATA_DIR, manifest=manifest)
+        set_file_index(storage.index)
+        return manifest, storage
+
+    def save_tree(self, channel_tree, storage, complete=True):
+        previous_tree = self.read_previous_tree()
+        previous_hashes = self.read_previous_hashes()
         self.write_tree_to_json(channel_tree)
+        # the next diff compares against these, not against what is on disk then
+        hashes = tree_hashes(channel_tree)
+        with open(os.path.join(HsoubAcademyChef.TREES_DATA_DIR, HsoubAcademyChef.HASHES_TPL), "w") as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+        if previous_tree is not None:
+            self.write_tree_diff(previous_tree, channel_tree, previous_hashes, hashes)
+        # records which files this tree uses, evicts if over quota
+        self.log_storage(storage.collect(tree_paths(channel_tree), complete=complete))
+
+    def finish(self, manifest):
+        manifest.save()
+        RETRY_QUEUE.save()
+        PROFILER.stop()
+
+    def log_storage(self, report):
+        for line in report_lines(report):
+            LOGGER.info(line)
+
+    def read_previous_tree(self):
+        if not file_exists(self.scrape_stage):
+            return None
+        previous_stage = os.path.join(HsoubAcademyChef.TREES_DATA_DIR,
+                                HsoubAcademyChef.PREVIOUS_STAGE_OUTPUT_TPL)
+        os.replace(self.scrape_stage, previous_stage)
+        with open(previous_stage) as f:
+            return json.load(f)
+
+    def read_previous_hashes(self):
+        hashes_path = os.path.join(HsoubAcademyChef.TREES_DATA_DIR, HsoubAcademyChef.HASHES_TPL)
+        if not os.path.isfile(hashes_path):
+            return None
+        previous_hashes = os.path.join(HsoubAcademyChef.TREES_DATA_DIR,
+                                HsoubAcademyChef.PREVIOUS_HASHES_TPL)
+        os.replace(hashes_path, previous_hashes)
+        with open(previous_hashes) as f:
+            return json.load(f)
+
+    def write_tree_diff(self, previous_tree, channel_tree, previous_hashes=None, hashes=None):
+        # a report of what changed, the upload still reads the full tree:
+        # Studio rebuilds the channel from it, ricecooker sends only new files
+        diff = diff_trees(previous_tree, channel_tree, old_hashes=previous_hashes, new_hashes=hashes)
+        report = write_report(diff, os.path.join(HsoubAcademyChef.TREES_DATA_DIR,
+                                HsoubAcademyChef.DIFF_REPORT_TPL))
+        changed_tree = changed_subtree(channel_tree, diff)
+        if changed_tree is not None:
+            jsontrees.write_tree_to_json_tree(os.path.join(HsoubAcademyChef.TREES_DATA_DIR,
+                                HsoubAcademyChef.CHANGED_STAGE_OUTPUT_TPL), changed_tree)
+        LOGGER.info("Tree diff: {} added, {} removed, {} modified, {} changed files ({} bytes)".format(
+            len(diff["added"]), len(diff["removed"]), len(diff["modified"]),
+            len(diff["changed_files"]), report["changed_files_size"]))
 
     def download_css_js(self):
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css")
-        with open("chefdata/styles.css", "wb") as f:
-            f.write(r.content)
-
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js")
-        with open("chefdata/scripts.js", "wb") as f:
-            f.write(r.content)
+        if REPLAY and file_exists("chefdata/styles.css") and file_exists("chefdata/scripts.js"):
+            return
+        download_assets()
 
     def scrape(self, args, options):
+        self.configure(options)
+        self.complete = CRAWL_FILTER.complete()
+        time_budget = options.get('--time-budget', None)
+        deadline = None
+        if time_budget is not None:
+            deadline = time.time() + float(time_budget)
+            categories = self.scheduled_scrape(list(browser_resources()), float(time_budget))
+        else:
+            categories = list(browser_resources())
+            self.stream_items(categories)
+        channel_tree = self.channel_tree(categories, deadline=deadline)
+        if TRANSCODER is not None:
+            # the transcodes left past the budget are picked up by the next run
+            TRANSCODER.shutdown(cancel=deadline is not None)
+            LOGGER.info("Video transcoding saved {} bytes".format(TRANSCODER.saved_bytes))
+        self.log_reports()
+        return channel_tree
+
+    def configure(self, options):
+        """
+        Sets the module wide crawl settings and pools from the options.
+        """
         download_video = options.get('--download-video', "1")
 
         if int(download_video) == 0:
             global DOWNLOAD_VIDEOS
             DOWNLOAD_VIDEOS = False
 
-        global channel_tree
+        global CRAWL_FILTER
+        CRAWL_FILTER = CrawlFilter.from_options(options)
+
+        global ZIP_POLICY
+        ZIP_POLICY = CompressionPolicy(
+            text_level=int(options.get('--zip-text-level', "6")),
+            store_media=int(options.get('--zip-store-media', "1")) == 1,
+            max_image_width=int(options.get('--max-image-width', "0")) or None,
+            image_quality=int(options.get('--image-quality', "0")) or None)
+
+        global OPTIMIZE_HTML
+        OPTIMIZE_HTML = int(options.get('--optimize-html', "1")) == 1
+
+        global RETRY_QUEUE, RETRY_WAIT
+        RETRY_QUEUE = RetryQueue(os.path.join(DATA_DIR, "retry_queue.json"),
+            max_attempts=int(options.get('--retry-attempts', "5")),
+            delay=float(options.get('--retry-delay', "30")))
+        RETRY_WAIT = float(options.get('--retry-wait', "300"))
+
+        global LIMITER, ITEM_WORKERS
+        ITEM_WORKERS = int(options.get('--workers', "4"))
+        LIMITER = AdaptiveLimiter(
+            initial=int(options.get('--min-concurrency', "1")),
+            minimum=int(options.get('--min-concurrency', "1")),
+            maximum=int(options.get('--max-concurrency', "16")),
+            target_latency=float(options.get('--target-latency', "2.0")))
+
+        video_workers = int(options.get('--video-workers', "2"))
+        if video_workers > 0:
+            global VIDEO_WORKERS
+            VIDEO_WORKERS = VideoWorkerPool(workers=video_workers,
+                timeout=float(options.get('--video-timeout', "3600")),
+                stall_timeout=float(options.get('--video-stall-timeout', "300")),
+                extractor=options.get('--video-extractor', "video_worker:youtube_dl_extract"))
+
+        transcode_profile = options.get('--transcode-profile', None)
+        if transcode_profile is not None:
+            global TRANSCODER
+            TRANSCODER = TranscodePool(transcode_profile, DATA_DIR,
+                workers=int(options.get('--transcode-workers', "2")))
+
+    def channel_tree(self, categories, deadline=None):
         channel_tree = dict(
                 source_domain=HsoubAcademyChef.HOSTNAME,
                 source_id=BASE_URL,
@@ -753,18 +1468,120 @@ class HsoubAcademyChef(JsonTreeChef):
                 license=LICENSE,
             )
 
-        for category in browser_resources():
-            category.download()
-            channel_tree["children"].append(category.to_node())
-
-        return channel_tree
+        for category in categories:
+            if category.tree_nodes:
+                channel_tree["children"].append(category.to_node())
+        return resolve_transcodes(channel_tree, deadline=deadline)
+
+    def log_reports(self):
+        LOGGER.info(LIMITER.report())
+        LOGGER.info(ITEM_REGISTRY.report())
+        LOGGER.info("Videos: {} downloaded, {} reused".format(VIDEO_STORE.downloads, VIDEO_STORE.reused))
+        if VIDEO_WORKERS is not None:
+            LOGGER.info(VIDEO_WORKERS.report())
+        LOGGER.info("Zip compression:")
+        for line in COMPRESSION_STATS.report():
+            LOGGER.info("    {}".format(line))
+        for line in RETRY_QUEUE.report():
+            LOGGER.info(line)
+        if OPTIMIZE_HTML:
+            LOGGER.info(OPTIMIZER_STATS.report())
+
+    def stream_items(self, categories, on_item=None):
+        """
+        Builds the items through iter_items and appends each node to
+        chefdata/trees/items.jsonl as soon as it is packaged, on_item(item)
+        is called for each of them too.
+        """
+        items_path = os.path.join(HsoubAcademyChef.TREES_DATA_DIR, HsoubAcademyChef.ITEMS_STREAM_TPL)
+        with open(items_path, "w") as f:
+            for item in iter_items(categories, concurrency=ITEM_WORKERS):
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                f.flush()
+                if on_item is not None:
+                    on_item(item)
+        self.retry_failed(categories)
+        for category in categories:
+            category.add_scheduled()
+
+    def retry_failed(self, categories, deadline=None):
+        """
+        Retries the items and listing pages that failed in this run or a
+        previous one, waiting up to RETRY_WAIT seconds for their backoff and
+        starting nothing after deadline (a time.time() value). The items
+        recovered replace their failed nodes in every topic listing them.
+        """
+        if REPLAY:
+            return
+        topics = dict((topic.source_id, topic) for category in categories for topic in category.topics)
+
+        def retry(entry):
+            topic = topics.get(entry.get("topic"))
+            if topic is None:
+                # not crawled in this run
+                return None
+            if entry["kind"] == "topic":
+                return topic.retry_topic()
+            if entry["kind"] == "listing":
+                return topic.retry_listing(entry["key"])
+            failures = topic.retry_item(entry["entry"])
+            for other in topics.values():
+                if other is not topic and other.lists(entry["key"]):
+                    other.retried.append(topic.retried[-1])
+            return failures
+
+        handlers = dict(topic=retry, listing=retry, item=retry)
+        for entry_key in RETRY_QUEUE.drop_others(handlers):
+            LOGGER.info("Dropped {} from the retry queue, nothing retries it".format(entry_key))
+        recovered = RETRY_QUEUE.retry(handlers, max_wait=RETRY_WAIT, deadline=deadline)
+        LOGGER.info("Retry pass: {} recovered".format(recovered))
+
+    def scheduled_scrape(self, categories, time_budget):
+        """
+        Crawls by priority until time_budget seconds have passed, the tree
+        holds the items finished by then. The items left are saved in the
+        checkpoint and go first in the next run.
+        """
+        checkpoint_path = os.path.join(DATA_DIR, "checkpoint.json")
+        starved = set()
+        if file_exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                starved = set(json.load(f).get("pending", []))
+
+        deadline = time.time() + time_budget
+        scheduler = CrawlScheduler(time_budget=time_budget, workers=ITEM_WORKERS)
+        for category in categories:
+            for topic in category.topics:
+                scheduler.push((-1, -1, 0, 0), topic.source_id, topic.schedule, scheduler, starved)
+        scheduler.run()
+        # within what is left of the budget, the rest waits for the next run
+        self.retry_failed(categories, deadline=deadline)
+        for category in categories:
+            category.add_scheduled()
+
+        pending = scheduler.pending()
+        if pending:
+            self.complete = False
+        with open(checkpoint_path, "w") as f:
+            json.dump(dict(pending=pending, failed=scheduler.failed, done=scheduler.done,
+                           finished=time.strftime("%Y-%m-%dT%H:%M:%S")), f, indent=2, ensure_ascii=False)
+        LOGGER.info("Scheduled crawl: {} jobs done, {} failed, {} left for the next run".format(
+            scheduler.done, len(scheduler.failed), len(pending)))
+        return categories
 
     def write_tree_to_json(self, channel_tree):
-        write_tree_to_json_tree(self.scrape_stage, channel_tree)
+        jsontrees.write_tree_to_json_tree(self.scrape_stage, channel_tree)
+
+
+def make_chef():
+    # ricecooker.chefs pulls in youtube_dl, pressurecooker and the upload
+    # code, it is only imported to run the chef
+    from ricecooker.chefs import JsonTreeChef
+    return type("HsoubAcademyChef", (HsoubAcademyChef, JsonTreeChef), {})()
 
 
 # CLI
 ################################################################################
 if __name__ == '__main__':
-    chef = HsoubAcademyChef()
+    chef = make_chef()
     chef.main()
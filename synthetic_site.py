@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+import argparse
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import struct
+import threading
+import urllib.parse as urlparse
+import zlib
+
+
+WORDS = ["البرمجة", "الحاسوب", "تطوير", "الويب", "قاعدة", "البيانات", "الخادم", "المتصفح",
+         "الشبكة", "التصميم", "الواجهة", "المستخدم", "الأمان", "التطبيق", "الملف", "الدالة",
+         "المتغير", "الصنف", "الكائن", "المكتبة", "الإطار", "الاختبار", "النشر", "السحابة",
+         "ريادة", "الأعمال", "التسويق", "المحتوى", "الكتابة", "الترجمة", "الصورة", "الفيديو"]
+
+# kind of the topics of each data_nav category, by its arabic name
+CATEGORIES = [("دروس ومقالات", "lessons"), ("كتب وملفات", "books"), ("أسئلة وأجوبة", "questions")]
+
+PAGE_TEMPLATE = '<!DOCTYPE html><html lang="ar" dir="rtl"><head><meta charset="utf-8"><title>{title}</title></head><body><nav><ul data-role="primaryNavBar">{nav}</ul></nav><main>{content}</main></body></html>'
+
+
+def png_bytes(width, height, seed):
+    """
+    A valid grayscale PNG, the pixels depend on seed so images don't
+    compress to nothing.
+    """
+    rows = []
+    for y in range(height):
+        rows.append(b"\x00" + bytes((x * seed + y * 7 + (x ^ y)) & 255 for x in range(width)))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    return b"".join([b"\x89PNG\r\n\x1a\n",
+                     chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+                     chunk(b"IDAT", zlib.compress(b"".join(rows))),
+                     chunk(b"IEND", b"")])
+
+
+def pdf_bytes(title, size):
+    """
+    A one page PDF padded to about size bytes.
+    """
+    head = ("%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+            "2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+            "3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+            "% {}\n").format(title).encode("utf-8")
+    tail = b"trailer<</Root 1 0 R>>\n%%EOF\n"
+    padding = max(0, size - len(head) - len(tail))
+    return head + b"".join(b"% " + b"x" * 76 + b"\n" for _ in range(padding // 79)) + tail
+
+
+class SyntheticSite(object):
+    """
+    Generates on request an Invision Community site with the structure the
+    scrapers read: the primaryNavBar, topic listings paginated with
+    ipsPagination_pageJump (elCmsPageWrap articles, ipsDataList books and
+    cForumQuestion threads), article and question pages with images, and
+    book pages with a PDF download. Nothing is kept in memory, every page
+    is derived from its URL and seed, so the same URL always gets the same
+    bytes.
+    """
+    def __init__(self, base_url, topics=4, pages=5, items=20, paragraphs=8, images=2,
+                 image_size=160, pdf_size=64 * 1024, shared=0.05, seed=0):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.topics = topics
+        self.pages = pages
+        self.items = items
+        self.paragraphs = paragraphs
+        self.images = images
+        self.image_size = image_size
+        self.pdf_size = pdf_size
+        # share of the listing entries that point at an item of the previous topic
+        self.shared = shared
+        self.seed = seed
+
+    def url(self, path):
+        return urlparse.urljoin(self.base_url, path)
+
+    def random(self, *key):
+        return random.Random("{}:{}".format(self.seed, ":".join(str(part) for part in key)))
+
+    def text(self, rng, words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    def item_count(self):
+        return len(CATEGORIES) * self.topics * self.pages * self.items
+
+    def render(self, path, query):
+        """
+        Returns (status, content type, body, headers) for a request.
+        """
+        parts = [part for part in path.split("/") if part]
+        if not parts:
+            return self.page("Hsoub Academy", "")
+        if parts[0] == "uploads" and len(parts) == 2:
+            return 200, "image/png", self.image(parts[1]), {}
+        if parts[0] == "download" and len(parts) == 2:
+            return self.pdf(parts[1])
+        kinds = dict((kind, name_ar) for name_ar, kind in CATEGORIES)
+        if parts[0] not in kinds or len(parts) < 2:
+            return 404, "text/html", b"not found", {}
+        kind = parts[0]
+        try:
+            topic = int(parts[1].split("-")[1])
+        except (IndexError, ValueError):
+            return 404, "text/html", b"not found", {}
+        if len(parts) == 2:
+            page = int(query.get("page", ["1"])[0])
+            if not 1 <= page <= self.pages or topic >= self.topics:
+                return 404, "text/html", b"not found", {}
+            return self.listing(kind, topic, page)
+        try:
+            item = int(parts[2].split("-")[0])
+        except ValueError:
+            return 404, "text/html", b"not found", {}
+        return getattr(self, "{}_item".format(kind))(topic, item)
+
+    def page(self, title, content):
+        nav = []
+        for name_ar, kind in CATEGORIES:
+            topics = "".join('<li><a href="{}">{} {}</a></li>'.format(
+                self.topic_url(kind, topic), self.text(self.random(kind, topic), 2), topic)
+                for topic in range(self.topics))
+            nav.append('<li><a href="#">{}</a><ul>{}</ul></li>'.format(name_ar, topics))
+        body = PAGE_TEMPLATE.format(title=title, nav="".join(nav), content=content)
+        return 200, "text/html; charset=utf-8", body.encode("utf-8"), {}
+
+    def topic_url(self, kind, topic):
+        return self.url("{}/topic-{}/".format(kind, topic))
+
+    def item_url(self, kind, topic, item):
+        return self.url("{}/topic-{}/{}-{}/".format(kind, topic, item, kind[:-1]))
+
+    def entries(self, topic, page):
+        """
+        The (topic, item) of the listing entries of a page, newest first.
+        """
+        first = (self.pages - page) * self.items
+        entries = []
+        for index in range(self.items):
+            item = first + self.items - 1 - index
+            rng = self.random("shared", topic, item)
+            if topic > 0 and rng.random() < self.shared:
+                entries.append((topic - 1, item))
+            else:
+                entries.append((topic, item))
+        return entries
+
+    def listing(self, kind, topic, page):
+        pagination = ('<ul class="ipsPagination"><li class="ipsPagination_pageJump">'
+                      '<a href="#">{} of {}</a><input type="number" min="1" max="{}"></li></ul>').format(
+            page, self.pages, self.pages)
+        rows = []
+        for entry_topic, item in self.entries(topic, page):
+            rng = self.random(kind, entry_topic, item)
+            title = "{} {}".format(self.text(rng, 4), item)
+            url = self.item_url(kind, entry_topic, item)
+            author = '<a href="{}">{}</a>'.format(self.url("profile/{}/".format(rng.randint(1, 500))), self.text(rng, 1))
+            date = "2020-{:02d}-{:02d}T10:00:00Z".format(1 + item % 12, 1 + item % 28)
+            tags = '<a href="{}">{}</a>'.format(self.url("tags/{}/".format(rng.randint(1, 50))), self.text(rng, 1))
+            if kind == "lessons":
+                rows.append('<article><img src="{}"><h2>{}<a href="{}">{}</a></h2><p>{}</p>'
+                            '<section>{}</section><time datetime="{}">{}</time></article>'.format(
+                    self.url("uploads/{}-{}-0.png".format(entry_topic, item)), tags, url, title,
+                    author, self.text(rng, 30), date, date[:10]))
+            elif kind == "books":
+                rows.append('<li class="ipsDataItem"><div class="ipsDataItem_icon"><a href="{url}" '
+                            'style="background-image: url( &quot;{thumb}&quot; )"></a></div>'
+                            '<div class="ipsDataItem_main"><h4>{tags}<a href="{url}">{title}</a></h4>'
+                            '<p>{author}</p><div>{description}</div><time datetime="{date}"></time></div></li>'.format(
+                    url=url, thumb=self.url("uploads/{}-{}-0.png".format(entry_topic, item)), tags=tags,
+                    title=title, author=author, description=self.text(rng, 20), date=date))
+            else:
+                rows.append('<li class="cForumQuestion"><div class="ipsDataItem_stats">{votes}</div>'
+                            '<div class="ipsDataItem_main"><h4>{tags}<a href="{url}">{title}</a></h4>'
+                            '<p>{author}</p><time datetime="{date}"></time></div></li>'.format(
+                    votes=rng.randint(0, 20), url=url, title=title, tags=tags, author=author, date=date))
+        if kind == "lessons":
+            content = '<div id="elCmsPageWrap">{}</div>{}'.format("".join(rows), pagination)
+        else:
+            content = '<ol class="ipsDataList">{}</ol>{}'.format("".join(rows), pagination)
+        return self.page("{} {}".format(kind, topic), content)
+
+    def body(self, rng, key):
+        parts = []
+        for paragraph in range(self.paragraphs):
+            parts.append("<p>{} <a href=\"{}\">{}</a></p>".format(
+                self.text(rng, 60), self.url("tags/{}/".format(rng.randint(1, 50))), self.text(rng, 2)))
+            if paragraph < self.images:
+                # relative, like the uploads of the real site
+                parts.append('<p><img src="/uploads/{}-{}.png" style="width:100%"></p>'.format(key, paragraph + 1))
+        parts.append('<pre><code>for item in items:\n    print(item)</code></pre>')
+        parts.append('<div class="ipsItemControls"><button>{}</button></div>'.format(self.text(rng, 1)))
+        parts.append('<script>var ipsDebug = false;</script>')
+        return "".join(parts)
+
+    def lessons_item(self, topic, item):
+        rng = self.random("lessons", topic, item)
+        content = '<article><h1>{}</h1>{}</article>'.format(self.text(rng, 4), self.body(rng, "{}-{}".format(topic, item)))
+        return self.page("lesson", content)
+
+    def questions_item(self, topic, item):
+        rng = self.random("questions", topic, item)
+        posts = ['<article class="cPost"><div class="cPost_contentWrap">{}</div></article>'.format(
+            self.body(rng, "{}-{}".format(topic, item)))]
+        for answer in range(rng.randint(0, 4)):
+            posts.append('<article class="cPost"><p>{}</p></article>'.format(self.text(rng, 40)))
+        return self.page("question", "".join(posts))
+
+    def books_item(self, topic, item):
+        rng = self.random("books", topic, item)
+        content = '<article><p>{}</p></article><aside><a href="{}">{}</a></aside>'.format(
+            self.text(rng, 40), self.url("download/{}-{}.pdf".format(topic, item)), self.text(rng, 1))
+        return self.page("book", content)
+
+    def image(self, name):
+        seed = zlib.crc32(name.encode("utf-8")) % 251 + 1
+        return cached_png(self.image_size, self.image_size * 2 // 3, seed)
+
+    def pdf(self, name):
+        headers = {"Content-Disposition": 'attachment; filename="{}"'.format(name)}
+        return 200, "application/pdf", pdf_bytes(name, self.pdf_size), headers
+
+
+@lru_cache(maxsize=256)
+def cached_png(width, height, seed):
+    return png_bytes(width, height, seed)
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        status, content_type, body, headers = self.server.site.render(parsed.path, urlparse.parse_qs(parsed.query))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(site, host="127.0.0.1", port=0):
+    """
+    Serves site from a background thread, returns the server, its base
+    URL is set on site.
+    """
+    server = ThreadingHTTPServer((host, port), SiteHandler)
+    server.daemon_threads = True
+    server.site = site
+    site.base_url = "http://{}:{}/".format(host, server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def site_arguments(parser):
+    parser.add_argument("--topics", type=int, default=4, help="topics per category")
+    parser.add_argument("--pages", type=int, default=5, help="listing pages per topic")
+    parser.add_argument("--items", type=int, default=20, help="items per listing page")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the listing pages")
+    parser.add_argument("--paragraphs", type=int, default=8)
+    parser.add_argument("--images", type=int, default=2, help="images per article")
+    parser.add_argument("--pdf-kb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def site_from_arguments(args, base_url="http://127.0.0.1/"):
+    return SyntheticSite(base_url, topics=args.topics, pages=args.pages * args.scale, items=args.items,
+                         paragraphs=args.paragraphs, images=args.images, pdf_size=args.pdf_kb * 1024,
+                         seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Invision style site for scale tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    site_arguments(parser)
+    args = parser.parse_args()
+    site = site_from_arguments(args)
+    server = serve(site, host=args.host, port=args.port)
+    print("Serving {} items on {}".format(site.item_count(), site.base_url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
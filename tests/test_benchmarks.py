@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+pytest.importorskip("ricecooker")
+import benchmarks  # noqa: E402
+import sushichef  # noqa: E402
+
+
+@pytest.fixture
+def fixture_pages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sushichef, "ARCHIVE", benchmarks.fixture_archive(str(tmp_path / "pages")))
+    monkeypatch.setattr(sushichef, "REPLAY", True)
+    return sushichef.ARCHIVE
+
+
+def test_pages_are_sorted_by_their_markup(fixture_pages):
+    listings, articles = benchmarks.load_pages(fixture_pages, 10)
+    assert dict((name, [url for url, _ in pages]) for name, pages in listings.items()) == {
+        "LessonTopic": ["https://academy.hsoub.com/lessons/topic-0/?page=1"],
+        "BookTopic": ["https://academy.hsoub.com/books/topic-0/?page=1"],
+        "QuestionTopic": ["https://academy.hsoub.com/questions/topic-0/?page=1"],
+    }
+    assert len(articles) == 6
+    for cls in benchmarks.TOPIC_CLASSES:
+        (_, soup), = listings[cls.__name__]
+        assert len(cls.listing(None, soup)) == 2
+    # the limit is per kind
+    listings, articles = benchmarks.load_pages(fixture_pages, 1)
+    assert [len(pages) for pages in listings.values()] == [1, 1, 1]
+    assert len(articles) == 1
+
+
+def test_every_benchmark_runs_over_the_fixture(fixture_pages):
+    listings, articles = benchmarks.load_pages(fixture_pages, 10)
+    results = benchmarks.run(listings, articles, repeat=2)
+    assert sorted(results) == sorted(
+        ["download", "LessonTopic.listing", "BookTopic.listing", "QuestionTopic.listing", "HTMLApp.clean",
+         "link_to_text", "remove_links", "Article.video_urls", "HTMLApp.to_local_images", "zip"])
+    for stats in results.values():
+        assert 0 < stats["min"] <= stats["median"]
+
+
+def test_compare_flags_the_benchmarks_over_the_threshold(capsys):
+    results = dict(fast=dict(min=1.0), slow=dict(min=1.5), new=dict(min=1.0))
+    baseline = dict(fast=dict(min=1.1), slow=dict(min=1.0))
+    assert benchmarks.compare(results, baseline, 0.2) == ["slow"]
+    assert benchmarks.compare(results, baseline, 0.6) == []
+    assert "no baseline" in capsys.readouterr().out
+
+
+def test_the_baseline_fails_a_slower_run(fixture_pages, tmp_path):
+    baseline_path = str(tmp_path / "baseline.json")
+    options = ["--fixture", "--repeat=1", "--only=HTMLApp.clean,zip", "--baseline", baseline_path]
+    benchmarks.main(options + ["--save-baseline"])
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    assert sorted(baseline["results"]) == ["HTMLApp.clean", "zip"]
+
+    # a generous threshold passes the same code
+    with pytest.raises(SystemExit) as exited:
+        benchmarks.main(options + ["--threshold=1000"])
+    assert exited.value.code == 0
+
+    # a baseline a thousand times faster is a regression
+    for stats in baseline["results"].values():
+        stats["min"] /= 1000
+    with open(baseline_path, "w") as f:
+        json.dump(baseline, f)
+    with pytest.raises(SystemExit) as exited:
+        benchmarks.main(options)
+    assert exited.value.code == 1
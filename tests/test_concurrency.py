@@ -0,0 +1,80 @@
+import pytest
+import requests
+
+from concurrency import AdaptiveLimiter, is_overload
+
+
+def response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def run(limiter, status_code=200, count=1):
+    for _ in range(count):
+        with limiter.slot() as slot:
+            slot.check(response(status_code))
+
+
+def test_limit_grows_after_fast_successes():
+    limiter = AdaptiveLimiter(initial=2, maximum=4, target_latency=1.0)
+    run(limiter, count=2)
+    assert int(limiter.limit) == 3
+    run(limiter, count=3)
+    assert int(limiter.limit) == 4
+    # capped at the maximum
+    run(limiter, count=20)
+    assert int(limiter.limit) == 4
+    assert limiter.increases == 2
+    assert limiter.errors == 0
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_limit_backs_off_on_overload_answers(status_code):
+    limiter = AdaptiveLimiter(initial=8, target_latency=1.0)
+    run(limiter, count=7)
+    run(limiter, status_code)
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+    assert limiter.errors == 1
+    # at most once per window, the requests in flight saw the old limit
+    run(limiter, status_code)
+    assert limiter.limit == 4
+    run(limiter, status_code, count=3)
+    assert limiter.limit == 2
+
+
+def test_limit_backs_off_on_overload_exceptions():
+    limiter = AdaptiveLimiter(initial=2, target_latency=1.0)
+    run(limiter, count=1)
+    with pytest.raises(requests.exceptions.Timeout):
+        with limiter.slot():
+            raise requests.exceptions.Timeout()
+    assert limiter.limit == 1
+    # never below the minimum
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with limiter.slot():
+            raise requests.exceptions.ConnectionError()
+    assert limiter.limit == 1
+
+
+def test_client_errors_dont_back_off():
+    limiter = AdaptiveLimiter(initial=2, target_latency=1.0)
+    run(limiter, 404, count=2)
+    assert int(limiter.limit) == 3
+    assert limiter.errors == 0
+    error = requests.exceptions.HTTPError(response=response(404))
+    assert not is_overload(error)
+    with pytest.raises(requests.exceptions.HTTPError):
+        with limiter.slot():
+            raise error
+    assert limiter.decreases == 0
+
+
+def test_slow_requests_back_off():
+    limiter = AdaptiveLimiter(initial=2, target_latency=1.0)
+    limiter.active = 2
+    limiter.record(0.5, True)
+    limiter.record(2.5, True)
+    assert limiter.limit == 1
+    assert limiter.errors == 0
@@ -0,0 +1,52 @@
+from crawl_filter import CrawlFilter
+
+
+def test_options_are_parsed():
+    crawl_filter = CrawlFilter.from_options({
+        '--categories': "Books and Resources, أسئلة وأجوبة", '--topics': "https://academy.hsoub.com/a/",
+        '--pages': "2-5", '--since': "2020-01-31", '--sample': "3"})
+    assert crawl_filter.categories == {"Books and Resources", "أسئلة وأجوبة"}
+    assert crawl_filter.topics == {"https://academy.hsoub.com/a/"}
+    assert (crawl_filter.first_page, crawl_filter.last_page) == (2, 5)
+    assert crawl_filter.since == "2020-01-31"
+    assert crawl_filter.sample == 3
+    assert not crawl_filter.complete()
+    assert CrawlFilter.from_options({'--pages': "4"}).page_range(10) == (4, 4)
+    assert CrawlFilter.from_options({}).complete()
+
+
+def test_categories_match_either_name():
+    crawl_filter = CrawlFilter.from_options({'--categories': "Books and Resources,أسئلة وأجوبة"})
+    assert crawl_filter.category_allowed("Books and Resources", "كتب وملفات")
+    assert crawl_filter.category_allowed("Questions and Answers", "أسئلة وأجوبة")
+    assert not crawl_filter.category_allowed("Lessons and Articles", "دروس ومقالات")
+    assert CrawlFilter().category_allowed("Lessons and Articles", "دروس ومقالات")
+
+
+def test_topics_and_pages():
+    crawl_filter = CrawlFilter(topics={"https://academy.hsoub.com/a"}, pages=(2, 5))
+    assert crawl_filter.topic_allowed("https://academy.hsoub.com/a/")
+    assert not crawl_filter.topic_allowed("https://academy.hsoub.com/b/")
+    assert crawl_filter.page_range(10) == (2, 5)
+    assert crawl_filter.page_range(3) == (2, 3)
+    assert CrawlFilter().page_range(10) == (1, 10)
+
+
+def test_since_keeps_newer_and_undated_entries():
+    crawl_filter = CrawlFilter(since="2020-01-31")
+    assert crawl_filter.entry_allowed(dict(updated="2020-01-31T10:00:00Z"))
+    assert crawl_filter.entry_allowed(dict(updated="2021-06-01"))
+    assert not crawl_filter.entry_allowed(dict(updated="2020-01-30T23:59:59Z"))
+    assert crawl_filter.entry_allowed(dict(updated=None))
+    assert crawl_filter.entry_allowed({})
+
+
+def test_sample_is_taken_per_topic():
+    crawl_filter = CrawlFilter(sample=3)
+    assert crawl_filter.take_sample("a", [1, 2]) == [1, 2]
+    assert not crawl_filter.sample_full("a")
+    assert crawl_filter.take_sample("a", [3, 4]) == [3]
+    assert crawl_filter.sample_full("a")
+    assert crawl_filter.take_sample("a", [5]) == []
+    assert crawl_filter.take_sample("b", [1, 2, 3, 4]) == [1, 2, 3]
+    assert CrawlFilter().take_sample("a", [1, 2, 3, 4]) == [1, 2, 3, 4]
@@ -0,0 +1,219 @@
+import os
+
+import bs4
+import pytest
+
+pytest.importorskip("ricecooker")
+import daemon  # noqa: E402
+import sushichef  # noqa: E402
+import utils  # noqa: E402
+from item_registry import canonical_url  # noqa: E402
+from storage import tree_paths  # noqa: E402
+
+
+# the module wide settings prepare, configure and the jobs change
+CHEF_GLOBALS = ("ARCHIVE", "REPLAY", "REFRESH", "PROFILER", "ASSETS", "ITEM_REGISTRY",
+                "DOWNLOAD_VIDEOS", "CRAWL_FILTER", "ZIP_POLICY", "OPTIMIZE_HTML", "RETRY_QUEUE",
+                "RETRY_WAIT", "LIMITER", "ITEM_WORKERS", "VIDEO_WORKERS", "TRANSCODER")
+
+
+@pytest.fixture
+def chefdata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(sushichef.DATA_DIR)
+    for name in CHEF_GLOBALS:
+        monkeypatch.setattr(sushichef, name, getattr(sushichef, name))
+    monkeypatch.setattr(utils, "FILE_INDEX", utils.FILE_INDEX)
+    return tmp_path
+
+
+def test_submit_returns_the_queued_job(chefdata):
+    crawl_daemon = daemon.CrawlDaemon({})
+    channel = crawl_daemon.submit("channel")
+    assert crawl_daemon.submit("channel") is channel
+    topic = crawl_daemon.submit("topic", "https://academy.hsoub.com/topic/")
+    assert topic is not channel
+    assert crawl_daemon.submit("topic", "https://academy.hsoub.com/topic/") is topic
+    # a finished job is queued again
+    channel.state = "done"
+    channel.done.set()
+    assert crawl_daemon.submit("channel") is not channel
+    with pytest.raises(ValueError):
+        crawl_daemon.submit("page")
+    with pytest.raises(ValueError):
+        crawl_daemon.submit("url")
+
+
+def test_submit_keeps_the_last_finished_jobs(chefdata, monkeypatch):
+    monkeypatch.setattr(daemon, "KEPT_JOBS", 2)
+    crawl_daemon = daemon.CrawlDaemon({})
+    for index in range(4):
+        crawl_daemon.submit("url", "https://academy.hsoub.com/item{}/".format(index)).done.set()
+    queued = crawl_daemon.submit("channel")
+    assert list(crawl_daemon.jobs) == [3, 4, 5]
+    assert crawl_daemon.get(5) is queued
+    assert crawl_daemon.get(1) is None
+
+
+def test_replace_item_replaces_every_listing():
+    key = canonical_url("https://academy.hsoub.com/item/")
+    tree = dict(children=[
+        dict(source_id="first", children=[dict(source_id=key, title="Old")]),
+        dict(source_id="second", children=[dict(source_id="other", title="Other"),
+                                           dict(source_id=key + "?utm_source=x", title="Old")]),
+    ])
+    assert daemon.replace_item(tree, key, dict(source_id=key, title="New"))
+    assert [child["title"] for topic in tree["children"] for child in topic["children"]] == \
+        ["New", "Other", "New"]
+    assert not daemon.replace_item(tree, "https://academy.hsoub.com/missing/", dict(source_id="x"))
+
+
+def test_chef_options():
+    assert daemon.chef_options(["--download-video=0", "--sample", "--quota=20G", "--since=a=b"]) == {
+        "--download-video": "0", "--sample": "1", "--quota": "20G", "--since": "a=b"}
+    assert daemon.chef_options([]) == {}
+
+
+class DaemonTopic(sushichef.Topic):
+    def __init__(self, title, source_id, entries):
+        super(DaemonTopic, self).__init__(title, source_id)
+        self.entries = entries
+
+    def pages(self):
+        return ["{}?page=1".format(self.source_id)]
+
+    def list_page(self, page_url):
+        return list(self.entries)
+
+    def build_item(self, entry, defer=None):
+        html_app = sushichef.HTMLApp(entry["title"], entry["source_id"])
+        html_app.to_file(self.item_path(html_app))
+        return html_app
+
+
+def write_assets():
+    for name in sushichef.ASSET_URLS:
+        with open(os.path.join(sushichef.DATA_DIR, name), "w") as f:
+            f.write("/* test */")
+
+
+def test_evicted_files_are_packaged_again(chefdata, monkeypatch):
+    write_assets()
+    first = dict(title="First", source_id="https://academy.hsoub.com/first/")
+    second = dict(title="Second", source_id="https://academy.hsoub.com/second/")
+    monkeypatch.setattr(sushichef, "download", lambda source_id: bs4.BeautifulSoup(
+        "<article><p>{}</p></article>".format(source_id), "html.parser"))
+    listed = [first, second]
+
+    def browser_resources():
+        category = sushichef.Category("Category", "https://academy.hsoub.com/category/")
+        category.topics.append(DaemonTopic("Topic", "https://academy.hsoub.com/topic/", listed))
+        yield category
+    monkeypatch.setattr(sushichef, "browser_resources", browser_resources)
+
+    crawl_daemon = daemon.CrawlDaemon({"--orphan-days": "0", "--video-workers": "0", "--retry-wait": "0"})
+    monkeypatch.setattr(crawl_daemon.chef, "download_css_js", lambda: None)
+    crawl_daemon.start()
+    try:
+        def run_channel():
+            job = crawl_daemon.submit("channel")
+            assert job.done.wait(30)
+            assert job.state == "done", job.error
+            return set(path for path in tree_paths(crawl_daemon.channel_tree) if path.endswith(".zip"))
+
+        zips = run_channel()
+        assert len(zips) == 2
+        # the second item left the listing, its zip and directory are evicted
+        listed.remove(second)
+        kept = run_channel()
+        assert len(kept) == 1
+        second_zip = (zips - kept).pop()
+        assert not os.path.exists(second_zip)
+        # the index of the run answers for chefdata/...
+        assert not utils.file_exists(os.path.relpath(second_zip))
+        assert not utils.dir_exists(os.path.relpath(os.path.dirname(second_zip)))
+
+        # back in the listing, it is packaged again instead of pointing at the evicted zip
+        listed.append(second)
+        assert run_channel() == zips
+        assert os.path.isfile(second_zip)
+    finally:
+        crawl_daemon.stop()
+
+
+class PdfResponse(object):
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {"content-type": "application/pdf", "Content-Disposition": 'attachment; filename="book.pdf"'}
+
+    def iter_content(self, size):
+        return [self.content[index:index + size] for index in range(0, len(self.content), size)]
+
+
+class PdfClient(object):
+    """
+    Serves the current edition of the book, or fails with error.
+    """
+    def __init__(self):
+        self.headers = {}
+        self.edition = b"%PDF-1.4 first edition %%EOF"
+        self.error = None
+        self.fetched = 0
+
+    def get(self, url, timeout=None, headers=None):
+        if self.error is not None:
+            raise self.error
+        self.fetched += 1
+        return PdfResponse(self.edition)
+
+
+class DaemonBookTopic(DaemonTopic):
+    def build_item(self, entry, defer=None):
+        book = sushichef.Book(entry["title"], entry["source_id"])
+        book.download(base_path=self.item_path(book))
+        return book
+
+
+def test_url_job_downloads_the_book_again(chefdata, monkeypatch):
+    write_assets()
+    client = PdfClient()
+    aside = bs4.BeautifulSoup('<aside><a href="https://academy.hsoub.com/download/book/">PDF</a></aside>',
+                              "html.parser").find("aside")
+    monkeypatch.setattr(sushichef.Book, "soup", lambda book: (aside, client))
+    book_url = "https://academy.hsoub.com/files/book/"
+
+    def browser_resources():
+        category = sushichef.Category("Category", "https://academy.hsoub.com/category/")
+        category.topics.append(DaemonBookTopic("Books", "https://academy.hsoub.com/files/",
+                                               [dict(title="Book", source_id=book_url)]))
+        yield category
+    monkeypatch.setattr(sushichef, "browser_resources", browser_resources)
+
+    crawl_daemon = daemon.CrawlDaemon({"--video-workers": "0", "--retry-wait": "0"})
+    monkeypatch.setattr(crawl_daemon.chef, "download_css_js", lambda: None)
+    crawl_daemon.start()
+    try:
+        def run(kind, url=None):
+            job = crawl_daemon.submit(kind, url)
+            assert job.done.wait(30)
+            assert job.state == "done", job.error
+            pdf, = [path for path in tree_paths(crawl_daemon.channel_tree) if path.endswith(".pdf")]
+            with open(pdf, "rb") as f:
+                return f.read()
+
+        assert run("channel") == b"%PDF-1.4 first edition %%EOF"
+        client.edition = b"%PDF-1.4 second edition %%EOF"
+        # a crawl keeps the saved PDF
+        assert run("channel") == b"%PDF-1.4 first edition %%EOF"
+        assert client.fetched == 1
+        # a url job refreshes it
+        assert run("url", book_url) == b"%PDF-1.4 second edition %%EOF"
+        assert client.fetched == 2
+        # a failed refresh keeps the saved one
+        client.edition = b"%PDF-1.4 third edition %%EOF"
+        client.error = sushichef.requests.exceptions.ConnectionError("down")
+        assert run("url", book_url) == b"%PDF-1.4 second edition %%EOF"
+    finally:
+        crawl_daemon.stop()
@@ -0,0 +1,31 @@
+from html_optimizer import optimize_html_app, subset_css
+
+
+CSS = ".used{color:red} .toggled{display:block} #opened{margin:0} .unused{color:blue}"
+
+
+def used(classes=(), ids=()):
+    return dict(tags={"div"}, classes=set(classes), ids=set(ids))
+
+
+def test_subset_css_keeps_rules_of_the_document():
+    css = subset_css(CSS, used(classes=["used"]))
+    assert css == ".used{color:red}"
+
+
+def test_subset_css_keeps_names_of_the_scripts():
+    css = subset_css(CSS, used(classes=["used"]), keep_names={"toggled", "opened"})
+    assert ".toggled{display:block}" in css
+    assert "#opened{margin:0}" in css
+    assert ".unused" not in css
+
+
+def test_names_of_the_scripts_survive_markup_and_css():
+    html = '<div class="used plain">a</div><div id="opened">b</div>'
+    js = 'el.classList.add("toggled"); document.getElementById("opened");'
+    optimized_html, optimized_css = optimize_html_app(html, CSS, {}, js=js)
+    assert 'class="used"' in optimized_html
+    assert 'id="opened"' in optimized_html
+    assert ".toggled{display:block}" in optimized_css
+    assert "#opened{margin:0}" in optimized_css
+    assert ".unused" not in optimized_css
@@ -0,0 +1,19 @@
+import pytest
+
+from importtime_check import LAZY_PACKAGES, eager_imports, import_times
+
+pytest.importorskip("ricecooker")
+
+
+def test_heavy_packages_are_imported_lazily():
+    assert eager_imports("sushichef") == []
+
+
+def test_eager_imports_are_seen():
+    assert eager_imports("json, html5lib", packages=("html5lib", "PIL")) == ["html5lib"]
+
+
+def test_import_times_of_the_chef():
+    times = import_times("sushichef")
+    assert ("sushichef", 0) in [(name, depth) for name, _, _, depth in times]
+    assert not set(LAZY_PACKAGES) & set(name.split(".")[0] for name, _, _, _ in times)
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from item_registry import ItemRegistry, canonical_url
+
+
+def test_canonical_url():
+    assert canonical_url(" HTTPS://Academy.Hsoub.com/item/?page=2#top ") == "https://academy.hsoub.com/item"
+    assert canonical_url("https://academy.hsoub.com/") == "https://academy.hsoub.com/"
+
+
+def test_item_of_two_listings_is_built_once():
+    registry = ItemRegistry()
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return dict(title="Item")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(registry.get_or_build, "https://academy.hsoub.com/item/", build)
+        assert started.wait(5)
+        # the same item, listed by another topic with another query string
+        second = executor.submit(registry.get_or_build, "https://academy.hsoub.com/item?tag=x", build)
+        release.set()
+        assert first.result() is second.result()
+    assert builds == [1]
+    assert (registry.built, registry.duplicates) == (1, 1)
+    assert "https://academy.hsoub.com/item" in registry
+
+
+def test_failed_build_is_not_kept():
+    registry = ItemRegistry()
+
+    def fail():
+        raise IOError("timeout")
+    with pytest.raises(IOError):
+        registry.get_or_build("https://academy.hsoub.com/item/", fail)
+    assert "https://academy.hsoub.com/item/" not in registry
+    assert registry.get_or_build("https://academy.hsoub.com/item/", lambda: "node") == "node"
@@ -0,0 +1,91 @@
+import os
+
+from page_archive import PageArchive
+
+
+def test_pages_are_replayed_from_a_new_archive(tmp_path):
+    path = str(tmp_path / "archive" / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>صفحة</p>")
+    archive.put("https://academy.hsoub.com/b/", b"\x89PNG")
+    archive.put("https://academy.hsoub.com/a/", "<p>second fetch</p>")
+    assert archive.get("https://academy.hsoub.com/a/") == b"<p>second fetch</p>"
+
+    replay = PageArchive(path)
+    assert len(replay) == 2
+    assert "https://academy.hsoub.com/b/" in replay
+    # the last record of an url wins
+    assert replay.get("https://academy.hsoub.com/a/") == b"<p>second fetch</p>"
+    assert replay.get("https://academy.hsoub.com/b/") == b"\x89PNG"
+    assert replay.get("https://academy.hsoub.com/c/") is None
+
+
+def test_truncated_record_is_not_replayed(tmp_path):
+    path = str(tmp_path / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>a</p>")
+    archive.put("https://academy.hsoub.com/b/", "<p>b</p>" * 100)
+    # a run killed while writing the last gzip member
+    with open(archive.data_path, "r+b") as f:
+        f.truncate(os.path.getsize(archive.data_path) - 10)
+    replay = PageArchive(path)
+    assert replay.get("https://academy.hsoub.com/a/") == b"<p>a</p>"
+    assert "https://academy.hsoub.com/b/" not in replay
+    # archived again after the truncated member
+    replay.put("https://academy.hsoub.com/b/", "<p>b</p>")
+    assert PageArchive(path).get("https://academy.hsoub.com/b/") == b"<p>b</p>"
+
+
+def test_damaged_record_is_not_replayed(tmp_path):
+    path = str(tmp_path / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>a</p>" * 100)
+    offset, length = archive.index["https://academy.hsoub.com/a/"]
+    with open(archive.data_path, "r+b") as f:
+        f.seek(offset + length - 10)
+        f.write(b"\0" * 10)
+    assert PageArchive(path).get("https://academy.hsoub.com/a/") is None
+
+
+def test_killed_index_write_is_skipped(tmp_path):
+    path = str(tmp_path / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>a</p>")
+    with open(archive.index_path, "a") as f:
+        f.write('{"url": "https://academy.hsoub.com/b/", "off')
+    assert len(PageArchive(path)) == 1
+
+
+def test_compact_keeps_the_last_record_of_every_url(tmp_path):
+    path = str(tmp_path / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>a</p>")
+    archive.put("https://academy.hsoub.com/b/", "<p>b</p>")
+    # few replaced records are left in place
+    assert archive.compact() == 0
+    for fetch in range(4):
+        archive.put("https://academy.hsoub.com/a/", "<p>a {}</p>".format(fetch))
+    size = os.path.getsize(archive.data_path)
+    reclaimed = archive.compact()
+    assert reclaimed > 0
+    assert os.path.getsize(archive.data_path) == size - reclaimed
+    assert not os.path.exists(archive.data_path + ".tmp")
+    for replay in (archive, PageArchive(path)):
+        assert len(replay) == 2
+        assert replay.get("https://academy.hsoub.com/a/") == b"<p>a 3</p>"
+        assert replay.get("https://academy.hsoub.com/b/") == b"<p>b</p>"
+    with open(archive.index_path) as f:
+        assert len(f.readlines()) == 2
+    # archived again after the compaction
+    archive.put("https://academy.hsoub.com/c/", "<p>c</p>")
+    assert PageArchive(path).get("https://academy.hsoub.com/c/") == b"<p>c</p>"
+
+
+def test_record_of_another_url_is_not_replayed(tmp_path):
+    path = str(tmp_path / "pages")
+    archive = PageArchive(path)
+    archive.put("https://academy.hsoub.com/a/", "<p>a</p>")
+    archive.put("https://academy.hsoub.com/b/", "<p>b</p>")
+    # a run killed after the compaction replaced the data but not the index
+    archive.index["https://academy.hsoub.com/b/"] = archive.index["https://academy.hsoub.com/a/"]
+    assert archive.get("https://academy.hsoub.com/b/") is None
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from profiling import StageProfiler
+
+
+def test_overlapping_stages_are_not_measured(tmp_path):
+    profiler = StageProfiler(str(tmp_path), alloc_every=1)
+    profiler.start()
+    try:
+        with profiler.stage("alone"):
+            data = [b"x" * 1000 for _ in range(100)]
+        entered, release = threading.Event(), threading.Event()
+
+        def other():
+            with profiler.stage("other"):
+                entered.set()
+                release.wait()
+        thread = threading.Thread(target=other)
+        thread.start()
+        entered.wait()
+        with profiler.stage("alone"):
+            data = [b"y" * 1000 for _ in range(100)]
+        release.set()
+        thread.join()
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                data = [b"z" * 1000 for _ in range(100)]
+    finally:
+        profiler.stop()
+    assert data
+    assert profiler.measured["alone"] == 1
+    assert profiler.discarded["alone"] == 1
+    assert profiler.measured["other"] == 0
+    # the nested stage is counted in the outer one
+    assert profiler.measured["outer"] == 1
+    assert profiler.measured["inner"] == 0
+    assert (tmp_path / "summary.txt").exists()
+
+
+class LeftStages(list):
+    """
+    The stages of a thread that leaves its last one between the sampler's
+    check and its read.
+    """
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, index):
+        raise IndexError("pop from empty list")
+
+
+def test_sampler_survives_stages_left_while_sampling(tmp_path):
+    profiler = StageProfiler(str(tmp_path), interval=0.001, alloc_every=1000)
+    profiler.start()
+    try:
+        profiler.thread_stages[threading.get_ident()] = LeftStages()
+        time.sleep(0.05)
+        assert profiler.sampler.is_alive()
+        del profiler.thread_stages[threading.get_ident()]
+
+        stop = time.time() + 0.3
+
+        def work():
+            while time.time() < stop:
+                with profiler.stage("listing"):
+                    sum(range(1000))
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert profiler.sampler.is_alive()
+    finally:
+        profiler.stop()
+    assert sum(profiler.stacks["listing"].values()) > 0
@@ -0,0 +1,76 @@
+import time
+
+from retry_queue import RetryQueue
+
+
+def test_collected_failures_keep_their_retry_flag(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"))
+    with queue.collect() as failures:
+        queue.fail("page", "a", "404 Not Found", retry=False)
+    assert failures == [("page a: 404 Not Found", False)]
+    queue.add_failures("item", "a", failures)
+    # nothing worth retrying, a dead letter right away
+    assert queue.pending(["item"]) == []
+    assert queue.entries["item a"]["attempts"] == queue.max_attempts
+
+    with queue.collect() as failures:
+        queue.fail("page", "b", "404 Not Found", retry=False)
+        queue.fail("page", "b", "503 Service Unavailable")
+    queue.add_failures("item", "b", failures)
+    assert [entry["key"] for entry in queue.pending(["item"])] == ["b"]
+
+
+def test_retried_failures_keep_their_retry_flag(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"), delay=0)
+    queue.add("item", "a", "timeout")
+    attempts = []
+
+    def handler(entry):
+        attempts.append(entry["key"])
+        return [("page a: 404 Not Found", False)]
+    assert queue.retry(dict(item=handler)) == 0
+    assert attempts == ["a"]
+    assert queue.pending(["item"]) == []
+
+
+def test_nested_collect_passes_failures_on(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"))
+    with queue.collect() as outer:
+        with queue.collect() as inner:
+            queue.fail("page", "a", "timeout")
+        queue.queue("listing", "a", inner)
+    assert outer == [("page a: timeout", True)]
+    assert queue.entries == {}
+
+
+def test_retry_starts_nothing_after_the_deadline(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"), delay=0)
+    for key in "abc":
+        queue.add("item", key, "timeout")
+    retried = []
+
+    def handler(entry):
+        retried.append(entry["key"])
+        time.sleep(0.05)
+        return []
+    recovered = queue.retry(dict(item=handler), max_wait=10, deadline=time.time() + 0.02)
+    assert recovered == 1
+    assert len(retried) == 1
+    assert len(queue.pending(["item"])) == 2
+    assert queue.retry(dict(item=handler), max_wait=10, deadline=time.time() - 1) == 0
+
+
+def test_retry_waits_for_backoff_until_the_deadline(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"), delay=60)
+    queue.add("item", "a", "timeout")
+    started = time.time()
+    assert queue.retry(dict(item=lambda entry: []), max_wait=300, deadline=started + 0.1) == 0
+    assert time.time() - started < 1
+
+
+def test_entries_nothing_retries_are_dropped(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"))
+    queue.add("item", "a", "timeout")
+    queue.add("video", "https://www.youtube.com/watch?v=a", "timeout")
+    assert queue.drop_others(["topic", "listing", "item"]) == ["video https://www.youtube.com/watch?v=a"]
+    assert list(queue.entries) == ["item a"]
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+pytest.importorskip("ricecooker")
+import soak  # noqa: E402
+import sushichef  # noqa: E402
+import utils  # noqa: E402
+from synthetic_site import SyntheticSite, serve  # noqa: E402
+
+
+# the module wide settings prepare and configure change
+CHEF_GLOBALS = ("BASE_URL", "ARCHIVE", "REPLAY", "PROFILER", "ASSETS", "ITEM_REGISTRY",
+                "DOWNLOAD_VIDEOS", "CRAWL_FILTER", "ZIP_POLICY", "OPTIMIZE_HTML", "RETRY_QUEUE",
+                "RETRY_WAIT", "LIMITER", "ITEM_WORKERS", "VIDEO_WORKERS", "TRANSCODER")
+
+
+def test_slope():
+    assert soak.slope([(0, 1), (1, 3), (2, 5), (3, 7)]) == 2.0
+    assert soak.slope([(0, 5), (10, 5)]) == 0.0
+    assert soak.slope([(1, 1), (1, 9)]) == 0.0
+    assert soak.slope([(1, 1)]) == 0.0
+    assert soak.slope([]) == 0.0
+
+
+def test_analyse_leaves_out_the_warmup():
+    # the first samples load the modules, then every item costs 1kB
+    samples = [dict(seconds=0, items=0, rss=1000000, fds=3)]
+    samples += [dict(seconds=second, items=10 * second, rss=2000000 + 10240 * second, fds=10 + second // 4)
+                for second in range(1, 10)]
+    result = soak.analyse(samples, 0.1)
+    assert result["items"] == 90
+    assert result["seconds"] == 9
+    assert result["rss_per_item"] == pytest.approx(1024)
+    assert result["rss_growth"] == 8 * 10240
+    assert result["fd_growth"] == 2
+    assert result["first_throughput"] == pytest.approx(10)
+    assert result["last_throughput"] == pytest.approx(10)
+    # without descriptors outside of linux
+    for sample in samples:
+        sample["fds"] = None
+    assert soak.analyse(samples, 0.1)["fd_growth"] == 0
+
+
+def test_crawl_of_a_synthetic_site(tmp_path, monkeypatch):
+    for name in CHEF_GLOBALS:
+        monkeypatch.setattr(sushichef, name, getattr(sushichef, name))
+    monkeypatch.setattr(utils, "FILE_INDEX", utils.FILE_INDEX)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(sushichef.DATA_DIR)
+    for name in sushichef.ASSET_URLS:
+        with open(os.path.join(sushichef.DATA_DIR, name), "w") as f:
+            f.write("/* soak */")
+    site = SyntheticSite("http://127.0.0.1/", topics=2, pages=2, items=3, paragraphs=2, images=1,
+                         pdf_size=4096)
+    server = serve(site)
+    sushichef.BASE_URL = site.base_url
+    options = {'--download-video': "0", '--workers': "2", '--retry-wait': "0", '--video-workers': "0"}
+    chef = sushichef.HsoubAcademyChef()
+    manifest, _ = chef.prepare(options)
+    chef.configure(options)
+    sampler = soak.Sampler(interval=0.05)
+    sampler.start()
+    try:
+        soak.crawl(chef, options, 2, sampler)
+    finally:
+        sampler.stop()
+        chef.finish(manifest)
+        server.shutdown()
+    # the second pass goes through the skip paths of the packaged items
+    assert sampler.items == 2 * site.item_count()
+    result = soak.analyse(sampler.samples, 0.2)
+    assert result["items"] == 2 * site.item_count()
+    assert result["fd_growth"] <= 32
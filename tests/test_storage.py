@@ -0,0 +1,60 @@
+import os
+import time
+
+from storage import StorageManager
+
+
+DAY = 86400
+
+
+def make_files(data_dir, *names):
+    paths = []
+    for name in names:
+        path = os.path.join(str(data_dir), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        paths.append(path)
+    return paths
+
+
+def test_partial_tree_keeps_the_files_of_the_complete_one(tmp_path):
+    first, second = make_files(tmp_path, "topic/first.zip", "topic/second.zip")
+    storage = StorageManager(str(tmp_path), max_age=DAY)
+    storage.collect([first, second], now=0)
+    # a sample run only saw the first item
+    report = StorageManager(str(tmp_path), max_age=DAY).collect([first], now=2 * DAY, complete=False)
+    assert report["removed"]["orphans"] == [0, 0]
+    assert os.path.isfile(second)
+    # the next complete tree dropped it
+    report = StorageManager(str(tmp_path), max_age=DAY).collect([first], now=3 * DAY)
+    assert report["removed"]["orphans"] == [1, 10]
+    assert not os.path.exists(second)
+
+
+def test_nothing_is_removed_before_a_complete_tree(tmp_path):
+    first, second = make_files(tmp_path, "topic/first.zip", "topic/second.zip")
+    report = StorageManager(str(tmp_path), quota=0, max_age=0).collect([first], now=DAY, complete=False)
+    assert report["removed"] == dict(orphans=[0, 0], lru=[0, 0])
+    assert report["no_complete_tree"]
+    assert os.path.isfile(second)
+    assert not os.path.exists(os.path.join(str(tmp_path), "referenced.json"))
+
+
+def test_sources_of_referenced_transcodes_are_kept(tmp_path):
+    transcoded, source, info, other = make_files(
+        tmp_path, "transcoded/low/abc.mp4", "videos/abc.mp4", "videos/abc.json", "videos/old.mp4")
+    report = StorageManager(str(tmp_path), max_age=DAY).collect([transcoded], now=time.time() + DAY)
+    assert report["removed"]["orphans"] == [1, 10]
+    assert os.path.isfile(source)
+    assert os.path.isfile(info)
+    assert not os.path.exists(other)
+
+
+def test_kept_source_markers_follow_their_download(tmp_path):
+    source, marker, old_marker = make_files(
+        tmp_path, "videos/abc.mp4", "transcoded/low/abc.source", "transcoded/low/old.source")
+    report = StorageManager(str(tmp_path), max_age=DAY).collect([source], now=time.time() + DAY)
+    assert report["removed"]["orphans"] == [1, 10]
+    assert os.path.isfile(marker)
+    assert not os.path.exists(old_marker)
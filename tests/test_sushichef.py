@@ -0,0 +1,426 @@
+import json
+import os
+import threading
+
+import bs4
+import pytest
+
+from crawl_filter import CrawlFilter
+from retry_queue import RetryQueue
+
+pytest.importorskip("ricecooker")
+import sushichef  # noqa: E402
+
+
+@pytest.fixture
+def chefdata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(sushichef.DATA_DIR)
+    return tmp_path
+
+
+def test_entry_fetched_needs_the_packaged_file(chefdata):
+    topic = sushichef.LessonTopic("Topic", "https://academy.hsoub.com/topic/")
+    entry = dict(title="Item", source_id="https://academy.hsoub.com/item/")
+    item_dir = topic.item_path(sushichef.Article(entry["title"], entry["source_id"]))
+    # build_path made the directory, nothing was fetched yet
+    assert os.path.isdir(item_dir)
+    assert not topic.entry_fetched(entry)
+    with open(os.path.join(item_dir, "item.zip"), "wb") as f:
+        f.write(b"zip")
+    assert topic.entry_fetched(entry)
+
+
+class FakeItem(object):
+    def __init__(self, entry):
+        self.entry = entry
+        self.source_id = entry["source_id"]
+
+    def to_node(self):
+        return dict(title=self.entry["title"], source_id=self.entry["source_id"])
+
+
+class FakeTopic(object):
+    def __init__(self, source_id, pages, per_page, build=None):
+        self.source_id = source_id
+        self.page_urls = ["{}?page={}".format(source_id, page) for page in range(1, pages + 1)]
+        self.per_page = per_page
+        self.build = build
+        self.listed = []
+        self.scheduled = {}
+
+    def pages(self):
+        return self.page_urls
+
+    def list_page(self, page_url):
+        self.listed.append(page_url)
+        return [dict(kind="html5", title="{} {}".format(page_url, index),
+                     source_id="{}#{}".format(page_url, index))
+                for index in range(self.per_page)]
+
+    def build_entry(self, entry):
+        if self.build is not None:
+            self.build(entry)
+        return FakeItem(entry)
+
+
+class FakeCategory(object):
+    def __init__(self, topics):
+        self.title = "Category"
+        self.topics = topics
+
+
+def test_sample_stops_the_pagination(monkeypatch):
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter(sample=4))
+    topics = [FakeTopic("https://academy.hsoub.com/topic{}/".format(index), pages=10, per_page=3)
+              for index in range(3)]
+    taken = 0
+    for _, topic, _, _, entries in sushichef.listing_pages([FakeCategory(topics)], workers=8):
+        taken += len(sushichef.CRAWL_FILTER.take_sample(topic.source_id, entries))
+    assert taken == 12
+    for topic in topics:
+        assert topic.listed == topic.page_urls[:2]
+
+
+def test_items_come_out_while_others_are_built(chefdata, monkeypatch):
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter())
+    for name in sushichef.ASSET_URLS:
+        with open(os.path.join(sushichef.DATA_DIR, name), "w") as f:
+            f.write("/* test */")
+    monkeypatch.setattr(sushichef, "ASSETS", {})
+    first_out = threading.Event()
+    waited = []
+
+    def build(entry):
+        if entry["title"].endswith("?page=1 0"):
+            waited.append(first_out.wait(5))
+
+    topic = FakeTopic("https://academy.hsoub.com/topic/", pages=1, per_page=3, build=build)
+    titles = []
+    for item in sushichef.iter_items([FakeCategory([topic])], concurrency=4):
+        titles.append(item["node"]["title"])
+        first_out.set()
+    assert waited == [True]
+    assert not titles[0].endswith("?page=1 0")
+    assert len(titles) == 3
+    assert sorted(topic.scheduled) == [(1, 0), (1, 1), (1, 2)]
+
+
+@pytest.fixture
+def retry_queue(tmp_path, monkeypatch):
+    queue = RetryQueue(str(tmp_path / "retry_queue.json"), delay=0)
+    monkeypatch.setattr(sushichef, "RETRY_QUEUE", queue)
+    monkeypatch.setattr(sushichef, "RETRY_WAIT", 0)
+    return queue
+
+
+def fetch_as(pages):
+    """
+    A download() answering from pages, a url -> html or exception dict,
+    anything else is a 404.
+    """
+    def download(source_id):
+        page = pages.get(source_id)
+        if page is None or isinstance(page, Exception):
+            sushichef.RETRY_QUEUE.fail("page", source_id, page or "404", retry=page is not None)
+            return False
+        return bs4.BeautifulSoup(page, "html.parser")
+    return download
+
+
+def test_failed_html_app_has_no_file(chefdata, retry_queue, monkeypatch):
+    monkeypatch.setattr(sushichef, "download", fetch_as({}))
+    html_app = sushichef.HTMLApp("Article", "https://academy.hsoub.com/article/")
+    html_app.to_file(sushichef.DATA_DIR)
+    assert html_app.filepath is None
+    assert html_app.to_node() is None
+    question = sushichef.Question("Question", "https://academy.hsoub.com/question/")
+    question.download(base_path=sushichef.DATA_DIR)
+    assert question.to_node() is None
+
+
+def test_html_app_points_at_its_zip(chefdata, retry_queue, monkeypatch):
+    url = "https://academy.hsoub.com/article/"
+    monkeypatch.setattr(sushichef, "download", fetch_as({url: "<article><p>Text</p></article>"}))
+    monkeypatch.setattr(sushichef, "ASSETS", {"styles.css": "p{margin:0}", "scripts.js": ""})
+    html_app = sushichef.HTMLApp("Article", url)
+    html_app.to_file(sushichef.DATA_DIR)
+    assert os.path.isfile(html_app.filepath)
+
+    # a refresh whose fetch fails keeps the zip of the last run
+    monkeypatch.setattr(sushichef, "download", fetch_as({}))
+    monkeypatch.setattr(sushichef, "REFRESH", True)
+    refreshed = sushichef.HTMLApp("Article", url)
+    refreshed.to_file(sushichef.DATA_DIR)
+    assert refreshed.filepath == html_app.filepath
+
+
+class RetryTopic(sushichef.Topic):
+    def build_item(self, entry, defer=None):
+        return FakeItem(entry)
+
+
+def test_recovered_item_replaces_every_listing(chefdata, retry_queue):
+    entry = dict(title="Item", source_id="https://academy.hsoub.com/item/")
+    first = RetryTopic("First", "https://academy.hsoub.com/first/")
+    second = RetryTopic("Second", "https://academy.hsoub.com/second/")
+    other = RetryTopic("Other", "https://academy.hsoub.com/other/")
+    failed = FakeItem(dict(entry, title="Failed"))
+    first.scheduled[(1, 0)] = failed
+    second.scheduled[(2, 3)] = failed
+    other.scheduled[(1, 0)] = FakeItem(dict(title="Other", source_id="https://academy.hsoub.com/other-item/"))
+    retry_queue.add("item", entry["source_id"], "timeout", topic=first.source_id, entry=entry)
+    category = FakeCategory([first, second, other])
+    sushichef.HsoubAcademyChef().retry_failed([category])
+    assert retry_queue.entries == {}
+    for topic in (first, second):
+        topic.add_scheduled()
+        assert topic.tree_nodes[entry["source_id"]]["title"] == "Item"
+    assert other.retried == []
+
+
+def test_home_page_is_retried_in_place(retry_queue, monkeypatch):
+    monkeypatch.setattr(sushichef.time, "sleep", lambda seconds: None)
+    pages = {sushichef.BASE_URL: IOError("503")}
+    fetches = []
+
+    def download(source_id):
+        fetches.append(source_id)
+        if len(fetches) == 2:
+            pages[source_id] = "<ul></ul>"
+        return fetch_as(pages)(source_id)
+    monkeypatch.setattr(sushichef, "download", download)
+    assert sushichef.home_page().find("ul") is not None
+    assert len(fetches) == 2
+    # the retry queue has no handler for it
+    assert retry_queue.entries == {}
+
+
+def test_home_page_gives_up_on_client_errors(retry_queue, monkeypatch):
+    monkeypatch.setattr(sushichef, "download", fetch_as({}))
+    with pytest.raises(IOError):
+        list(sushichef.browser_resources())
+
+
+def test_upload_takes_the_md5_from_the_manifest(chefdata, monkeypatch):
+    from ricecooker import config
+    from ricecooker.classes import files
+    from file_index import FileIndex
+    from manifest import Manifest, md5_file
+    import utils
+
+    monkeypatch.setattr(config, "STORAGE_DIRECTORY", str(chefdata / "storage"))
+    monkeypatch.setattr(files, "download", files.download)
+    path = os.path.join(sushichef.DATA_DIR, "book.pdf")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4 book")
+    index = FileIndex(sushichef.DATA_DIR, manifest=Manifest(str(chefdata / "manifest.json")))
+    monkeypatch.setattr(utils, "FILE_INDEX", index)
+    index.add_file(path, md5=md5_file(path))
+    utils.use_manifest_hashes()
+
+    write_and_get_hash = files.write_and_get_hash
+
+    def read_again(*args):
+        raise AssertionError("the file was read again")
+    monkeypatch.setattr(files, "write_and_get_hash", read_again)
+    document = files.DocumentFile(path)
+    assert document.process_file() == "{}.pdf".format(md5_file(path))
+    with open(config.get_storage_path(document.filename), "rb") as f:
+        assert f.read() == b"%PDF-1.4 book"
+
+    # rewritten behind the index's back, ricecooker hashes it itself
+    monkeypatch.setattr(files, "write_and_get_hash", write_and_get_hash)
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4 second edition")
+    assert files.DocumentFile(path).process_file() == "{}.pdf".format(md5_file(path))
+
+
+def test_another_ricecooker_keeps_its_download(monkeypatch, caplog):
+    from ricecooker.classes import files
+    import utils
+
+    def download(path, default_ext=None, session=None):
+        return "ricecooker"
+    monkeypatch.setattr(files, "download", download)
+    utils.use_manifest_hashes()
+    assert files.download is download
+    assert "download(path, default_ext, session) isn't the one of the pinned version" in caplog.text
+
+
+def test_subtitles_come_from_the_download(monkeypatch):
+    video = sushichef.YouTubeResource("https://www.youtube.com/watch?v=abc")
+    video.video_id = "abc"
+    video.subtitles = ["ar", "en"]
+
+    def extract(*args, **kwargs):
+        raise AssertionError("extracted again")
+    monkeypatch.setattr(video, "get_video_info", extract)
+    assert [sub["language"] for sub in video.subtitles_dict()] == ["ar", "en"]
+    assert all(sub["youtube_id"] == "abc" for sub in video.subtitles_dict())
+    video.subtitles = []
+    assert video.subtitles_dict() == []
+
+
+class FakeVideoStore(object):
+    """
+    Answers for the downloaded videos of videos, a video id -> path dict,
+    the others can't be fetched.
+    """
+    def __init__(self, videos):
+        self.videos = videos
+
+    def get(self, video_id, fetch):
+        if video_id not in self.videos:
+            raise IOError("connection reset")
+        return dict(title=video_id, subtitles=[])
+
+    def video_path(self, video_id):
+        return self.videos[video_id]
+
+
+def test_failed_playlist_entry_goes_to_the_item(chefdata, retry_queue, monkeypatch):
+    path = os.path.join(sushichef.DATA_DIR, "good.mp4")
+    with open(path, "wb") as f:
+        f.write(b"video")
+    monkeypatch.setattr(sushichef, "VIDEO_STORE", FakeVideoStore(dict(good=path)))
+    playlist = sushichef.YouTubeResource("https://www.youtube.com/playlist?list=PL1")
+    monkeypatch.setattr(playlist, "playlist_entries", lambda: [
+        ("Good", "https://www.youtube.com/watch?v=good"), ("Bad", "https://www.youtube.com/watch?v=bad")])
+    with retry_queue.collect() as failures:
+        resources = playlist.download_playlist(base_path=sushichef.DATA_DIR)
+    assert [resource.filepath for resource in resources] == [path, None]
+    assert len(failures) == 1
+    assert failures[0][0].startswith("video https://www.youtube.com/watch?v=bad")
+    # the item they are collected for is queued, not the video
+    assert retry_queue.entries == {}
+
+
+class DeferTopic(sushichef.Topic):
+    def list_page(self, page_url):
+        return [dict(kind="html5", title="Item", source_id="https://academy.hsoub.com/item/")]
+
+    def build_item(self, entry, defer=None):
+        defer(lambda: sushichef.RETRY_QUEUE.fail("video", "https://www.youtube.com/watch?v=bad", "timeout"))
+        return FakeItem(entry)
+
+
+def test_failed_deferred_video_queues_its_item(chefdata, retry_queue, monkeypatch):
+    from item_registry import ItemRegistry
+    from scheduler import CrawlScheduler
+
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter())
+    monkeypatch.setattr(sushichef, "ITEM_REGISTRY", ItemRegistry())
+    topic = DeferTopic("Topic", "https://academy.hsoub.com/topic/")
+    scheduler = CrawlScheduler(workers=1)
+    topic.schedule_page(scheduler, set(), 1, "https://academy.hsoub.com/topic/?page=1")
+    scheduler.run()
+    assert scheduler.done == 2
+    assert list(retry_queue.entries) == ["item https://academy.hsoub.com/item/"]
+    entry = retry_queue.entries["item https://academy.hsoub.com/item/"]
+    assert entry["topic"] == topic.source_id
+    assert entry["entry"]["title"] == "Item"
+
+
+def test_retry_pass_drops_stray_video_entries(chefdata, retry_queue):
+    retry_queue.add("video", "https://www.youtube.com/watch?v=bad", "timeout")
+    sushichef.HsoubAcademyChef().retry_failed([])
+    assert retry_queue.entries == {}
+
+
+class ListedTopic(sushichef.Topic):
+    def __init__(self, title, source_id, entries, builds):
+        super(ListedTopic, self).__init__(title, source_id)
+        self.entries = entries
+        self.builds = builds
+
+    def pages(self):
+        return ["{}?page=1".format(self.source_id)]
+
+    def list_page(self, page_url):
+        return list(self.entries)
+
+    def build_item(self, entry, defer=None):
+        self.builds.append(entry["source_id"])
+        return FakeItem(entry)
+
+
+def test_item_listed_in_two_topics_is_built_once(chefdata, monkeypatch):
+    from item_registry import ItemRegistry
+
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter())
+    monkeypatch.setattr(sushichef, "ITEM_REGISTRY", ItemRegistry())
+    monkeypatch.setattr(sushichef, "ASSETS", {"styles.css": "", "scripts.js": ""})
+    for name in sushichef.ASSET_URLS:
+        with open(os.path.join(sushichef.DATA_DIR, name), "w") as f:
+            f.write("/* test */")
+    shared = dict(title="Shared", source_id="https://academy.hsoub.com/shared/")
+    builds = []
+    topics = [ListedTopic("First", "https://academy.hsoub.com/first/", [shared], builds),
+              ListedTopic("Second", "https://academy.hsoub.com/second/",
+                          [dict(shared, source_id=shared["source_id"] + "?tag=second")], builds)]
+    items = list(sushichef.iter_items([FakeCategory(topics)], concurrency=2))
+    assert len(builds) == 1
+    assert len(items) == 2
+    for topic in topics:
+        topic.add_scheduled()
+        assert [node["title"] for node in topic.tree_nodes.values()] == ["Shared"]
+    assert sushichef.ITEM_REGISTRY.duplicates == 1
+
+
+def test_catalogue_lists_the_sampled_entries(chefdata, monkeypatch):
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", sushichef.CRAWL_FILTER)
+    topics = [FakeTopic("https://academy.hsoub.com/topic{}/".format(index), pages=10, per_page=3)
+              for index in range(2)]
+    monkeypatch.setattr(sushichef, "browser_resources", lambda: iter([FakeCategory(topics)]))
+    sushichef.HsoubAcademyChef().write_catalogue({'--sample': "4", '--catalogue-workers': "4"})
+    with open(os.path.join(sushichef.DATA_DIR, "catalogue.jsonl")) as f:
+        entries = [json.loads(line) for line in f]
+    for topic in topics:
+        listed = [entry for entry in entries if entry["topic"] == topic.source_id]
+        assert [entry["title"] for entry in listed] == [
+            "{}?page=1 {}".format(topic.source_id, index) for index in range(3)] + [
+            "{}?page=2 0".format(topic.source_id)]
+        assert all(entry["category"] == "Category" and entry["kind"] == "html5" for entry in listed)
+        assert listed[0]["page"] == topic.page_urls[0]
+        # the pages after the sample are never fetched
+        assert topic.listed == topic.page_urls[:2]
+
+
+HOME_PAGE = """<ul data-role="primaryNavBar">
+<li><a>دروس ومقالات</a><ul><li><a href="https://academy.hsoub.com/programming/">برمجة</a></li></ul></li>
+<li><a>كتب وملفات</a><ul><li><a href="https://academy.hsoub.com/files/">كتب</a></li></ul></li>
+<li><a>أسئلة وأجوبة</a><ul><li><a href="https://academy.hsoub.com/questions/">أسئلة</a></li>
+<li><a href="#">كل الأسئلة</a></li></ul></li>
+</ul>"""
+
+
+def test_categories_and_topics_are_filtered(retry_queue, monkeypatch):
+    monkeypatch.setattr(sushichef, "download", fetch_as({sushichef.BASE_URL: HOME_PAGE}))
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter.from_options(
+        {'--categories': "Books and Resources,أسئلة وأجوبة"}))
+    categories = list(sushichef.browser_resources())
+    assert [category.title for category in categories] == ["كتب وملفات", "أسئلة وأجوبة"]
+    assert [type(topic).__name__ for topic in categories[0].topics] == ["BookTopic"]
+    assert [topic.source_id for topic in categories[1].topics] == ["https://academy.hsoub.com/questions/"]
+
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter.from_options(
+        {'--topics': "https://academy.hsoub.com/files/"}))
+    categories = list(sushichef.browser_resources())
+    assert [topic.source_id for category in categories for topic in category.topics] == [
+        "https://academy.hsoub.com/files/"]
+
+
+class DatedTopic(sushichef.Topic):
+    def listing(self, page):
+        return [dict(title="Old", source_id="https://academy.hsoub.com/old/", updated="2019-12-01T10:00:00Z"),
+                dict(title="New", source_id="https://academy.hsoub.com/new/", updated="2020-02-01T10:00:00Z"),
+                dict(title="Undated", source_id="https://academy.hsoub.com/undated/", updated=None)]
+
+
+def test_since_filters_the_listing(retry_queue, monkeypatch):
+    page_url = "https://academy.hsoub.com/topic/?page=1"
+    monkeypatch.setattr(sushichef, "download", fetch_as({page_url: "<ol></ol>"}))
+    monkeypatch.setattr(sushichef, "CRAWL_FILTER", CrawlFilter.from_options({'--since': "2020-01-01"}))
+    topic = DatedTopic("Topic", "https://academy.hsoub.com/topic/")
+    assert [entry["title"] for entry in topic.list_page(page_url)] == ["New", "Undated"]
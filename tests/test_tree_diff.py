@@ -0,0 +1,55 @@
+import os
+
+from tree_diff import changed_subtree, diff_trees, tree_hashes
+
+
+def make_tree(path):
+    return dict(source_id="channel", kind="topic", title="Channel", children=[
+        dict(source_id="topic", kind="topic", title="Topic", children=[
+            dict(source_id="item", kind="html5", title="Item", files=[dict(file_type="html5", path=path)]),
+        ]),
+    ])
+
+
+def write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_unchanged_tree_has_no_diff(tmp_path):
+    path = str(tmp_path / "f.zip")
+    write(path, b"first")
+    old_tree = make_tree(path)
+    diff = diff_trees(old_tree, make_tree(path), old_hashes=tree_hashes(old_tree))
+    assert diff == dict(added=[], removed=[], modified=[], changed_files=[])
+
+
+def test_file_rewritten_in_place_is_modified(tmp_path):
+    path = str(tmp_path / "f.zip")
+    write(path, b"first")
+    old_tree = make_tree(path)
+    old_hashes = tree_hashes(old_tree)
+
+    write(path, b"second version")
+    os.utime(path, (1, 1))
+    new_tree = make_tree(path)
+    diff = diff_trees(old_tree, new_tree, old_hashes=old_hashes, new_hashes=tree_hashes(new_tree))
+
+    assert diff["modified"] == [("channel", "topic", "item")]
+    assert diff["changed_files"] == [path]
+    changed = changed_subtree(new_tree, diff)
+    assert changed["children"][0]["children"][0]["source_id"] == "item"
+
+
+def test_added_node_files_are_changed(tmp_path):
+    path = str(tmp_path / "f.zip")
+    other = str(tmp_path / "g.zip")
+    write(path, b"first")
+    write(other, b"other")
+    old_tree = make_tree(path)
+    new_tree = make_tree(path)
+    new_tree["children"][0]["children"].append(
+        dict(source_id="new", kind="html5", title="New", files=[dict(file_type="html5", path=other)]))
+    diff = diff_trees(old_tree, new_tree, old_hashes=tree_hashes(old_tree))
+    assert diff["added"] == [("channel", "topic", "new")]
+    assert diff["changed_files"] == [other]
@@ -0,0 +1,86 @@
+from io import BytesIO
+import os
+import struct
+import zipfile
+
+import pytest
+
+from verify import CORRUPT_SUFFIX, Suspect, check_jpeg, check_mp4, check_pdf, check_zip, verify
+
+
+def make_zip():
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("index.html", "<p>نص</p>" * 100)
+        zf.writestr("css/styles.css", "p{margin:0}")
+    return buffer.getvalue()
+
+
+PDF = (b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog >>\nendobj\ntrailer\n<< /Root 1 0 R >>\n"
+       b"startxref\n9\n%%EOF\n")
+# an incremental update appends a section with its own %%EOF
+PDF_UPDATED = PDF + b"2 0 obj\n<< >>\nendobj\nstartxref\n120\n%%EOF\r\n"
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00\x10JFIF" + b"\x11" * 2000 + b"\xff\xd9"
+
+
+def box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+MP4 = box(b"ftyp", b"isom\x00\x00\x02\x00") + box(b"moov", b"\x01" * 100) + box(b"mdat", b"\x02" * 5000)
+
+GOOD = [("zip", check_zip, make_zip()), ("pdf", check_pdf, PDF), ("pdf", check_pdf, PDF_UPDATED),
+        ("jpg", check_jpeg, JPEG), ("mp4", check_mp4, MP4)]
+TRUNCATED = [(kind, check, data[:len(data) // 2]) for kind, check, data in GOOD]
+PADDED = [(kind, check, data + b"\x00" * 3000) for kind, check, data in GOOD]
+
+
+@pytest.mark.parametrize("kind,check,data", GOOD + PADDED)
+def test_valid_files_pass(kind, check, data):
+    assert check(data) is None
+
+
+@pytest.mark.parametrize("kind,check,data", TRUNCATED)
+def test_truncated_files_fail(kind, check, data):
+    error = check(data)
+    assert error is not None
+    assert not isinstance(error, Suspect)
+
+
+def test_pdf_header_after_junk():
+    assert check_pdf(b"\r\n" * 10 + PDF) is None
+    assert check_pdf(b"x" * 2000 + PDF) == "missing %PDF header"
+
+
+@pytest.mark.parametrize("check,data", [
+    (check_pdf, PDF + b"appended by a mail gateway" * 100),
+    (check_jpeg, JPEG + b"camera maker trailer" * 100),
+])
+def test_data_after_the_end_marker_is_suspect(check, data):
+    assert isinstance(check(data), Suspect)
+
+
+def test_truncated_jpeg_with_thumbnail_is_suspect():
+    # the EXIF thumbnail ends with its own end marker
+    thumbnail = b"\xff\xd8\xff\xdb" + b"\x22" * 100 + b"\xff\xd9"
+    data = b"\xff\xd8\xff\xe1" + thumbnail + b"\x33" * 5000
+    assert isinstance(check_jpeg(data), Suspect)
+    assert check_jpeg(JPEG[:-2]) == "missing JPEG end marker"
+
+
+def test_bad_files_are_renamed_and_suspect_ones_kept(tmp_path):
+    data_dir = str(tmp_path)
+    files = dict(good=("item.zip", make_zip()), truncated=("book.pdf", PDF[:40]),
+                 padded=("video.mp4", MP4 + b"\x00" * 7), suspect=("image.jpg", JPEG + b"trailer" * 200))
+    paths = {}
+    for name, (filename, content) in files.items():
+        paths[name] = os.path.join(data_dir, name, filename)
+        os.makedirs(os.path.dirname(paths[name]))
+        with open(paths[name], "wb") as f:
+            f.write(content)
+    bad = verify(data_dir, workers=2)
+    assert [path for path, _ in bad] == [paths["truncated"]]
+    assert not os.path.exists(paths["truncated"])
+    assert os.path.isfile(paths["truncated"] + CORRUPT_SUFFIX)
+    for name in ("good", "padded", "suspect"):
+        assert os.path.isfile(paths[name])
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+
+from manifest import md5_file
+from video_store import VideoStore
+
+
+def test_info_is_rehashed_when_the_video_changed(tmp_path):
+    store = VideoStore(str(tmp_path))
+    os.makedirs(store.base_path)
+    video_path = store.video_path("abc")
+    with open(video_path, "wb") as f:
+        f.write(b"first download")
+    info = store.save_info("abc", dict(id="abc", title="Video"))
+    assert info["md5"] == md5_file(video_path)
+    assert store.load_info("abc") == info
+
+    with open(video_path, "wb") as f:
+        f.write(b"downloaded again, longer")
+    info = store.load_info("abc")
+    assert info["md5"] == md5_file(video_path)
+    assert info["size"] == os.path.getsize(video_path)
+    with open(store.info_path("abc")) as f:
+        assert json.load(f) == info
+
+
+def test_subtitle_languages_are_kept(tmp_path):
+    store = VideoStore(str(tmp_path))
+    os.makedirs(store.base_path)
+    with open(store.video_path("abc"), "wb") as f:
+        f.write(b"video")
+    info = store.save_info("abc", dict(id="abc", title="Video", subtitles={"en": [{}], "ar": [{}]}))
+    assert info["subtitles"] == ["ar", "en"]
+    assert store.load_info("abc")["subtitles"] == ["ar", "en"]
+
+
+def test_subtitles_are_added_to_old_infos(tmp_path):
+    store = VideoStore(str(tmp_path))
+    os.makedirs(store.base_path)
+    with open(store.video_path("abc"), "wb") as f:
+        f.write(b"video")
+    store.save_info("abc", dict(id="abc", title="Video"))
+    info = store.get("abc", lambda download_to: None)
+    assert info["subtitles"] is None
+    store.set_subtitles("abc", ["en"])
+    assert VideoStore(str(tmp_path)).load_info("abc")["subtitles"] == ["en"]
+
+
+def test_concurrent_requests_download_once(tmp_path):
+    store = VideoStore(str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+    fetches = []
+
+    def fetch(download_to):
+        fetches.append(download_to)
+        started.set()
+        release.wait(5)
+        with open(os.path.join(download_to, "abc.mp4"), "wb") as f:
+            f.write(b"video")
+        return dict(id="abc", title="Video")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(store.get, "abc", fetch)
+        assert started.wait(5)
+        # these arrive while the first one downloads
+        others = [executor.submit(store.get, "abc", fetch) for _ in range(3)]
+        release.set()
+        infos = [first.result()] + [other.result() for other in others]
+    assert fetches == [store.base_path]
+    assert all(info is infos[0] for info in infos)
+    assert (store.downloads, store.reused) == (1, 3)
+    # a later request, or the next run, reuses the download
+    assert store.get("abc", fetch) is infos[0]
+    assert VideoStore(str(tmp_path)).get("abc", fetch)["md5"] == md5_file(store.video_path("abc"))
+    assert len(fetches) == 1
+
+
+def test_failed_download_is_tried_again(tmp_path):
+    store = VideoStore(str(tmp_path))
+    assert store.get("abc", lambda download_to: None) is None
+    assert store.in_flight == {}
+    assert store.get("abc", lambda download_to: dict(id="abc", title="Video"))["title"] == "Video"
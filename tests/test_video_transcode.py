@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+
+from video_transcode import TranscodePool, source_kept_path, transcoded_path
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_transcoded_path(tmp_path):
+    assert transcoded_path(str(tmp_path), "abc", "low") == os.path.join(str(tmp_path), "transcoded", "low", "abc.mp4")
+
+
+def test_cached_output_is_reused_without_ffmpeg(tmp_path):
+    data_dir = str(tmp_path)
+    src = os.path.join(data_dir, "videos", "abc.mp4")
+    write(src, b"source video")
+    cached = transcoded_path(data_dir, "abc", "low")
+    write(cached, b"small")
+    # ffmpeg would fail, the cache hit never runs it
+    pool = TranscodePool("low", data_dir, ffmpeg=os.path.join(data_dir, "no-ffmpeg"))
+    try:
+        assert pool.result("abc", src) == cached
+    finally:
+        pool.shutdown()
+
+
+def test_failed_transcode_falls_back_to_source(tmp_path):
+    data_dir = str(tmp_path)
+    src = os.path.join(data_dir, "videos", "abc.mp4")
+    write(src, b"source video")
+    pool = TranscodePool("low", data_dir, ffmpeg=os.path.join(data_dir, "no-ffmpeg"))
+    try:
+        assert pool.result("abc", src) == src
+        assert not os.path.exists(transcoded_path(data_dir, "abc", "low"))
+    finally:
+        pool.shutdown()
+
+
+def test_resolve_tree_swaps_in_transcodes(tmp_path):
+    data_dir = str(tmp_path)
+    src = os.path.join(data_dir, "videos", "abc.mp4")
+    other = os.path.join(data_dir, "videos", "other.mp4")
+    write(src, b"source video")
+    cached = transcoded_path(data_dir, "abc", "low")
+    write(cached, b"small")
+    pool = TranscodePool("low", data_dir)
+    try:
+        pool.submit("abc", src)
+        tree = dict(source_id="topic", children=[
+            dict(source_id="a", files=[dict(file_type="video", path=src)]),
+            dict(source_id="b", files=[dict(file_type="video", path=other)]),
+        ])
+        assert pool.resolve_tree(tree) == [cached]
+        assert tree["children"][0]["files"][0]["path"] == cached
+        # not submitted, left alone
+        assert tree["children"][1]["files"][0]["path"] == other
+    finally:
+        pool.shutdown()
+
+
+def fake_ffmpeg(data_dir, size, seconds=0):
+    """
+    An ffmpeg writing size bytes to its output, the last argument, after
+    sleeping seconds.
+    """
+    path = os.path.join(data_dir, "fake-ffmpeg")
+    with open(path, "w") as f:
+        f.write("#!{}\nimport sys, time\ntime.sleep({})\nopen(sys.argv[-1], 'wb').write(bytes({}))\n".format(
+            sys.executable, seconds, size))
+    os.chmod(path, 0o755)
+    return path
+
+
+def test_source_is_kept_when_the_transcode_isnt_smaller(tmp_path):
+    data_dir = str(tmp_path)
+    src = os.path.join(data_dir, "videos", "abc.mp4")
+    write(src, b"source video")
+    pool = TranscodePool("low", data_dir, ffmpeg=fake_ffmpeg(data_dir, size=100))
+    try:
+        assert pool.result("abc", src) == src
+    finally:
+        pool.shutdown()
+    dst = transcoded_path(data_dir, "abc", "low")
+    assert not os.path.exists(dst)
+    assert os.path.isfile(source_kept_path(dst))
+    assert pool.saved_bytes == 0
+    # the next run doesn't run ffmpeg again
+    pool = TranscodePool("low", data_dir, ffmpeg=os.path.join(data_dir, "no-ffmpeg"))
+    try:
+        assert pool.result("abc", src) == src
+    finally:
+        pool.shutdown()
+
+
+def test_smaller_transcode_is_cached(tmp_path):
+    data_dir = str(tmp_path)
+    src = os.path.join(data_dir, "videos", "abc.mp4")
+    write(src, b"source video")
+    pool = TranscodePool("low", data_dir, ffmpeg=fake_ffmpeg(data_dir, size=4))
+    try:
+        assert pool.result("abc", src) == transcoded_path(data_dir, "abc", "low")
+    finally:
+        pool.shutdown()
+    assert pool.saved_bytes == len(b"source video") - 4
+
+
+def test_transcodes_past_the_deadline_keep_the_source(tmp_path):
+    data_dir = str(tmp_path)
+    pool = TranscodePool("low", data_dir, workers=1, ffmpeg=fake_ffmpeg(data_dir, size=4, seconds=30))
+    tree = dict(source_id="topic", children=[])
+    for video_id in ("running", "pending"):
+        src = os.path.join(data_dir, "videos", "{}.mp4".format(video_id))
+        write(src, b"source video")
+        pool.submit(video_id, src)
+        tree["children"].append(dict(source_id=video_id, files=[dict(file_type="video", path=src)]))
+    started = time.time()
+    assert pool.resolve_tree(tree, deadline=started + 0.5) == []
+    pool.shutdown(cancel=True)
+    assert time.time() - started < 10
+    assert pool.jobs["pending"].cancelled()
+    assert not os.listdir(os.path.join(data_dir, "transcoded", "low"))
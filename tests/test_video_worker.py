@@ -0,0 +1,25 @@
+import logging
+
+import pytest
+
+from video_worker import VideoJobError, VideoWorkerPool
+
+
+def test_hung_job_is_requeued_then_given_up(caplog):
+    pool = VideoWorkerPool(workers=1, timeout=0.5, stall_timeout=0.5, attempts=2,
+                           extractor="video_worker:fake_extract")
+    with caplog.at_level(logging.INFO):
+        with pytest.raises(VideoJobError):
+            pool.run("fake://hang/abc")
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("requeued (1/2)" in message for message in messages)
+    assert not any("requeued (2/2)" in message for message in messages)
+    assert any("giving up after 2 attempts" in message for message in messages)
+    assert pool.killed == 2
+
+
+def test_extractor_errors_are_not_retried(tmp_path):
+    pool = VideoWorkerPool(workers=1, extractor="video_worker:fake_extract")
+    with pytest.raises(VideoJobError):
+        pool.run("fake://error/abc", download_to=str(tmp_path))
+    assert pool.jobs == 1
@@ -0,0 +1,60 @@
+import os
+import time
+import zipfile
+
+from zip_writer import CompressionPolicy, CompressionStats, ReproducibleZipWriter
+
+
+def write_zip(filepath, entries, policy=None, stats=None):
+    writer = ReproducibleZipWriter(filepath, policy=policy or CompressionPolicy(),
+                                   stats=stats or CompressionStats())
+    with writer as zipper:
+        for name, content in entries:
+            zipper.write_contents(name, content)
+    return writer
+
+
+ENTRIES = [("index.html", "<p>نص</p>" * 50), ("js/scripts.js", "var a = 1;"),
+           ("css/styles.css", "p{margin:0}"), ("files/a.png", b"\x89PNG" + bytes(range(256)))]
+
+
+def test_same_content_gives_the_same_bytes(tmp_path):
+    first = write_zip(str(tmp_path / "first.zip"), ENTRIES)
+    # another run, another order of writes
+    time.sleep(0.01)
+    second = write_zip(str(tmp_path / "second.zip"), list(reversed(ENTRIES)))
+    with open(first.filepath, "rb") as f1, open(second.filepath, "rb") as f2:
+        assert f1.read() == f2.read()
+    assert first.md5 == second.md5
+    with zipfile.ZipFile(first.filepath) as zf:
+        assert zf.namelist() == sorted(name for name, _ in ENTRIES)
+        assert set(info.date_time for info in zf.infolist()) == {(1980, 1, 1, 0, 0, 0)}
+
+
+def test_unchanged_zip_is_not_rewritten(tmp_path):
+    filepath = str(tmp_path / "item.zip")
+    assert write_zip(filepath, ENTRIES).changed
+    os.utime(filepath, (0, 0))
+    assert not write_zip(filepath, ENTRIES).changed
+    assert os.path.getmtime(filepath) == 0
+    assert write_zip(filepath, ENTRIES[1:]).changed
+
+
+def test_media_is_stored_and_text_deflated(tmp_path):
+    stats = CompressionStats()
+    write_zip(str(tmp_path / "item.zip"), ENTRIES, policy=CompressionPolicy(text_level=9), stats=stats)
+    with zipfile.ZipFile(str(tmp_path / "item.zip")) as zf:
+        types = dict((info.filename, info.compress_type) for info in zf.infolist())
+    assert types["files/a.png"] == zipfile.ZIP_STORED
+    assert types["index.html"] == zipfile.ZIP_DEFLATED
+    assert types["css/styles.css"] == zipfile.ZIP_DEFLATED
+    assert stats.modes["stored"]["entries"] == 1
+    assert stats.modes["deflate-9"]["entries"] == 3
+
+
+def test_media_is_deflated_without_store_media():
+    policy = CompressionPolicy(store_media=False)
+    assert policy.for_entry("files/a.JPG")[0] == zipfile.ZIP_DEFLATED
+    assert CompressionPolicy().for_entry("files/a.JPG")[0] == zipfile.ZIP_STORED
+    assert CompressionPolicy().for_entry("book.pdf")[2] == "stored"
+    assert CompressionPolicy(text_level=1).for_entry("index.html")[1:] == (1, "deflate-1")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+
+from manifest import md5_file
+from utils import known_md5
+
+
+NODE_FIELDS = ("kind", "title", "description", "author", "language", "license")
+
+_hash_cache = {}
+
+
+def load_tree(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_hash(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _hash_cache:
+        # files written by the chef were hashed while writing them
+        _hash_cache[key] = known_md5(path) or md5_file(path)
+    return _hash_cache[key]
+
+
+def recorded_hash(path, hashes):
+    if hashes is not None and path in hashes:
+        return hashes[path]
+    return file_hash(path)
+
+
+def node_files(node, hashes=None):
+    """
+    Maps the files of node to their hash, taken from hashes (the hashes
+    recorded when its tree was written) when they are there.
+    """
+    files = {}
+    for file_ in node.get("files", []):
+        if file_.get("path") is not None:
+            files[file_["path"]] = recorded_hash(file_["path"], hashes)
+        elif file_.get("youtube_id") is not None:
+            key = "{}:{}".format(file_["youtube_id"], file_.get("language", ""))
+            files[key] = key
+    thumbnail = node.get("thumbnail")
+    if thumbnail and ((hashes is not None and thumbnail in hashes) or os.path.isfile(thumbnail)):
+        files[thumbnail] = recorded_hash(thumbnail, hashes)
+    return files
+
+
+def tree_hashes(tree):
+    """
+    The current hash of every file of tree, saved along with the tree so
+    the next diff compares against what the files held back then.
+    """
+    hashes = {}
+    for node in index_tree(tree).values():
+        hashes.update(node_files(node))
+    return hashes
+
+
+def index_tree(tree):
+    """
+    Map every node to its chain of source_ids, the same item can live
+    under several topics so the source_id alone is not unique.
+    """
+    index = {}
+    stack = [((), tree)]
+    while stack:
+        parents, node = stack.pop()
+        if node is None:
+            continue
+        key = parents + (node["source_id"],)
+        index[key] = node
+        for child in node.get("children", []):
+            stack.append((key, child))
+    return index
+
+
+def node_signature(node, hashes=None):
+    signature = {field: node.get(field) for field in NODE_FIELDS}
+    signature["files"] = node_files(node, hashes)
+    return signature
+
+
+def diff_trees(old_tree, new_tree, old_hashes=None, new_hashes=None):
+    """
+    old_hashes are the hashes recorded by tree_hashes() when old_tree was
+    written. Without them the files of both trees are hashed from the disk,
+    and a file rewritten in place looks unchanged.
+    """
+    old_index = index_tree(old_tree)
+    new_index = index_tree(new_tree)
+    added = [key for key in new_index if key not in old_index]
+    removed = [key for key in old_index if key not in new_index]
+    modified = []
+    changed_files = set()
+    for key in added:
+        changed_files.update(node_files(new_index[key], new_hashes).keys())
+    for key in new_index:
+        if key not in old_index:
+            continue
+        old_signature = node_signature(old_index[key], old_hashes)
+        new_signature = node_signature(new_index[key], new_hashes)
+        if old_signature != new_signature:
+            modified.append(key)
+            for path, hash_ in new_signature["files"].items():
+                if old_signature["files"].get(path) != hash_:
+                    changed_files.add(path)
+    return dict(
+        added=sorted(added),
+        removed=sorted(removed),
+        modified=sorted(modified),
+        changed_files=sorted(path for path in changed_files if os.path.isfile(path))
+    )
+
+
+def changed_subtree(tree, diff):
+    """
+    Returns a copy of tree holding only the added or modified nodes and
+    the topics needed to reach them, None if nothing changed.
+    """
+    changed = set(map(tuple, diff["added"])) | set(map(tuple, diff["modified"]))
+
+    def prune(node, parents):
+        if node is None:
+            return None
+        key = parents + (node["source_id"],)
+        children = []
+        for child in node.get("children", []):
+            child = prune(child, key)
+            if child is not None:
+                children.append(child)
+        if key not in changed and not children:
+            return None
+        node = dict(node)
+        if "children" in node:
+            node["children"] = children
+        return node
+
+    return prune(tree, ())
+
+
+def size_of(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+def write_report(diff, filepath):
+    report = dict(diff)
+    for name in ("added", "removed", "modified"):
+        report[name] = [" > ".join(key) for key in diff[name]]
+    report["changed_files_size"] = size_of(diff["changed_files"])
+    with open(filepath, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two ricecooker json trees")
+    parser.add_argument("old", help="previous ricecooker_json_tree.json")
+    parser.add_argument("new", help="current ricecooker_json_tree.json")
+    parser.add_argument("--old-hashes", default=None,
+                        help="file hashes recorded with the old tree (ricecooker_json_tree.prev.hashes.json)")
+    parser.add_argument("--report", default=None, help="write the diff as json here")
+    parser.add_argument("--changed-tree", default=None,
+                        help="write a tree with only the changed nodes here")
+    args = parser.parse_args()
+
+    new_tree = load_tree(args.new)
+    old_hashes = load_tree(args.old_hashes) if args.old_hashes is not None else None
+    diff = diff_trees(load_tree(args.old), new_tree, old_hashes=old_hashes)
+    print("Added: {} Removed: {} Modified: {} Changed files: {} ({} bytes)".format(
+        len(diff["added"]), len(diff["removed"]), len(diff["modified"]),
+        len(diff["changed_files"]), size_of(diff["changed_files"])))
+    if args.report is not None:
+        write_report(diff, args.report)
+    if args.changed_tree is not None:
+        with open(args.changed_tree, "w") as f:
+            json.dump(changed_subtree(new_tree, diff), f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
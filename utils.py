@@ -1,19 +1,137 @@
-from git import Repo
+import fnmatch
+import hashlib
+import importlib
+import inspect
+import logging
 import ntpath
 import os
 from pathlib import Path
-from bs4 import Tag
+import shutil
 import imghdr
 from io import BytesIO
 import requests
 
+from manifest import md5_file
+
+
+LOGGER = logging.getLogger()
+# the files.download this module replaces, ricecooker 0.6.46
+DOWNLOAD_PARAMETERS = ["path", "default_ext"]
+
+
+class LazyModule(object):
+    """
+    Stands for a module that is imported on first attribute access.
+    """
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, name)
+
+
+# FileIndex of the data dir, when set paths under it are answered from
+# memory instead of the filesystem
+FILE_INDEX = None
+
+
+def set_file_index(index):
+    global FILE_INDEX
+    FILE_INDEX = index
+
+
+def register_file(filepath, md5=None):
+    if FILE_INDEX is not None and FILE_INDEX.covers(filepath):
+        FILE_INDEX.add_file(filepath, md5=md5)
+
+
+def forget_file(filepath):
+    if FILE_INDEX is not None and FILE_INDEX.covers(filepath):
+        FILE_INDEX.remove_file(filepath)
+
+
+def known_md5(filepath):
+    """
+    The md5 of filepath recorded in the manifest, None if it isn't there or
+    the file changed since.
+    """
+    if FILE_INDEX is not None and FILE_INDEX.covers(filepath):
+        return FILE_INDEX.hash(filepath)
+    return None
+
+
+def file_md5(filepath):
+    md5 = known_md5(filepath)
+    if md5 is None:
+        md5 = md5_file(filepath)
+        register_file(filepath, md5=md5)
+    return md5
+
+
+def use_manifest_hashes():
+    """
+    Makes ricecooker's files.download, which copies every local file of the
+    tree to its storage named after its md5, take the md5 from the manifest.
+    A file already in storage isn't read again, one that isn't is copied
+    without hashing it. Another ricecooker than the pinned one keeps its own
+    download, with a warning.
+    """
+    from ricecooker import config
+    from ricecooker.classes import files
+    download = files.download
+    if getattr(download, "manifest", False):
+        return
+    try:
+        parameters = list(inspect.signature(download).parameters)
+    except (TypeError, ValueError):
+        parameters = None
+    if parameters != DOWNLOAD_PARAMETERS or not hasattr(files, "extract_path_ext") \
+            or not hasattr(config, "get_storage_path"):
+        LOGGER.warning("ricecooker's files.download{} isn't the one of the pinned version, "
+                       "the files are hashed by ricecooker".format(
+                           "({})".format(", ".join(parameters)) if parameters is not None else ""))
+        return
+
+    def manifest_download(path, default_ext=None):
+        md5 = known_md5(path)
+        if md5 is not None:
+            # the index can be older than the file, the disk has the last word
+            entry = FILE_INDEX.manifest.get(os.path.normpath(path))
+            md5 = entry["md5"] if entry is not None else None
+        if md5 is None:
+            return download(path, default_ext=default_ext)
+        filename = "{}.{}".format(md5, files.extract_path_ext(path, default_ext=default_ext))
+        storage_path = config.get_storage_path(filename)
+        if not os.path.isfile(storage_path) or os.path.getsize(storage_path) != os.path.getsize(path):
+            tmp_path = storage_path + ".tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, storage_path)
+        return filename
+    manifest_download.manifest = True
+    files.download = manifest_download
+
+
+def find_files(dirpath, pattern):
+    if FILE_INDEX is not None and FILE_INDEX.covers(dirpath):
+        return FILE_INDEX.find(dirpath, pattern)
+    if not os.path.isdir(dirpath):
+        return []
+    return [os.path.join(dirpath, name) for name in sorted(fnmatch.filter(os.listdir(dirpath), pattern))]
+
 
 def dir_exists(filepath):
+    if FILE_INDEX is not None and FILE_INDEX.covers(filepath):
+        return FILE_INDEX.has_dir(filepath)
     file_ = Path(filepath)
     return file_.is_dir()
 
 
 def file_exists(filepath):
+    if FILE_INDEX is not None and FILE_INDEX.covers(filepath):
+        return FILE_INDEX.has_file(filepath)
     my_file = Path(filepath)
     return my_file.is_file()
 
@@ -57,6 +175,7 @@ def get_name_from_url_no_ext(url):
 
 
 def clone_repo(git_url, repo_dir):
+    from git import Repo
     if not dir_exists(repo_dir):
         print("Cloning repository {}".format(git_url))
         Repo.clone_from(git_url, repo_dir)
@@ -69,8 +188,10 @@ def clone_repo(git_url, repo_dir):
 
 def build_path(levels):
     path = os.path.join(*levels)
-    if not dir_exists(path):
-        os.makedirs(path)
+    if FILE_INDEX is not None and FILE_INDEX.covers(path):
+        FILE_INDEX.make_dirs(path)
+    elif not dir_exists(path):
+        os.makedirs(path, exist_ok=True)
     return path
 
 
@@ -137,6 +258,7 @@ def save_response_content(response, destination):
 
 
 def link_to_text(content):
+    from bs4 import Tag
     if content is not None:
         for tag in content.find_all("a"):
             span = Tag(name="span")
@@ -150,6 +272,9 @@ def link_to_text(content):
 
 
 def save_thumbnail(url, title, data_dir):
+    saved = find_files(os.path.join(data_dir, "thumbnails"), "{}.*".format(title))
+    if saved:
+        return saved[0]
     try:
         r = requests.get(url)
     except:
@@ -162,5 +287,6 @@ def save_thumbnail(url, title, data_dir):
             base_dir = build_path([data_dir, "thumbnails"])
             filepath = os.path.join(base_dir, filename)
             with open(filepath, "wb") as f:
-                f.write(img_buffer.read())
+                f.write(r.content)
+            register_file(filepath, md5=hashlib.md5(r.content).hexdigest())
             return filepath
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+from manifest import Manifest
+
+
+LOGGER = logging.getLogger()
+
+MANIFEST_FILE = "manifest.json"
+CORRUPT_SUFFIX = ".corrupt"
+# generated by the chef itself or verified in their own way
+SKIP_DIRS = {"archive", "trees", "profiles"}
+SKIP_SUFFIXES = (".json", ".jsonl", ".tmp", ".part", CORRUPT_SUFFIX)
+HASH_CHUNK = 2097152
+# readers find the PDF header anywhere in the first 1024 bytes
+PDF_HEADER_WINDOW = 1024
+# how far from the end a trailer is looked for before it counts as suspect
+TRAILER_WINDOW = 1024
+
+
+class Suspect(str):
+    """
+    A finding valid files can have too (data after the end marker),
+    logged but the file is kept.
+    """
+
+
+def content_end(data):
+    # zero or 0xff padding after the end marker doesn't count
+    end = len(data)
+    while end > 0 and data[end - 1] in (0, 0xff):
+        end -= 1
+    return end
+
+
+def check_trailer(data, marker, name):
+    """
+    Checks that marker, the end of the format, ends the content: missing is
+    an error, followed by more than padding only a Suspect.
+    """
+    end = content_end(data)
+    if data.rfind(marker, max(0, end - TRAILER_WINDOW), len(data)) != -1:
+        return None
+    if data.rfind(marker) == -1:
+        return "missing {}".format(name)
+    return Suspect("data after the {}".format(name))
+
+
+def check_zip(data):
+    # the end of central directory record is in the last 64KB + 22 bytes
+    eocd = data.rfind(b"PK\x05\x06", max(0, len(data) - 65557))
+    if eocd == -1 or eocd + 22 > len(data):
+        return "missing end of central directory"
+    entries, cd_size, cd_offset = struct.unpack("<HII", data[eocd + 10:eocd + 20])
+    if cd_offset + cd_size > eocd:
+        return "central directory out of bounds"
+    position = cd_offset
+    for _ in range(entries):
+        if data[position:position + 4] != b"PK\x01\x02":
+            return "bad central directory entry"
+        name_len, extra_len, comment_len = struct.unpack("<HHH", data[position + 28:position + 34])
+        local_offset = struct.unpack("<I", data[position + 42:position + 46])[0]
+        if data[local_offset:local_offset + 4] != b"PK\x03\x04":
+            return "bad local header"
+        position += 46 + name_len + extra_len + comment_len
+    if position != cd_offset + cd_size:
+        return "central directory size mismatch"
+
+
+def check_pdf(data):
+    if data.find(b"%PDF-", 0, PDF_HEADER_WINDOW) == -1:
+        return "missing %PDF header"
+    # incremental updates append sections, each ending with its own %%EOF
+    return check_trailer(data, b"%%EOF", "%%EOF trailer")
+
+
+def check_jpeg(data):
+    if data[:3] != b"\xff\xd8\xff":
+        return "bad JPEG header"
+    # an EXIF thumbnail has an end marker of its own, without one at the end
+    # the image may be truncated or just have a trailer appended
+    return check_trailer(data, b"\xff\xd9", "JPEG end marker")
+
+
+def check_png(data):
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        return "bad PNG header"
+    return check_trailer(data, b"IEND", "PNG IEND chunk")
+
+
+def check_gif(data):
+    if data[:6] not in (b"GIF87a", b"GIF89a"):
+        return "bad GIF header"
+
+
+def check_webp(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return "bad WEBP header"
+    if struct.unpack("<I", data[4:8])[0] + 8 > len(data):
+        return "truncated WEBP"
+
+
+def check_mp4(data):
+    # the top level boxes must cover the file, up to zero padding
+    position = 0
+    end = content_end(data)
+    boxes = set()
+    while position < end:
+        if position + 8 > len(data):
+            return "truncated box header"
+        size, box_type = struct.unpack(">I4s", data[position:position + 8])
+        if size == 1:
+            if position + 16 > len(data):
+                return "truncated box header"
+            size = struct.unpack(">Q", data[position + 8:position + 16])[0]
+        elif size == 0:
+            size = len(data) - position
+        if size < 8 or position + size > len(data):
+            return "truncated {} box".format(box_type.decode("latin-1"))
+        boxes.add(box_type)
+        position += size
+    for required in (b"ftyp", b"moov"):
+        if required not in boxes:
+            return "missing {} box".format(required.decode("latin-1"))
+
+
+CHECKS = {
+    ".zip": check_zip,
+    ".pdf": check_pdf,
+    ".jpg": check_jpeg,
+    ".jpeg": check_jpeg,
+    ".png": check_png,
+    ".gif": check_gif,
+    ".webp": check_webp,
+    ".mp4": check_mp4,
+}
+
+
+def verify_file(path):
+    """
+    Returns (md5, error) of path, error is None for a valid file.
+    """
+    if os.path.getsize(path) == 0:
+        return None, "empty file"
+    check = CHECKS.get(os.path.splitext(path)[1].lower())
+    md5 = hashlib.md5()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        error = check(data) if check is not None else None
+        view = memoryview(data)
+        try:
+            for offset in range(0, len(data), HASH_CHUNK):
+                md5.update(view[offset:offset + HASH_CHUNK])
+        finally:
+            view.release()
+    return md5.hexdigest(), error
+
+
+def iter_files(data_dir):
+    for root, dirs, files in os.walk(data_dir):
+        if root == data_dir:
+            dirs[:] = [name for name in dirs if name not in SKIP_DIRS]
+        for name in files:
+            if not name.endswith(SKIP_SUFFIXES):
+                yield os.path.join(root, name)
+
+
+def verify(data_dir, workers=8, full=False, dry_run=False):
+    """
+    Verifies every artifact in data_dir and records its checksum in the
+    manifest. Bad files are renamed with a .corrupt suffix so the skip logic
+    of the next run downloads them again, suspect ones are only logged.
+    Files whose size and mtime match the manifest are not read again unless
+    full is True.
+    """
+    manifest = Manifest(os.path.join(data_dir, MANIFEST_FILE))
+    paths = [path for path in iter_files(data_dir)
+             if full or manifest.get(path) is None or manifest.get(path)["status"] != "ok"]
+
+    def run(path):
+        try:
+            return path, verify_file(path)
+        except (OSError, ValueError, struct.error) as e:
+            return path, (None, str(e))
+
+    bad = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, (md5, error) in executor.map(run, paths):
+            if isinstance(error, Suspect):
+                LOGGER.info("    - Suspect {}: {}, kept".format(path, error))
+                error = None
+            if error is None:
+                manifest.record(path, md5)
+                continue
+            LOGGER.info("    - Corrupt {}: {}".format(path, error))
+            bad.append((path, error))
+            manifest.remove(path)
+            if not dry_run:
+                os.replace(path, path + CORRUPT_SUFFIX)
+    manifest.save()
+    LOGGER.info("Verified {} files, {} corrupt".format(len(paths), len(bad)))
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the artifacts in chefdata")
+    parser.add_argument("--data-dir", default="chefdata")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--full", action="store_true", help="verify files already in the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="report bad files without renaming them")
+    args = parser.parse_args()
+    bad = verify(args.data_dir, workers=args.workers, full=args.full, dry_run=args.dry_run)
+    for path, error in bad:
+        print("{}: {}".format(path, error))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import urllib.parse as urlparse
+
+from manifest import md5_file
+
+
+def youtube_id(url):
+    parsed = urlparse.urlparse(url)
+    if parsed.netloc.endswith("youtu.be"):
+        return parsed.path.strip("/").split("/")[0] or None
+    return urlparse.parse_qs(parsed.query).get("v", [None])[0]
+
+
+class VideoStore(object):
+    """
+    Channel wide store of downloaded videos keyed by YouTube id. Every id is
+    downloaded once into data_dir/videos, concurrent requests for an id that
+    is being downloaded wait for that download instead of starting another.
+    """
+    INFO_FIELDS = ("id", "title", "width", "height", "subtitles")
+
+    def __init__(self, data_dir):
+        self.base_path = os.path.join(data_dir, "videos")
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.infos = {}
+        self.downloads = 0
+        self.reused = 0
+
+    def video_path(self, video_id):
+        return os.path.join(self.base_path, "{}.mp4".format(video_id))
+
+    def info_path(self, video_id):
+        return os.path.join(self.base_path, "{}.json".format(video_id))
+
+    def load_info(self, video_id):
+        video_path = self.video_path(video_id)
+        if not os.path.isfile(video_path) or os.path.getsize(video_path) == 0:
+            return None
+        try:
+            with open(self.info_path(video_id)) as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            return None
+        stat = os.stat(video_path)
+        if (info.get("size"), info.get("mtime")) != (stat.st_size, stat.st_mtime):
+            # the video was replaced since it was hashed
+            info = self.save_info(video_id, info)
+        return info
+
+    def save_info(self, video_id, info):
+        info = {field: info.get(field) for field in VideoStore.INFO_FIELDS}
+        if info["subtitles"] is not None:
+            # the languages, not youtube_dl's formats of each
+            info["subtitles"] = sorted(info["subtitles"])
+        # hashed once after the download, the upload reads it from here
+        video_path = self.video_path(video_id)
+        if os.path.isfile(video_path):
+            stat = os.stat(video_path)
+            info.update(md5=md5_file(video_path), size=stat.st_size, mtime=stat.st_mtime)
+        with open(self.info_path(video_id), "w") as f:
+            json.dump(info, f, ensure_ascii=False)
+        return info
+
+    def set_subtitles(self, video_id, languages):
+        """
+        Adds the subtitle languages to an info saved before they were kept.
+        """
+        with self.lock:
+            info = self.infos.get(video_id)
+            if info is None:
+                return
+            info["subtitles"] = sorted(languages)
+            with open(self.info_path(video_id), "w") as f:
+                json.dump(info, f, ensure_ascii=False)
+
+    def get(self, video_id, fetch):
+        """
+        Returns the info of video_id, calling fetch(download_to) only if no
+        other caller has downloaded it or is downloading it right now.
+        """
+        with self.lock:
+            if video_id in self.infos:
+                self.reused += 1
+                return self.infos[video_id]
+            event = self.in_flight.get(video_id)
+            owner = event is None
+            if owner:
+                event = self.in_flight[video_id] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self.lock:
+                self.reused += 1
+                return self.infos.get(video_id)
+
+        info = None
+        try:
+            info = self.load_info(video_id)
+            if info is None:
+                os.makedirs(self.base_path, exist_ok=True)
+                info = fetch(self.base_path)
+                if info is not None:
+                    info = self.save_info(video_id, info)
+                    with self.lock:
+                        self.downloads += 1
+            else:
+                with self.lock:
+                    self.reused += 1
+        finally:
+            with self.lock:
+                if info is not None:
+                    self.infos[video_id] = info
+                del self.in_flight[video_id]
+            event.set()
+        return info
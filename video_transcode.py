@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import argparse
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+import logging
+import os
+import subprocess
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+TRANSCODE_PROFILES = {
+    "low": dict(height=360, video_bitrate="250k", audio_bitrate="48k"),
+    "medium": dict(height=480, video_bitrate="500k", audio_bitrate="64k"),
+    "high": dict(height=720, video_bitrate="1000k", audio_bitrate="96k"),
+}
+
+
+def transcoded_path(data_dir, video_id, profile):
+    return os.path.join(data_dir, "transcoded", profile, "{}.mp4".format(video_id))
+
+
+def source_kept_path(dst):
+    # marks a video whose transcode wasn't smaller, the source is used as is
+    return os.path.splitext(dst)[0] + ".source"
+
+
+def transcode(src, dst, profile, ffmpeg="ffmpeg", on_start=None):
+    settings = TRANSCODE_PROFILES[profile]
+    bufsize = "{}k".format(int(settings["video_bitrate"][:-1]) * 2)
+    tmp_path = dst + ".part.mp4"
+    cmd = [ffmpeg, "-y", "-loglevel", "error", "-i", src,
+           # never upscale, keep the width even for libx264
+           "-vf", "scale=-2:'min({},ih)'".format(settings["height"]),
+           "-c:v", "libx264", "-preset", "medium", "-b:v", settings["video_bitrate"],
+           "-maxrate", settings["video_bitrate"], "-bufsize", bufsize,
+           "-c:a", "aac", "-b:a", settings["audio_bitrate"],
+           "-movflags", "+faststart", tmp_path]
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if on_start is not None:
+            on_start(process)
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    except (subprocess.CalledProcessError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dst)
+    return dst
+
+
+class TranscodePool(object):
+    """
+    Runs ffmpeg transcodes in a pool of workers, the outputs are cached
+    in data_dir/transcoded/<profile>/<video_id>.mp4 across runs. A video
+    the transcode doesn't shrink keeps its source, and only a marker is
+    cached for it.
+    """
+    def __init__(self, profile, data_dir, workers=2, ffmpeg="ffmpeg"):
+        if profile not in TRANSCODE_PROFILES:
+            raise ValueError("Unknown transcode profile: {}".format(profile))
+        self.profile = profile
+        self.data_dir = data_dir
+        self.ffmpeg = ffmpeg
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}
+        # source path -> video id, resolve_tree finds the jobs of a tree's videos
+        self.sources = {}
+        # video id -> running ffmpeg, killed when its job is cancelled
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.saved_bytes = 0
+
+    def run(self, video_id, src):
+        dst = transcoded_path(self.data_dir, video_id, self.profile)
+        if os.path.isfile(dst):
+            return dst
+        source_kept = source_kept_path(dst)
+        if os.path.isfile(source_kept):
+            return src
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        LOGGER.info("    + Transcoding {} to {}".format(video_id, self.profile))
+
+        def started(process):
+            with self.lock:
+                self.processes[video_id] = process
+        try:
+            transcode(src, dst, self.profile, ffmpeg=self.ffmpeg, on_start=started)
+        finally:
+            with self.lock:
+                self.processes.pop(video_id, None)
+        if os.path.getsize(dst) >= os.path.getsize(src):
+            # the source is already small enough, no second full size copy of it
+            os.remove(dst)
+            open(source_kept, "w").close()
+            return src
+        with self.lock:
+            self.saved_bytes += os.path.getsize(src) - os.path.getsize(dst)
+        return dst
+
+    def submit(self, video_id, src):
+        with self.lock:
+            if video_id not in self.jobs or self.jobs[video_id].cancelled():
+                self.jobs[video_id] = self.executor.submit(self.run, video_id, src)
+                self.sources[src] = video_id
+            return self.jobs[video_id]
+
+    def result(self, video_id, src, deadline=None):
+        """
+        Waits for the transcode of video_id until deadline (a time.time()
+        value), falls back to src if ffmpeg failed or didn't finish in time.
+        """
+        future = self.submit(video_id, src)
+        try:
+            return future.result(timeout=None if deadline is None else max(0, deadline - time.time()))
+        except (TimeoutError, CancelledError):
+            LOGGER.info("    + Transcode of {} not done in time, the source is kept".format(video_id))
+            self.cancel(video_id)
+            return src
+        except (subprocess.CalledProcessError, OSError) as e:
+            LOGGER.info("    + Transcode failed for {}: {}".format(video_id, e))
+            return src
+
+    def cancel(self, video_id):
+        """
+        Drops the job of video_id if it didn't start, kills its ffmpeg if it did.
+        """
+        with self.lock:
+            future = self.jobs.get(video_id)
+            process = self.processes.get(video_id)
+        if future is not None:
+            future.cancel()
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def resolve_tree(self, node, deadline=None):
+        """
+        Points the video files of node and its children submitted for
+        transcoding at their transcoded output, waiting for the jobs still
+        running until deadline. Returns the paths that changed.
+        """
+        changed = []
+        for file_dict in node.get("files", []):
+            with self.lock:
+                video_id = self.sources.get(file_dict.get("path"))
+            if video_id is not None:
+                path = self.result(video_id, file_dict["path"], deadline=deadline)
+                if path != file_dict["path"]:
+                    file_dict["path"] = path
+                    changed.append(path)
+        for child in node.get("children", []):
+            changed.extend(self.resolve_tree(child, deadline=deadline))
+        return changed
+
+    def shutdown(self, cancel=False):
+        """
+        Waits for the jobs left, or with cancel drops and kills them.
+        """
+        if cancel:
+            with self.lock:
+                video_ids = list(self.jobs)
+            for video_id in video_ids:
+                self.cancel(video_id)
+        self.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode local mp4 files with a chef profile")
+    parser.add_argument("files", nargs="+", help="mp4 files, the file name is used as the video id")
+    parser.add_argument("--profile", default="low", choices=sorted(TRANSCODE_PROFILES))
+    parser.add_argument("--data-dir", default="chefdata")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    pool = TranscodePool(args.profile, args.data_dir, workers=args.workers)
+    for path in args.files:
+        pool.submit(os.path.splitext(os.path.basename(path))[0], path)
+    for path in args.files:
+        video_id = os.path.splitext(os.path.basename(path))[0]
+        dst = pool.result(video_id, path)
+        print("{}: {} -> {} bytes".format(path, os.path.getsize(path), os.path.getsize(dst)))
+    pool.shutdown()
+    print("Saved {} bytes".format(pool.saved_bytes))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+DEFAULT_EXTRACTOR = "video_worker:youtube_dl_extract"
+INFO_FIELDS = ("id", "title", "width", "height", "ext", "duration")
+PROGRESS_INTERVAL = 1.0
+
+
+class VideoJobError(Exception):
+    pass
+
+
+def youtube_dl_extract(url, download_to, options, progress):
+    """
+    With the list_subtitles option a download also lists the subtitles of
+    the video: youtube_dl only extracts them when asked to write them, so
+    the extraction asks and the download, which would write them, doesn't.
+    """
+    import youtube_dl
+    options = dict(options, progress_hooks=[lambda status: progress(status.get("downloaded_bytes"))])
+    if options.pop("list_subtitles", False) and download_to is not None:
+        with youtube_dl.YoutubeDL(dict(options, writesubtitles=True)) as ydl:
+            ydl.add_default_info_extractors()
+            info = ydl.extract_info(url, download=False, process=False)
+        with youtube_dl.YoutubeDL(options) as ydl:
+            return ydl.process_ie_result(info, download=True)
+    with youtube_dl.YoutubeDL(options) as ydl:
+        ydl.add_default_info_extractors()
+        return ydl.extract_info(url, download=download_to is not None)
+
+
+def fake_extract(url, download_to, options, progress):
+    """
+    Stand-in for youtube_dl, fake://<behaviour>/<id> urls pick what it does:
+    ok, error, crash, hang (no progress at all), slow (progress forever)
+    and flaky (hangs the first time, then ok).
+    """
+    behaviour, video_id = url[len("fake://"):].split("/", 1)
+    if behaviour == "flaky":
+        marker = os.path.join(download_to or ".", "{}.flaky".format(video_id))
+        behaviour = "ok" if os.path.exists(marker) else "hang"
+        open(marker, "w").close()
+    if behaviour == "error":
+        raise ValueError("video {} is not available".format(video_id))
+    if behaviour == "crash":
+        os._exit(3)
+    if behaviour == "hang":
+        time.sleep(3600)
+    if behaviour == "slow":
+        done = 0
+        while True:
+            done += 1024
+            progress(done)
+            time.sleep(0.1)
+    if download_to is not None:
+        with open(os.path.join(download_to, "{}.mp4".format(video_id)), "wb") as f:
+            for chunk in range(8):
+                f.write(b"\0" * 1024)
+                progress((chunk + 1) * 1024)
+    return dict(id=video_id, title="Fake video {}".format(video_id), width=640, height=360)
+
+
+def load_extractor(name):
+    module_name, _, function_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def trim_info(info):
+    """
+    Keeps what the chef reads from youtube_dl's info, it goes through a pipe.
+    """
+    trimmed = {field: info.get(field) for field in INFO_FIELDS}
+    if info.get("subtitles") is not None:
+        trimmed["subtitles"] = {language: [] for language in info["subtitles"]}
+    if info.get("entries") is not None:
+        trimmed["entries"] = [dict(id=entry.get("id"), title=entry.get("title"))
+                              for entry in info["entries"] if entry]
+    return trimmed
+
+
+def worker_main():
+    """
+    Child side: reads a job as json from stdin and writes json lines on
+    stdout, progress while downloading, then info or error.
+    """
+    job = json.loads(sys.stdin.read())
+    # youtube_dl and ffmpeg write to stdout, only the protocol goes there
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def emit(**message):
+        protocol.write(json.dumps(message, default=str) + "\n")
+
+    last_progress = [0]
+
+    def progress(done):
+        now = time.monotonic()
+        if now - last_progress[0] >= PROGRESS_INTERVAL:
+            last_progress[0] = now
+            emit(progress=done)
+
+    try:
+        info = load_extractor(job["extractor"])(job["url"], job["download_to"], job["options"], progress)
+    except Exception as e:
+        emit(error="{}: {}".format(type(e).__name__, e))
+        return 1
+    emit(info=trim_info(info) if info is not None else None)
+    return 0
+
+
+class VideoWorkerPool(object):
+    """
+    Runs video extractions and downloads in child processes, at most workers
+    at a time. A child is killed when it runs longer than timeout seconds or
+    reports no download progress for stall_timeout seconds, or if it dies,
+    and the job is queued again up to attempts times. Errors raised by the
+    extractor itself are not retried here.
+    """
+    def __init__(self, workers=2, timeout=3600, stall_timeout=300, attempts=2,
+                 extractor=DEFAULT_EXTRACTOR, python=sys.executable):
+        self.slots = threading.BoundedSemaphore(workers)
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.attempts = attempts
+        self.extractor = extractor
+        self.python = python
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.killed = 0
+
+    def run(self, url, download_to=None, options=None):
+        """
+        Returns the trimmed info of url, raises VideoJobError when every
+        attempt failed.
+        """
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            with self.slots:
+                info, error, retry = self.run_once(url, download_to, options or {})
+            if error is None:
+                return info
+            if not retry:
+                break
+            if attempt < self.attempts:
+                LOGGER.info("    + Video job {} {}, requeued ({}/{})".format(url, error, attempt, self.attempts))
+            else:
+                LOGGER.info("    + Video job {} {}, giving up after {} attempts".format(url, error, attempt))
+        raise VideoJobError(error)
+
+    def run_once(self, url, download_to, options):
+        """
+        Returns (info, error, retry).
+        """
+        with self.lock:
+            self.jobs += 1
+        job = dict(url=url, download_to=download_to, options=options, extractor=self.extractor)
+        # its own session, a kill takes ffmpeg children with it
+        proc = subprocess.Popen([self.python, os.path.abspath(__file__), "--worker"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                start_new_session=True, universal_newlines=True)
+        lines = queue.Queue()
+        reader = threading.Thread(target=self.read_lines, args=(proc.stdout, lines), daemon=True)
+        reader.start()
+        proc.stdin.write(json.dumps(job))
+        proc.stdin.close()
+
+        started = last_progress = time.monotonic()
+        message = {}
+        while True:
+            wait = min(started + self.timeout, last_progress + self.stall_timeout) - time.monotonic()
+            try:
+                line = lines.get(timeout=max(0, wait))
+            except queue.Empty:
+                now = time.monotonic()
+                hung = "timed out after {:.0f}s".format(now - started) \
+                    if now - started >= self.timeout else \
+                    "stalled for {:.0f}s".format(now - last_progress)
+                self.kill(proc)
+                return None, hung, True
+            if line is None:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "progress" in message:
+                last_progress = time.monotonic()
+            elif "info" in message or "error" in message:
+                break
+        try:
+            code = proc.wait(timeout=self.stall_timeout)
+        except subprocess.TimeoutExpired:
+            # answered but doesn't exit
+            self.kill(proc)
+            code = proc.returncode
+        if "info" in message:
+            return message["info"], None, False
+        if "error" in message:
+            return None, message["error"], False
+        return None, "worker exited with code {}".format(code), True
+
+    def read_lines(self, stream, lines):
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    def kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            proc.kill()
+        proc.wait()
+        with self.lock:
+            self.killed += 1
+
+    def report(self):
+        return "Video jobs: {} run, {} killed".format(self.jobs, self.killed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run video jobs in supervised worker processes")
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--extractor", default=DEFAULT_EXTRACTOR,
+                        help="module:function, video_worker:fake_extract takes fake://<behaviour>/<id> urls")
+    parser.add_argument("--download-to", default=None)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--stall-timeout", type=float, default=300)
+    parser.add_argument("--attempts", type=int, default=2)
+    args = parser.parse_args()
+    if args.worker:
+        sys.exit(worker_main())
+
+    pool = VideoWorkerPool(workers=args.workers, timeout=args.timeout, stall_timeout=args.stall_timeout,
+                           attempts=args.attempts, extractor=args.extractor)
+
+    def run(url):
+        try:
+            print("{}: {}".format(url, pool.run(url, download_to=args.download_to)))
+        except VideoJobError as e:
+            print("{}: failed, {}".format(url, e))
+    threads = [threading.Thread(target=run, args=(url,)) for url in args.urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(pool.report())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
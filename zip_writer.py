@@ -0,0 +1,165 @@
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+
+
+# zip can't store dates before 1980, any fixed value keeps the output stable
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_COMPRESS_LEVEL = 6
+# deflating these again costs CPU and saves next to nothing
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4",
+                     ".pdf", ".zip", ".woff", ".woff2"}
+
+
+class CompressionStats(object):
+    def __init__(self):
+        self.modes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, mode, raw_size, stored_size, cpu_time):
+        with self.lock:
+            stats = self.modes.setdefault(mode, dict(entries=0, raw=0, stored=0, cpu=0.0))
+            stats["entries"] += 1
+            stats["raw"] += raw_size
+            stats["stored"] += stored_size
+            stats["cpu"] += cpu_time
+
+    def report(self):
+        lines = []
+        for mode, stats in self.modes.items():
+            lines.append("{}: {} entries, {} -> {} bytes ({} saved), {:.2f}s CPU".format(
+                mode, stats["entries"], stats["raw"], stats["stored"],
+                stats["raw"] - stats["stored"], stats["cpu"]))
+        return lines
+
+
+COMPRESSION_STATS = CompressionStats()
+
+
+class CompressionPolicy(object):
+    """
+    Chooses how each zip entry is compressed: already compressed media is
+    stored as is and text is deflated with text_level.
+    """
+    def __init__(self, text_level=ZIP_COMPRESS_LEVEL, store_media=True,
+                 max_image_width=None, image_quality=None):
+        self.text_level = text_level
+        self.store_media = store_media
+        self.max_image_width = max_image_width
+        self.image_quality = image_quality
+
+    def for_entry(self, name):
+        ext = os.path.splitext(name)[1].lower()
+        if self.store_media and ext in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED, None, "stored"
+        return zipfile.ZIP_DEFLATED, self.text_level, "deflate-{}".format(self.text_level)
+
+    def optimize_image(self, content, stats=COMPRESSION_STATS):
+        """
+        Downscales images wider than max_image_width and re-encodes JPEGs with
+        image_quality, the original bytes are kept if the result isn't smaller.
+        """
+        if not self.max_image_width and not self.image_quality:
+            return content
+        try:
+            from PIL import Image
+        except ImportError:
+            return content
+        start = time.process_time()
+        try:
+            img = Image.open(BytesIO(content))
+            img_format = img.format
+            if img_format not in ("JPEG", "PNG"):
+                return content
+            if self.max_image_width and img.width > self.max_image_width:
+                height = int(img.height * self.max_image_width / float(img.width))
+                img = img.resize((self.max_image_width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            if img_format == "JPEG":
+                img.save(buffer, format="JPEG", quality=self.image_quality or 85, optimize=True)
+            else:
+                img.save(buffer, format="PNG", optimize=True)
+            optimized = buffer.getvalue()
+        except (IOError, OSError, ValueError):
+            return content
+        if len(optimized) >= len(content):
+            return content
+        stats.add("image-recompress", len(content), len(optimized), time.process_time() - start)
+        return optimized
+
+
+DEFAULT_POLICY = CompressionPolicy()
+
+
+class ReproducibleZipWriter(object):
+    """
+    Drop-in for html_writer.HTMLWriter that collects the entries in memory and
+    writes them sorted, with fixed timestamps and permissions, so the same
+    content always produces the same zip bytes.
+    """
+    def __init__(self, filepath, policy=DEFAULT_POLICY, stats=COMPRESSION_STATS):
+        self.filepath = filepath
+        self.policy = policy
+        self.stats = stats
+        self.entries = {}
+        self.changed = None
+        self.md5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write_contents(self, filename, content, directory=""):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.entries[directory + filename] = content
+
+    def write_index_contents(self, content):
+        self.write_contents("index.html", content)
+
+    def zipinfo(self, name, compress_type):
+        info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+        info.compress_type = compress_type
+        info.create_system = 3
+        info.external_attr = 0o644 << 16
+        return info
+
+    def to_bytes(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            for name in sorted(self.entries):
+                compress_type, level, mode = self.policy.for_entry(name)
+                start = time.process_time()
+                zf.writestr(self.zipinfo(name, compress_type), self.entries[name],
+                            compresslevel=level)
+                self.stats.add(mode, len(self.entries[name]),
+                               zf.getinfo(name).compress_size, time.process_time() - start)
+        return buffer.getvalue()
+
+    def close(self):
+        """
+        Writes the zip unless the file on disk already has the same bytes,
+        so unchanged articles keep their mtime and hash.
+        """
+        data = self.to_bytes()
+        self.md5 = hashlib.md5(data).hexdigest()
+        if os.path.isfile(self.filepath) and os.path.getsize(self.filepath) == len(data):
+            with open(self.filepath, "rb") as f:
+                if f.read() == data:
+                    self.changed = False
+                    return self.changed
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.filepath) or ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.filepath)
+        self.changed = True
+        return self.changed